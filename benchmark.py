@@ -0,0 +1,200 @@
+# Benchmarks the endpoints in process against synthetic data, and fails when they regress against a
+# stored baseline. Run `python benchmark.py --help` for the available options.
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+
+@dataclass(frozen=True)
+class BenchmarkCase:
+    name: str
+    url: str
+    headers: Optional[Dict[str, str]] = None
+    # module the endpoint needs that is not a dependency of the api, the case is skipped without it
+    requires: Optional[str] = None
+
+
+CASES: List[BenchmarkCase] = [
+    BenchmarkCase("variables", "/variables"),
+    BenchmarkCase("proxies", "/proxies"),
+    BenchmarkCase("proxies-filtered", "/proxies?n=70&s=30&start=-130&stop=-60&type=Tree%20Rings&fields=id&fields=lat&fields=lon&limit=200"),
+    BenchmarkCase("timeseries-point", "/variables/psl/timeseries?lat=-70&lon=-100"),
+    BenchmarkCase("timeseries-point-window", "/variables/tas/timeseries?lat=10&lon=20&startYear=1950&endYear=2000&move_reference=false"),
+    BenchmarkCase("timeseries-area", "/variables/psl/timeseries-area?n=-60&s=-80&start=170&stop=-62"),
+    BenchmarkCase("timeseries-area-small", "/variables/u10/timeseries-area?n=-10&s=-20&start=-162&stop=-150"),
+    BenchmarkCase("timeseries-batch", "/variables/psl/timeseries-batch?point=-70,-100&point=10,20&point=45,-120&point=0,0"),
+    BenchmarkCase("trend-full", "/variables/psl/trend/cesm"),
+    BenchmarkCase("trend-1950-2000", "/variables/psl/trend/cesm?startYear=1950&endYear=2000"),
+    BenchmarkCase("trend-1979-2005", "/variables/tas/trend/lens?startYear=1979&endYear=2005"),
+    BenchmarkCase("trend-annual", "/variables/psl/trend/hadcm3?startYear=1990&endYear=1990&move_reference=true"),
+    BenchmarkCase("trend-binary", "/variables/psl/trend/pace?startYear=1950&endYear=2000", {"Accept": "application/vnd.pv.grid"}),
+    BenchmarkCase("trend-overview", "/variables/tas/trend/lens?startYear=1979&endYear=2005&level=2"),
+    BenchmarkCase("trend-box", "/variables/tas/trend/lens?startYear=1979&endYear=2005&n=-60&s=-80&start=170&stop=-62"),
+    BenchmarkCase("annual-stream", "/variables/psl/annual/hadcm3?startYear=1950&endYear=2000&move_reference=true"),
+    BenchmarkCase("annual-stream-binary", "/variables/psl/annual/lens?startYear=1950&endYear=2000", {"Accept": "application/vnd.pv.grid-stream; quantize=int16"}),
+    BenchmarkCase("trend-series", "/variables/psl/trend-series?window=30&lat=-70&lon=-100"),
+    BenchmarkCase("trend-series-area", "/variables/tas/trend-series?window=20&n=-60&s=-80&start=170&stop=-62"),
+    BenchmarkCase("correlation", "/variables/psl/correlation/cesm?startYear=1950&endYear=2000"),
+    BenchmarkCase("download-timeseries-csv", "/variables/psl/timeseries?lat=-70&lon=-100&download=csv"),
+    BenchmarkCase("download-timeseries-mat", "/variables/psl/timeseries?lat=-70&lon=-100&download=mat"),
+    BenchmarkCase("download-timeseries-xls", "/variables/psl/timeseries-area?download=xls", requires="openpyxl"),
+    BenchmarkCase("download-trend-full", "/variables/psl/trend/hadcm3?download=full"),
+    BenchmarkCase("download-trend-partial", "/variables/psl/trend/hadcm3?startYear=1950&endYear=2000&download=partial"),
+    BenchmarkCase("download-trend-trend", "/variables/psl/trend/cesm?startYear=1950&endYear=2000&download=trend"),
+]
+
+
+def percentile(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q))
+
+
+def run_case(client, case: BenchmarkCase, iterations: int) -> dict:
+    """
+    Times one endpoint: its first request, then iterations more for the latency percentiles, then
+    one more under tracemalloc for its peak and retained memory. Latencies are in milliseconds.
+    """
+    def request():
+        response = client.get(case.url, headers=case.headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"{case.name}: {case.url} returned {response.status_code} {response.text[:200]}")
+        return response
+
+    started = time.perf_counter()
+    size = len(request().content)
+    first = (time.perf_counter() - started) * 1000
+
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        request()
+        samples.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    request()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "firstMs": round(first, 3),
+        "p50Ms": round(percentile(samples, 50), 3),
+        "p95Ms": round(percentile(samples, 95), 3),
+        "p99Ms": round(percentile(samples, 99), 3),
+        "meanMs": round(float(np.mean(samples)), 3),
+        "peakBytes": peak - before,
+        "retainedBytes": after - before,
+        "responseBytes": size,
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float, tail_tolerance: float,
+            memory_tolerance: float, min_ms: float) -> List[str]:
+    """
+    Returns a description of every metric that is worse than the baseline by more than its
+    tolerance. Latencies must also be worse by at least min_ms, so very fast cases do not fail on
+    timer noise.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for metric, allowed in (("p50Ms", tolerance), ("p95Ms", tail_tolerance)):
+            if result[metric] > expected[metric] * (1 + allowed) and result[metric] - expected[metric] > min_ms:
+                regressions.append(f"{name} {metric}: {result[metric]:.2f} ms, baseline {expected[metric]:.2f} ms")
+        if result["peakBytes"] > expected["peakBytes"] * (1 + memory_tolerance) and result["peakBytes"] - expected["peakBytes"] > 1024 * 1024:
+            regressions.append(f"{name} peakBytes: {result['peakBytes']}, baseline {expected['peakBytes']}")
+    return regressions
+
+
+def print_table(results: Dict[str, dict], baseline: Dict[str, dict]):
+    print(f"{'case':<26}{'first':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'base p50':>10}{'peak MB':>10}{'kept MB':>10}")
+    for name, result in results.items():
+        base = baseline.get(name, {}).get("p50Ms")
+        print(f"{name:<26}{result['firstMs']:>10.2f}{result['p50Ms']:>10.2f}{result['p95Ms']:>10.2f}{result['p99Ms']:>10.2f}"
+              f"{base if base is not None else float('nan'):>10.2f}{result['peakBytes'] / 1e6:>10.2f}{result['retainedBytes'] / 1e6:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the api endpoints against synthetic data.")
+    parser.add_argument("--root", default="benchmark-data", help="directory holding the data folder, synthetic stores are generated there if it has none")
+    parser.add_argument("--scale", type=float, default=0.5, help="grid scale of generated stores, see synthetic.py")
+    parser.add_argument("--iterations", type=int, default=20, help="timed requests per case after the first")
+    parser.add_argument("--cases", nargs="*", help="only run these cases")
+    parser.add_argument("--result-cache", action="store_true", help="keep the result cache on, so repeated requests measure cache hits")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results as the new baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed p50 latency regression as a fraction of the baseline")
+    parser.add_argument("--tail-tolerance", type=float, default=1.0, help="allowed p95 latency regression as a fraction of the baseline")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25, help="allowed peak memory regression as a fraction of the baseline")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="latency regressions smaller than this are ignored")
+    arguments = parser.parse_args()
+
+    # settings are read when the api modules are imported, so configure them first
+    if not arguments.result_cache:
+        os.environ["PV_RESULT_CACHE_MB"] = "0"
+        os.environ.pop("PV_RESULT_CACHE_DIR", None)
+    # the proxy table is not synthetic, read the one next to this file
+    os.environ.setdefault("PV_PROXIES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "proxies.pkl"))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs(arguments.root, exist_ok=True)
+    os.chdir(arguments.root)
+
+    import synthetic
+    if not synthetic.all_stores_exist():
+        synthetic.generate(arguments.scale)
+
+    from fastapi.testclient import TestClient
+    started = time.perf_counter()
+    import main as api
+    print(f"startup {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    cases = [case for case in CASES if not arguments.cases or case.name in arguments.cases]
+    for case in cases:
+        if case.requires and importlib.util.find_spec(case.requires) is None:
+            print(f"skipping {case.name}, {case.requires} is not installed")
+    cases = [case for case in cases if not case.requires or importlib.util.find_spec(case.requires) is not None]
+    results = {}
+    with TestClient(api.app) as client:
+        for case in cases:
+            results[case.name] = run_case(client, case, arguments.iterations)
+
+    baseline = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)["cases"]
+    print_table(results, baseline)
+
+    if arguments.update_baseline:
+        with open(arguments.baseline, "w") as file:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "scale": arguments.scale,
+                "iterations": arguments.iterations,
+                "cases": {**baseline, **results},
+            }, file, indent=2)
+        print(f"Wrote baseline {arguments.baseline}")
+        return
+
+    regressions = compare(results, baseline, arguments.tolerance, arguments.tail_tolerance, arguments.memory_tolerance, arguments.min_ms)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print("No regressions" if baseline else f"No baseline at {arguments.baseline}, run with --update-baseline to write one")
+
+
+if __name__ == "__main__":
+    main()
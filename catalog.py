@@ -0,0 +1,70 @@
+# immutable responses built once at startup, and the etag helpers used for every response
+import hashlib
+from typing import Dict, Optional
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+from data import Dataset, VariableMetadata
+from json_encoder import dumps
+from util import generate_color_axis
+
+
+def etag(body: bytes) -> str:
+    """
+    Returns a strong entity tag for a response body, derived from a hash of its content.
+    """
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    """
+    Checks an If-None-Match header against the entity tag of a response, using the weak
+    comparison the header calls for.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tag = tag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in if_none_match.split(","))
+
+
+class ETagJSONResponse(JSONResponse):
+    """
+    JSON response that stamps a content hash entity tag on itself, so clients can revalidate
+    computed responses with If-None-Match. Content may hold numpy arrays, which are serialized
+    directly rather than walked one scalar at a time.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.headers.setdefault("etag", etag(self.body))
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+class ResponseCatalog:
+    """
+    Responses that cannot change while the process is running, rendered once along with their
+    entity tags: the color axis of every color map used by a variable, and the variables/datasets
+    listing.
+    """
+
+    def __init__(self, variables: Dict[str, VariableMetadata], datasets: Dict[str, Dataset]):
+        self._color_axes = {variable.colorMap: generate_color_axis(variable.colorMap) for variable in variables.values()}
+        # rendered the same way FastAPI renders a returned dict, so the bytes do not change
+        self._variables = JSONResponse(jsonable_encoder({
+            "variables": list(variables.values()),
+            "datasets": list(datasets.values()),
+        })).body
+        self._variables_etag = etag(self._variables)
+
+    def color_axis(self, colormap_name: str) -> list:
+        if colormap_name not in self._color_axes:
+            self._color_axes[colormap_name] = generate_color_axis(colormap_name)
+        return self._color_axes[colormap_name]
+
+    def variables(self) -> Response:
+        return Response(self._variables, media_type="application/json", headers={"ETag": self._variables_etag})
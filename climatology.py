@@ -0,0 +1,47 @@
+# reference period climatologies used to move anomalies to a common reference period
+from typing import Iterable, Tuple
+
+import xarray as xr
+
+from lru import SizedLRU
+from manifest import store_versions
+from registry import registry
+from settings import CLIMATOLOGY_CACHE_BYTES, REFERENCE_PERIOD
+from timing import stage
+
+
+class ClimatologyCache:
+    """
+    Keeps the time mean of each store over a reference period in memory, keyed by the store and
+    the period, so the mean is only ever computed once per process.
+
+    :param max_bytes: The memory budget of the cache in bytes.
+    """
+
+    def __init__(self, max_bytes: int = CLIMATOLOGY_CACHE_BYTES):
+        self._climatologies = SizedLRU(max_bytes)
+
+    def get(self, path: str, period: Tuple[int, int] = REFERENCE_PERIOD, level: int = 0) -> xr.Dataset:
+        """
+        Returns the climatology of a store over a reference period.
+
+        :param path: The path of the .nc file as listed in data_sets.py.
+        :param period: The first and last year of the reference period.
+        :param level: The pyramid level of the store, 0 is the full grid.
+        """
+        def create():
+            with stage("climatology"):
+                climatology = registry.open(path, level=level).sel(time=slice(*period)).mean(dim='time').load()
+            return climatology, climatology.nbytes
+        key = (path, tuple(period), level, store_versions.get(path))
+        return self._climatologies.get_or_create(key, create)
+
+    def precompute(self, paths: Iterable[str], period: Tuple[int, int] = REFERENCE_PERIOD):
+        for path in paths:
+            self.get(path, period)
+
+    def stats(self) -> dict:
+        return self._climatologies.stats()
+
+
+climatologies = ClimatologyCache()
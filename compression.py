@@ -0,0 +1,142 @@
+# gzip and brotli content encoding of responses, negotiated from Accept-Encoding. Brotli is only
+# offered when the brotli package is installed
+import zlib
+from typing import AsyncIterator, Hashable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from lru import SizedLRU
+from settings import COMPRESSION_CACHE_BYTES
+from timing import stage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# media types worth compressing, by prefix. The binary grid encodings are already dense, and
+# downloads like netCDF and mat files are left alone
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/x-ndjson")
+
+# levels for streamed bodies, which are compressed on every request. Higher levels cost several
+# times the time for a few percent on float heavy text
+GZIP_LEVEL = 1
+BROTLI_QUALITY = 1
+
+# levels for cached bodies, which are compressed once and sent many times
+CACHED_GZIP_LEVEL = 9
+CACHED_BROTLI_QUALITY = 9
+
+
+def supported_encodings() -> tuple:
+    # in order of preference when a client accepts several equally
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Returns the content encoding to use for an Accept-Encoding header, the supported one with
+    the highest quality value, or None to send the body as it is.
+    """
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(","):
+        name, _, parameters = item.partition(";")
+        quality = 1.0
+        parameter, _, value = parameters.partition("=")
+        if parameter.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in supported_encodings():
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def is_compressible(media_type: Optional[str]) -> bool:
+    return media_type is not None and media_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """
+    Compresses a whole body at the cached levels.
+    """
+    if encoding == "br":
+        return brotli.compress(body, quality=CACHED_BROTLI_QUALITY)
+    compressor = zlib.compressobj(CACHED_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+class StreamCompressor:
+    """
+    Compresses a body a chunk at a time, flushing after every chunk so each one can be decoded
+    as soon as it arrives, which keeps streamed responses streaming.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+async def compress_stream(body: AsyncIterator, encoding: str) -> AsyncIterator[bytes]:
+    """
+    Compresses an async iterator of body chunks, as StreamingResponse bodies are, off the event
+    loop.
+    """
+    compressor = StreamCompressor(encoding)
+    async for chunk in body:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        compressed = await run_in_threadpool(compressor.compress, chunk)
+        if compressed:
+            yield compressed
+    yield compressor.finish()
+
+
+class CompressedBodies:
+    """
+    Keeps compressed copies of deterministic response bodies, keyed by their entity tag, which is
+    a hash of their content, and the encoding. Least recently used first out under its memory
+    budget, so a popular response is only ever compressed once.
+
+    :param max_bytes: The memory budget of the cache in bytes.
+    """
+
+    def __init__(self, max_bytes: int = COMPRESSION_CACHE_BYTES):
+        self._bodies = SizedLRU(max_bytes)
+
+    def compress(self, tag: Hashable, encoding: str, body: bytes) -> bytes:
+        """
+        Returns the compressed body of a response, compressing it only the first time its tag and
+        encoding are seen.
+        """
+        def create():
+            with stage("compress"):
+                compressed = compress(body, encoding)
+            return compressed, len(compressed)
+        return self._bodies.get_or_create((tag, encoding), create)
+
+    def stats(self) -> dict:
+        return self._bodies.stats()
+
+
+compressed_bodies = CompressedBodies()
@@ -0,0 +1,21 @@
+import os
+
+import pytest
+from synthetic import generate
+
+@pytest.fixture(scope="session")
+def stores(tmp_path_factory):
+    # main opens the stores listed in data_sets.py relative to the working directory, so the
+    # session moves into a directory of small synthetic ones before main is imported
+    root = tmp_path_factory.mktemp("stores")
+    cwd = os.getcwd()
+    os.chdir(root)
+    os.symlink(os.path.join(cwd, "proxies.pkl"), "proxies.pkl")
+    generate(scale=0.05)
+    yield root
+    os.chdir(cwd)
+
+@pytest.fixture(scope="session")
+def main(stores):
+    import main
+    return main
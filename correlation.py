@@ -0,0 +1,67 @@
+# vectorized pearson correlations between reconstructions and the instrumental record
+from typing import Tuple
+
+import numpy as np
+import xarray as xr
+from scipy.special import stdtr
+
+
+def align(time_a: np.ndarray, time_b: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the indices into each time axis of the times both share, in ascending order.
+    """
+    _, index_a, index_b = np.intersect1d(time_a, time_b, return_indices=True)
+    return index_a, index_b
+
+
+def pearson(x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the pearson correlation coefficient and its two sided p value between x and y along
+    their first axis, for every series along the remaining axes at once. Pairs where either value
+    is missing are skipped, series with fewer than three valid pairs or no variance get NaN.
+
+    :param x: Array with time along its first axis.
+    :param y: Array with time along its first axis, broadcastable against x.
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+    valid = ~(np.isnan(x) | np.isnan(y))
+    n = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_anomaly = np.where(valid, x - np.where(valid, x, 0).sum(axis=0) / n, 0)
+        y_anomaly = np.where(valid, y - np.where(valid, y, 0).sum(axis=0) / n, 0)
+        r = (x_anomaly * y_anomaly).sum(axis=0) / np.sqrt((x_anomaly ** 2).sum(axis=0) * (y_anomaly ** 2).sum(axis=0))
+        r = np.clip(r, -1, 1)
+        degrees_of_freedom = n - 2
+        t = r * np.sqrt(degrees_of_freedom / (1 - r ** 2))
+        p_value = 2 * stdtr(degrees_of_freedom, -np.abs(t))
+    p_value = np.where(np.abs(r) == 1, 0.0, p_value)
+    enough = n >= 3
+    return np.where(enough, r, np.nan), np.where(enough, p_value, np.nan)
+
+
+def correlation_map(reconstruction: xr.DataArray, instrumental: xr.DataArray, startYear: int = None,
+                    endYear: int = None) -> Tuple[xr.DataArray, xr.DataArray]:
+    """
+    Correlates every grid cell of a reconstruction with the instrumental record at the nearest
+    instrumental grid cell, over the years both cover inside an optional window.
+
+    :param reconstruction: Data array with dimensions time, lat and lon.
+    :param instrumental: Data array with dimensions time, lat and lon, on any grid.
+    :return: Maps of the correlation coefficient and its p value on the reconstruction grid, NaN
+        where fewer than three years are shared.
+    """
+    if startYear is not None and endYear is not None:
+        reconstruction = reconstruction.sel(time=slice(startYear, endYear))
+        instrumental = instrumental.sel(time=slice(startYear, endYear))
+    reconstruction = reconstruction.transpose("time", "lat", "lon")
+    instrumental = instrumental.sel(lat=reconstruction["lat"], lon=reconstruction["lon"], method="nearest")
+    instrumental = instrumental.transpose("time", "lat", "lon")
+    reconstruction_index, instrumental_index = align(reconstruction["time"].values, instrumental["time"].values)
+    r, p_value = pearson(
+        reconstruction.isel(time=reconstruction_index).values,
+        instrumental.isel(time=instrumental_index).values,
+    )
+    # built from the grid alone, a window without any reconstruction years has no time to drop
+    template = xr.DataArray(np.empty(r.shape), dims=("lat", "lon"), coords={
+        "lat": reconstruction["lat"], "lon": reconstruction["lon"]}, name=reconstruction.name)
+    return template.copy(data=r), template.copy(data=p_value)
@@ -1,9 +1,29 @@
 from enum import Enum
-import xarray as xr
+import atexit
+import io
+import os
+import shutil
 import tempfile
-from fastapi.responses import FileResponse
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, Hashable, Iterator
+from urllib.parse import quote
+
+import xarray as xr
+from fastapi.responses import FileResponse, Response, StreamingResponse
 import pandas as pd
 from scipy.io import savemat
+from starlette.background import BackgroundTask
+
+from lru import SizedLRU
+from settings import DOWNLOAD_CACHE_BYTES, DOWNLOAD_CACHE_DIR
+from timing import stage
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
 
 
 class DownloadMode(str, Enum):
@@ -16,37 +36,194 @@ class TimeseriesDownload(str, Enum):
     csv = "csv"
     xls = "xls"
 
+# number of rows rendered per chunk when streaming csv downloads
+CSV_CHUNK_ROWS = 2048
+
+# headers a file response sets itself from the file it sends
+FILE_HEADERS = ("content-length", "content-type", "etag", "last-modified")
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@dataclass(frozen=True)
+class Artifact:
+    path: str
+    media_type: str
+    headers: Dict[str, str]
+
+
+class ArtifactCache:
+    """
+    Keeps finished download files on disk, keyed by request, least recently used first out once
+    their total size goes over the budget, and counts the bytes rendered for each format. Files
+    live in a directory of their own that is removed when the process exits.
+
+    :param max_bytes: The disk budget of the cache in bytes, 0 keeps nothing.
+    :param parent: The directory to create the cache directory in, the system temporary
+        directory if None.
+    """
+
+    def __init__(self, max_bytes: int = DOWNLOAD_CACHE_BYTES, parent: str = DOWNLOAD_CACHE_DIR):
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix="pv-downloads-", dir=parent)
+        atexit.register(shutil.rmtree, self.directory, True)
+        self._artifacts = SizedLRU(max_bytes, on_evict=lambda key, artifact: _remove(artifact.path))
+        self._written: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def temporary_path(self, suffix: str) -> str:
+        """
+        Returns a new empty file in the cache directory, for a download to be written to.
+        """
+        file_descriptor, path = tempfile.mkstemp(suffix=suffix, dir=self.directory)
+        os.close(file_descriptor)
+        return path
+
+    def record(self, file_format: str, nbytes: int):
+        """
+        Adds the size of a rendered download to the bytes written for its format.
+        """
+        with self._lock:
+            self._written[file_format] = self._written.get(file_format, 0) + nbytes
+
+    def _artifact_path(self) -> str:
+        return os.path.join(self.directory, f"{uuid.uuid4().hex}.artifact")
+
+    def _keep(self, key: Hashable, path: str, response: Response):
+        headers = {name: value for name, value in response.headers.items() if name not in FILE_HEADERS}
+        artifact = Artifact(path, response.media_type or response.headers.get("content-type"), headers)
+        self._artifacts.put(key, artifact, os.path.getsize(path))
+
+    def _serve(self, artifact: Artifact) -> Response:
+        # each response sends its own link to the file, so evicting the artifact while it is
+        # being sent does not cut the response short
+        link = self._artifact_path() + ".sending"
+        os.link(artifact.path, link)
+        return FileResponse(link, media_type=artifact.media_type, headers=artifact.headers, background=BackgroundTask(_remove, link))
+
+    async def _tee(self, key: Hashable, response: StreamingResponse, body: AsyncIterator) -> AsyncIterator[bytes]:
+        # the file is only kept once the whole body has been sent
+        path = self._artifact_path()
+        complete = False
+        try:
+            with open(path, "wb") as file:
+                async for chunk in body:
+                    file.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if complete:
+                self._keep(key, path, response)
+            else:
+                _remove(path)
+
+    def response(self, key: Hashable, compute: Callable, *args) -> Response:
+        """
+        Returns the cached download for a key, or the download compute(*args) returns, keeping a
+        copy of its file once it is finished.
+
+        :param key: The normalized parameters, format and store versions of the request.
+        :param compute: The blocking function building the download response.
+        """
+        artifact = self._artifacts.get(key)
+        if artifact is not None:
+            try:
+                return self._serve(artifact)
+            except FileNotFoundError:
+                pass
+        result = compute(*args)
+        if isinstance(result, FileResponse):
+            path = self._artifact_path()
+            os.link(result.path, path)
+            self._keep(key, path, result)
+        elif isinstance(result, StreamingResponse):
+            result.body_iterator = self._tee(key, result, result.body_iterator)
+        elif isinstance(result, Response):
+            path = self._artifact_path()
+            with open(path, "wb") as file:
+                file.write(result.body)
+            self._keep(key, path, result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            written = dict(self._written)
+        return {**self._artifacts.stats(), "bytesWritten": written}
+
+
+downloads = ArtifactCache()
+
+def attachment_headers(filename: str) -> dict:
+    """
+    Returns the Content-Disposition header that makes the browser save a response as a file.
+    """
+    filename = filename.replace(' ', '_')
+    quoted = quote(filename)
+    if quoted != filename:
+        return {"Content-Disposition": f"attachment; filename*=utf-8''{quoted}"}
+    return {"Content-Disposition": f'attachment; filename="{filename}"'}
+
 def netCDF_download(data: xr.Dataset, name: str) -> FileResponse:
-    temp = tempfile.NamedTemporaryFile(suffix='nc',delete=False)
-    data.to_netcdf(temp.name)
+    # netCDF needs a real file to write to, it is streamed from disk then removed once sent
+    path = downloads.temporary_path('.nc')
+    try:
+        with stage("download"):
+            data.to_netcdf(path)
+    except BaseException:
+        os.remove(path)
+        raise
+    downloads.record("nc", os.path.getsize(path))
     return FileResponse(
-        temp.name,
+        path,
         media_type='application/netcdf',
-        filename=f"{name}.nc".replace(' ','_')
+        filename=f"{name}.nc".replace(' ','_'),
+        background=BackgroundTask(_remove, path)
     )
 
-def dataframe_download(data_frame: pd.DataFrame,download:TimeseriesDownload,  name: str) -> FileResponse:
-    temp = tempfile.NamedTemporaryFile(suffix=download,delete=False)
+def csv_chunks(data_frame: pd.DataFrame) -> Iterator[str]:
+    """
+    Renders a data frame as csv a block of rows at a time, so the response can start before the
+    whole file has been built.
+    """
+    written = 0
+    for start in range(0, max(len(data_frame), 1), CSV_CHUNK_ROWS):
+        chunk = data_frame.iloc[start:start + CSV_CHUNK_ROWS].to_csv(index=False, header=start == 0)
+        written += len(chunk.encode("utf-8"))
+        yield chunk
+    downloads.record("csv", written)
+
+def dataframe_download(data_frame: pd.DataFrame,download:TimeseriesDownload,  name: str) -> Response:
     match download:
         case TimeseriesDownload.csv:
-            data_frame.to_csv(temp, index=False)
-            return FileResponse(
-                temp.name,
+            return StreamingResponse(
+                csv_chunks(data_frame),
                 media_type='text/csv',
-                filename=f"{name}.csv".replace(' ','_')
+                headers=attachment_headers(f"{name}.csv")
             )
         case TimeseriesDownload.mat:
+            buffer = io.BytesIO()
             mat_dict = {'data': data_frame.to_records(index=False)}
-            savemat(temp.name, mat_dict)
-            return FileResponse(
-                temp.name,
+            with stage("download"):
+                savemat(buffer, mat_dict)
+            downloads.record("mat", buffer.tell())
+            return Response(
+                buffer.getvalue(),
                 media_type='application/x-matlab-data',
-                filename=f"{name}.mat".replace(' ','_')
+                headers=attachment_headers(f"{name}.mat")
             )
         case TimeseriesDownload.xls:
-            data_frame.to_excel(temp, index=False)
-            return FileResponse(
-                temp.name,
+            buffer = io.BytesIO()
+            with stage("download"):
+                # xlsxwriter writes a sheet several times faster than openpyxl, the pandas default
+                data_frame.to_excel(buffer, index=False, engine="xlsxwriter" if xlsxwriter is not None else None)
+            downloads.record("xls", buffer.tell())
+            return Response(
+                buffer.getvalue(),
                 media_type='application/vnd.ms-excel',
-                filename=f"{name}.xls".replace(' ','_')
-            )
\ No newline at end of file
+                headers=attachment_headers(f"{name}.xls")
+            )
@@ -0,0 +1,116 @@
+# runs blocking xarray work off the event loop, with per endpoint limits and request coalescing
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional
+
+from settings import COMPUTE_LIMITS
+from timing import record
+
+
+class EndpointPool:
+    """
+    A bounded thread pool for one endpoint, which keeps count of the work waiting for and running
+    on its threads.
+
+    :param name: The name of the endpoint, used to name the threads.
+    :param limit: How many requests of this endpoint may compute at the same time.
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.limit = limit
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.coalesced = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"compute-{name}")
+
+    def submit(self, loop: asyncio.AbstractEventLoop, function: Callable, *args) -> asyncio.Future:
+        submitted = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+
+        def work():
+            waited = time.perf_counter() - submitted
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            record("queue", waited)
+            try:
+                return function(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        # run in a copy of the caller's context, so the work reports to the request's timings
+        return loop.run_in_executor(self._executor, contextvars.copy_context().run, work)
+
+    def stats(self) -> dict:
+        started = self.completed + self.running
+        return {
+            "limit": self.limit,
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "coalesced": self.coalesced,
+            "waitSecondsMean": round(self.wait_seconds_total / started, 6) if started else None,
+            "waitSecondsMax": round(self.wait_seconds_max, 6),
+        }
+
+
+class ComputeExecutor:
+    """
+    Runs the blocking part of requests on bounded per endpoint thread pools so the event loop
+    stays free, and lets identical requests that arrive while one is already computing share its
+    result instead of computing it again.
+
+    :param limits: How many requests of each endpoint may compute at the same time, endpoints that
+        are not listed get the "default" limit.
+    """
+
+    def __init__(self, limits: Dict[str, int] = COMPUTE_LIMITS):
+        self._limits = limits
+        self._pools: Dict[str, EndpointPool] = {}
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    def pool(self, endpoint: str) -> EndpointPool:
+        if endpoint not in self._pools:
+            self._pools[endpoint] = EndpointPool(endpoint, self._limits.get(endpoint, self._limits["default"]))
+        return self._pools[endpoint]
+
+    async def run(self, endpoint: str, key: Optional[Hashable], function: Callable, *args):
+        """
+        Runs function(*args) on the pool of an endpoint and returns its result.
+
+        :param endpoint: The name of the endpoint the work belongs to.
+        :param key: The normalized parameters of the request, requests with the same key share one
+            computation while it is in flight. None never coalesces, for results that cannot be
+            shared such as streamed downloads.
+        :param function: The blocking function to run.
+        """
+        pool = self.pool(endpoint)
+        if key is not None:
+            key = (endpoint, key)
+            if key in self._in_flight:
+                pool.coalesced += 1
+                return await asyncio.shield(self._in_flight[key])
+        future = pool.submit(asyncio.get_running_loop(), function, *args)
+        if key is not None:
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # shielded so a client disconnecting does not cancel work other requests are waiting on
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        return {endpoint: pool.stats() for endpoint, pool in self._pools.items()}
+
+
+compute = ComputeExecutor()
@@ -0,0 +1,293 @@
+"""
+Compact binary encoding for lat/lon grid responses, such as the trend maps.
+
+Clients opt in by sending ``Accept: application/vnd.pv.grid``, and may add the parameter
+``quantize=int16`` to receive 16 bit quantized values instead of float32. All numbers are little
+endian, and the payload is laid out as follows.
+
+======  ==========  =========================================================================
+offset  size        field
+======  ==========  =========================================================================
+0       4           magic bytes ``PVG1``
+4       1           value type, 1 for float32 and 2 for int16
+5       3           reserved, always zero
+8       4           uint32 number of latitudes, nlat
+12      4           uint32 number of longitudes, nlon
+16      8           float64 scale
+24      8           float64 offset
+32      4           uint32 length in bytes of the JSON metadata, m
+36      m           UTF-8 JSON metadata (bound, variable, name, colorMap), padded with spaces to
+                    a multiple of 4 bytes, m includes the padding
+36+m    4*nlat      float32 latitudes
+        4*nlon      float32 longitudes (-180 to 180)
+        nlat*nlon   values, one row of nlon values per latitude, 4 bytes each for float32 and
+                    2 bytes each for int16
+======  ==========  =========================================================================
+
+float32 values are sent as is, with a scale of 1 and an offset of 0, and NaN for missing cells.
+int16 values decode to ``value * scale + offset``, with -32768 marking missing cells.
+
+Sequences of grids on the same axes, such as the annual maps of a range of years, are streamed as
+``application/vnd.pv.grid-stream`` (with the same ``quantize`` parameter). The stream is a series
+of messages, each a uint32 byte length followed by the message. The first message is the header,
+sent once, and every message after it is the frame of one grid.
+
+======  ==========  =========================================================================
+offset  size        header field
+======  ==========  =========================================================================
+0       4           magic bytes ``PVS1``
+4       4           uint32 number of latitudes, nlat
+8       4           uint32 number of longitudes, nlon
+12      4           uint32 length in bytes of the JSON metadata, m, padded as above
+16      m           UTF-8 JSON metadata
+16+m    4*nlat      float32 latitudes
+        4*nlon      float32 longitudes (-180 to 180)
+======  ==========  =========================================================================
+
+======  ==========  =========================================================================
+offset  size        frame field
+======  ==========  =========================================================================
+0       4           magic bytes ``PVF1``
+4       1           value type, 1 for float32 and 2 for int16
+5       1           flags, bit 0 set when the values are a delta from the previous frame
+6       2           reserved, always zero
+8       4           int32 year
+12      8           float64 scale
+20      8           float64 offset
+28      8           float64 bound of the color scale of this frame
+36      ...         nlat*nlon values, laid out and decoded as in a grid
+======  ==========  =========================================================================
+
+Values are decoded to float64 first. A delta frame then adds them to the previous decoded frame,
+reading its missing cells as 0. Deltas are taken from what the client decoded rather than from
+the exact values, so quantization errors never add up over a stream.
+"""
+import json
+import struct
+from enum import Enum
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+MEDIA_TYPE = "application/vnd.pv.grid"
+MAGIC = b"PVG1"
+HEADER = struct.Struct("<4sB3xIIddI")
+MISSING_INT16 = -32768
+
+STREAM_MEDIA_TYPE = "application/vnd.pv.grid-stream"
+STREAM_MAGIC = b"PVS1"
+STREAM_HEADER = struct.Struct("<4sIII")
+FRAME_MAGIC = b"PVF1"
+FRAME_HEADER = struct.Struct("<4sBB2xiddd")
+FRAME_DELTA = 1
+LENGTH = struct.Struct("<I")
+
+
+class GridEncoding(int, Enum):
+    float32 = 1
+    int16 = 2
+
+
+def negotiate(accept: Optional[str], binary_media_type: str = MEDIA_TYPE) -> Optional[GridEncoding]:
+    """
+    Returns the binary encoding requested by an Accept header, or None if the client did not ask
+    for one and should get JSON.
+
+    :param binary_media_type: The binary media type the response can be sent as.
+    """
+    if not accept:
+        return None
+    for media_range in accept.split(","):
+        media_type, *parameters = [part.strip() for part in media_range.split(";")]
+        if media_type.lower() != binary_media_type:
+            continue
+        options = {}
+        for parameter in parameters:
+            key, _, value = parameter.partition("=")
+            options[key.strip().lower()] = value.strip().lower()
+        try:
+            quality = float(options.get("q", 1))
+        except ValueError:
+            quality = 0.0
+        # q=0 means the client does not accept the binary type at all
+        if quality <= 0:
+            continue
+        return GridEncoding.int16 if options.get("quantize") == "int16" else GridEncoding.float32
+    return None
+
+
+def quantize(values: np.ndarray) -> Tuple[np.ndarray, float, float]:
+    """
+    Quantizes values to int16 over their finite range, returning the quantized values along with
+    the scale and offset needed to decode them.
+    """
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return np.full(values.shape, MISSING_INT16, dtype="<i2"), 1.0, 0.0
+    low, high = float(finite.min()), float(finite.max())
+    offset = (high + low) / 2
+    scale = (high - low) / 65534 if high > low else 1.0
+    with np.errstate(invalid="ignore"):
+        quantized = np.rint((values - offset) / scale)
+    quantized = np.where(np.isfinite(quantized), quantized, MISSING_INT16).astype("<i2")
+    return quantized, scale, offset
+
+
+def _metadata_bytes(metadata: dict) -> bytes:
+    metadata_bytes = json.dumps(metadata, separators=(",", ":")).encode()
+    return metadata_bytes + b" " * (-len(metadata_bytes) % 4)
+
+
+def _message(payload: bytes) -> bytes:
+    return LENGTH.pack(len(payload)) + payload
+
+
+def encode_grid(lats: np.ndarray, lons: np.ndarray, values: np.ndarray, metadata: dict,
+                encoding: GridEncoding = GridEncoding.float32) -> bytes:
+    """
+    Encodes a grid as described in the module docstring.
+
+    :param lats: The latitude of each row of values.
+    :param lons: The longitude of each column of values.
+    :param values: 2-D array of values with shape (len(lats), len(lons)).
+    :param metadata: JSON serializable fields describing the grid.
+    :param encoding: The type values are sent as.
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(len(lats), len(lons))
+    if encoding == GridEncoding.int16:
+        encoded, scale, offset = quantize(values)
+    else:
+        encoded, scale, offset = values.astype("<f4"), 1.0, 0.0
+    metadata_bytes = _metadata_bytes(metadata)
+    return b"".join((
+        HEADER.pack(MAGIC, encoding.value, len(lats), len(lons), scale, offset, len(metadata_bytes)),
+        metadata_bytes,
+        np.asarray(lats, dtype="<f4").tobytes(),
+        np.asarray(lons, dtype="<f4").tobytes(),
+        encoded.tobytes(),
+    ))
+
+
+def decode_grid(payload: bytes) -> Tuple[dict, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Decodes a payload made by encode_grid, returning its metadata, latitudes, longitudes and 2-D
+    float values, with NaN for missing cells.
+    """
+    magic, value_type, nlat, nlon, scale, offset, metadata_length = HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise ValueError("Not a grid payload.")
+    position = HEADER.size
+    metadata = json.loads(payload[position:position + metadata_length])
+    position += metadata_length
+    lats = np.frombuffer(payload, dtype="<f4", count=nlat, offset=position)
+    position += 4 * nlat
+    lons = np.frombuffer(payload, dtype="<f4", count=nlon, offset=position)
+    position += 4 * nlon
+    if GridEncoding(value_type) == GridEncoding.int16:
+        quantized = np.frombuffer(payload, dtype="<i2", count=nlat * nlon, offset=position)
+        values = np.where(quantized == MISSING_INT16, np.nan, quantized * scale + offset)
+    else:
+        values = np.frombuffer(payload, dtype="<f4", count=nlat * nlon, offset=position).astype(np.float64)
+    return metadata, lats, lons, values.reshape(nlat, nlon)
+
+
+class FrameEncoder:
+    """
+    Turns a sequence of grids into the values sent for each frame of a stream, keeping the frame
+    the client will have decoded last so deltas are taken from it.
+
+    :param encoding: The binary type values are sent as, or None for JSON, where they are sent as
+        float64.
+    :param delta: Send every frame after the first as its difference from the previous one.
+    """
+
+    def __init__(self, encoding: Optional[GridEncoding], delta: bool = False):
+        self.encoding = encoding
+        self.delta = delta
+        self._previous: Optional[np.ndarray] = None
+
+    def encode(self, values: np.ndarray) -> Tuple[np.ndarray, float, float, bool]:
+        """
+        Returns the values to send for the next grid, their scale and offset, and whether they are
+        a delta.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        is_delta = self.delta and self._previous is not None
+        base = np.nan_to_num(self._previous, nan=0.0) if is_delta else 0.0
+        sent = values - base
+        if self.encoding == GridEncoding.int16:
+            encoded, scale, offset = quantize(sent)
+            decoded = np.where(encoded == MISSING_INT16, np.nan, encoded * scale + offset)
+        elif self.encoding == GridEncoding.float32:
+            encoded, scale, offset = sent.astype("<f4"), 1.0, 0.0
+            decoded = encoded.astype(np.float64)
+        else:
+            encoded, scale, offset = sent, 1.0, 0.0
+            decoded = sent
+        self._previous = base + decoded
+        return encoded, scale, offset, is_delta
+
+
+def encode_stream_header(lats: np.ndarray, lons: np.ndarray, metadata: dict) -> bytes:
+    """
+    Encodes the header message of a grid stream, as described in the module docstring.
+    """
+    metadata_bytes = _metadata_bytes(metadata)
+    return _message(b"".join((
+        STREAM_HEADER.pack(STREAM_MAGIC, len(lats), len(lons), len(metadata_bytes)),
+        metadata_bytes,
+        np.asarray(lats, dtype="<f4").tobytes(),
+        np.asarray(lons, dtype="<f4").tobytes(),
+    )))
+
+
+def encode_frame(encoder: FrameEncoder, year: int, bound: float, values: np.ndarray) -> bytes:
+    """
+    Encodes the frame message of one grid of a stream, with values shaped (nlat, nlon).
+
+    :param encoder: The encoder of the stream, which must have a binary encoding.
+    """
+    encoded, scale, offset, is_delta = encoder.encode(values)
+    flags = FRAME_DELTA if is_delta else 0
+    return _message(FRAME_HEADER.pack(FRAME_MAGIC, encoder.encoding.value, flags, year, scale, offset, bound) + encoded.tobytes())
+
+
+def decode_stream(payload: bytes) -> Tuple[dict, np.ndarray, np.ndarray, List[Tuple[int, float, np.ndarray]]]:
+    """
+    Decodes a whole grid stream, returning its metadata, latitudes, longitudes and every frame as
+    its year, bound and 2-D float values with deltas applied.
+    """
+    def messages() -> Iterator[bytes]:
+        position = 0
+        while position < len(payload):
+            (length,) = LENGTH.unpack_from(payload, position)
+            yield payload[position + LENGTH.size:position + LENGTH.size + length]
+            position += LENGTH.size + length
+
+    messages = messages()
+    header = next(messages)
+    magic, nlat, nlon, metadata_length = STREAM_HEADER.unpack_from(header)
+    if magic != STREAM_MAGIC:
+        raise ValueError("Not a grid stream.")
+    position = STREAM_HEADER.size
+    metadata = json.loads(header[position:position + metadata_length])
+    position += metadata_length
+    lats = np.frombuffer(header, dtype="<f4", count=nlat, offset=position)
+    lons = np.frombuffer(header, dtype="<f4", count=nlon, offset=position + 4 * nlat)
+
+    frames = []
+    previous = None
+    for frame in messages:
+        magic, value_type, flags, year, scale, offset, bound = FRAME_HEADER.unpack_from(frame)
+        if magic != FRAME_MAGIC:
+            raise ValueError("Not a grid stream frame.")
+        if GridEncoding(value_type) == GridEncoding.int16:
+            quantized = np.frombuffer(frame, dtype="<i2", count=nlat * nlon, offset=FRAME_HEADER.size)
+            values = np.where(quantized == MISSING_INT16, np.nan, quantized * scale + offset)
+        else:
+            values = np.frombuffer(frame, dtype="<f4", count=nlat * nlon, offset=FRAME_HEADER.size).astype(np.float64)
+        if flags & FRAME_DELTA:
+            values = np.nan_to_num(previous, nan=0.0) + values
+        previous = values
+        frames.append((year, bound, values.reshape(nlat, nlon)))
+    return metadata, lats, lons, frames
@@ -0,0 +1,161 @@
+# Converts every .nc file listed in data_sets.py to the zarr stores the api reads, then writes the
+# store manifest. Run `python ingest.py --help` for the available options.
+import argparse
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import List, Optional
+
+import xarray as xr
+from zarr.codecs import BloscCodec, GzipCodec, ZstdCodec
+
+from data_sets import datasets, instrumental
+from manifest import write_manifest
+from pyramid import LEVEL_FACTOR, coarsen, level_suffix
+from registry import SERIES_SUFFIX
+from settings import PYRAMID_LEVELS
+
+
+@dataclass(frozen=True)
+class IngestOptions:
+    """
+    How the stores are written.
+
+    :param compression: The compressor for data variables, one of zstd, blosc, gzip or none.
+    :param level: The compression level.
+    :param float32: Downcast float64 data variables to float32.
+    :param map_time_chunk: Years per chunk in the map layout, each chunk holds the whole grid.
+    :param series_space_chunk: Grid cells per side of a chunk in the timeseries layout, each
+        chunk holds the whole time axis.
+    """
+    compression: str = "zstd"
+    level: int = 3
+    float32: bool = False
+    map_time_chunk: int = 1
+    series_space_chunk: int = 8
+
+
+@dataclass
+class IngestResult:
+    path: str
+    map_bytes: int
+    series_bytes: int
+    seconds: float
+
+
+def compressors(options: IngestOptions) -> list:
+    match options.compression:
+        case "zstd":
+            return [ZstdCodec(level=options.level)]
+        case "blosc":
+            return [BloscCodec(cname="lz4", clevel=options.level, shuffle="shuffle")]
+        case "gzip":
+            return [GzipCodec(level=options.level)]
+        case "none":
+            return []
+    raise ValueError(f"Unknown compression {options.compression}.")
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(directory, name)) for directory, _, files in os.walk(path) for name in files)
+
+
+def write_layout(dataset: xr.Dataset, store: str, chunks: dict, options: IngestOptions):
+    chunks = {dim: min(size, dataset.sizes[dim]) if size > 0 else dataset.sizes[dim] for dim, size in chunks.items() if dim in dataset.dims}
+    encoding = {}
+    for name, variable in dataset.data_vars.items():
+        encoding[name] = {
+            "chunks": tuple(chunks.get(dim, dataset.sizes[dim]) for dim in variable.dims),
+            "compressors": compressors(options),
+        }
+    # write next to the old store and swap it in, so a failed conversion never leaves half a store
+    temporary_store = store + ".tmp"
+    shutil.rmtree(temporary_store, ignore_errors=True)
+    dataset.to_zarr(temporary_store, mode="w", encoding=encoding)
+    shutil.rmtree(store, ignore_errors=True)
+    os.replace(temporary_store, store)
+
+
+def write_pyramid(dataset: xr.Dataset, path: str, options: IngestOptions, levels: int = PYRAMID_LEVELS):
+    """
+    Writes the coarser levels of a store in the map layout, level n averaging blocks of 2^n by 2^n
+    cells of the full grid (path.l1.zarr, path.l2.zarr and so on).
+    """
+    dataset = dataset.load()
+    for level in range(1, levels + 1):
+        coarse = coarsen(dataset, LEVEL_FACTOR ** level)
+        write_layout(coarse, path + level_suffix(level), {"time": options.map_time_chunk, "lat": -1, "lon": -1}, options)
+
+
+def convert(path: str, options: IngestOptions) -> IngestResult:
+    """
+    Converts one .nc file to its two zarr layouts and the coarser levels of its map layout. The map
+    layout (path.zarr) keeps whole grids together for trend and annual maps, and the timeseries
+    layout (path.ts.zarr) keeps the whole time axis of a small block of cells together for the
+    point and area timeseries.
+
+    :param path: The path of the .nc file as listed in data_sets.py.
+    :param options: How the stores are written.
+    """
+    started = time.perf_counter()
+    dataset = xr.open_dataset(path)
+    for variable in dataset.variables.values():
+        variable.encoding = {}
+    if options.float32:
+        dataset = dataset.assign({name: variable.astype("float32") for name, variable in dataset.data_vars.items() if variable.dtype == "float64"})
+    write_layout(dataset, path + ".zarr", {"time": options.map_time_chunk, "lat": -1, "lon": -1}, options)
+    write_layout(dataset, path + SERIES_SUFFIX, {"time": -1, "lat": options.series_space_chunk, "lon": options.series_space_chunk}, options)
+    write_pyramid(dataset, path, options)
+    dataset.close()
+    return IngestResult(path, directory_size(path + ".zarr"), directory_size(path + SERIES_SUFFIX), time.perf_counter() - started)
+
+
+def all_paths() -> List[str]:
+    return [path for dataset in [*datasets.values(), instrumental] for path in dataset.variables.values()]
+
+
+def ingest(paths: List[str], options: IngestOptions, workers: Optional[int] = None) -> List[IngestResult]:
+    """
+    Converts .nc files in parallel across processes, reporting each store as it finishes.
+    """
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(convert, path, options): path for path in paths}
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(f"{result.path}: map {result.map_bytes / 1e6:.1f} MB, timeseries {result.series_bytes / 1e6:.1f} MB, {result.seconds:.1f} s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the .nc files in data_sets.py to zarr stores.")
+    parser.add_argument("paths", nargs="*", help="only convert these .nc files, defaults to every file in data_sets.py")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, defaults to the number of cpus")
+    parser.add_argument("--compression", choices=["zstd", "blosc", "gzip", "none"], default="zstd")
+    parser.add_argument("--level", type=int, default=3, help="compression level")
+    parser.add_argument("--float32", action="store_true", help="downcast float64 data to float32")
+    parser.add_argument("--map-time-chunk", type=int, default=1, help="years per chunk of the map layout")
+    parser.add_argument("--series-space-chunk", type=int, default=8, help="cells per side of a chunk of the timeseries layout")
+    parser.add_argument("--no-manifest", action="store_true", help="do not rewrite data/manifest.json")
+    arguments = parser.parse_args()
+
+    options = IngestOptions(
+        compression=arguments.compression,
+        level=arguments.level,
+        float32=arguments.float32,
+        map_time_chunk=arguments.map_time_chunk,
+        series_space_chunk=arguments.series_space_chunk,
+    )
+    started = time.perf_counter()
+    results = ingest(arguments.paths or all_paths(), options, arguments.workers)
+    total = sum(result.map_bytes + result.series_bytes for result in results)
+    print(f"Converted {len(results)} files, {total / 1e6:.1f} MB in {time.perf_counter() - started:.1f} s")
+    if not arguments.no_manifest:
+        write_manifest(all_paths())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# numpy aware json serialization for responses, using orjson when it is installed
+import json
+from typing import Any
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default(value: Any) -> Any:
+    """
+    Converts what json cannot serialize natively. Arrays become lists in one call instead of one
+    numpy scalar at a time, missing values become null, and anything else goes through FastAPI's
+    encoder.
+    """
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == "f" and np.isnan(value).any():
+            return np.where(np.isnan(value), None, value).tolist()
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return jsonable_encoder(value)
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Serializes a response body the way Starlette's JSONResponse does, except that numpy arrays and
+    scalars can appear anywhere in it.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, default=default, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,125 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class SizedLRU:
+    """
+    A thread safe least recently used cache bounded by the total size of its entries rather than
+    their count. Entries report their own size in bytes when they are stored, and the least
+    recently used entries are evicted until the cache fits inside its budget again.
+
+    :param max_bytes: The memory budget of the cache in bytes.
+    :param on_evict: Called with the key and value of every entry that is evicted, replaced,
+        cleared or too big to keep, for values that hold something outside the cache such as a
+        file.
+    """
+
+    def __init__(self, max_bytes: int, on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: dict = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable):
+        return key in self._entries
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, size: int):
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                replaced, replaced_size = self._entries.pop(key)
+                self.current_bytes -= replaced_size
+                if replaced is not value:
+                    evicted.append((key, replaced))
+            # values bigger than the whole budget are never kept
+            if size > self.max_bytes:
+                evicted.append((key, value))
+            else:
+                self._entries[key] = (value, size)
+                self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                evicted_key, (evicted_value, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+                evicted.append((evicted_key, evicted_value))
+        self._evicted(evicted)
+
+    def get_or_create(self, key: Hashable, create: Callable[[], Tuple[Any, int]]):
+        """
+        Returns the cached value for a key, or builds it with create() and stores it. Concurrent
+        callers asking for the same missing key wait for a single call of create().
+
+        :param key: The key of the entry.
+        :param create: Function returning a (value, size in bytes) tuple for the key.
+        """
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    return self._entries[key][0]
+            try:
+                value, size = create()
+                self.put(key, value, size)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+        return value
+
+    def pop(self, key: Hashable, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, size = self._entries.pop(key)
+            self.current_bytes -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            evicted = [(key, value) for key, (value, _) in self._entries.items()]
+            self._entries.clear()
+            self.current_bytes = 0
+        self._evicted(evicted)
+
+    def _evicted(self, entries: list):
+        # called outside the lock, so the callback may take its time
+        if self.on_evict is not None:
+            for key, value in entries:
+                self.on_evict(key, value)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+        }
+
+
+_missing = object()
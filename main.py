@@ -1,17 +1,38 @@
 
 from fastapi import FastAPI, HTTPException, Request, Response, Query, Path
-from typing import Annotated, Callable
+from functools import partial
+from typing import Annotated, Callable, Hashable, List, Optional, Tuple
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import asyncio
+import time
 
 import numpy as np
-from scipy.stats import pearsonr
-from util import abs_floor_minimum, to_degrees_east, generate_color_axis, get_first_key
+from util import abs_floor_minimum, to_degrees_east, get_first_key
 from data import VariableMetadata
 from data_sets import variables, datasets, instrumental
+from registry import registry, Layout
+from trend import build_prefix_sums, trends, window_slopes
+from climatology import climatologies
+from region import Box, box_indexers, regions
+from nearest import nearest
+from manifest import load_manifest, is_fresh, store_versions
+from results import results
+from executor import compute
+from correlation import align, pearson, correlation_map
+from proxies import FIELDS, ProxyQuery, ProxyTable
+from settings import PRECOMPUTE_CLIMATOLOGY, REFERENCE_PERIOD, BATCH_MAX_POINTS, PYRAMID_LEVELS, PROXIES_PATH, STREAM_BATCH_YEARS, COMPRESSION_ENABLED, COMPRESSION_MIN_BYTES
 import xarray as xr
-from download import DownloadMode, TimeseriesDownload, netCDF_download, dataframe_download
+from download import DownloadMode, TimeseriesDownload, downloads, netCDF_download, dataframe_download
+import grid_encoding
+from catalog import ResponseCatalog, ETagJSONResponse, etag, etag_matches
+from json_encoder import dumps
+from compression import compressed_bodies, compress_stream, is_compressible, negotiate
+from starlette.concurrency import run_in_threadpool
+import timing
+from timing import stage
 import pandas as pd
-app = FastAPI(openapi_url=None)
+app = FastAPI(openapi_url=None, default_response_class=ETagJSONResponse)
 # add origins for cors
 origins = [
     "http://localhost:5173",
@@ -24,39 +45,155 @@ app.add_middleware(
     allow_origins=origins,
     allow_methods=["GET"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count"],
     max_age=600
 )
 
 
+def store_key(path: str, *parts) -> tuple:
+    # identifies data read from a store to the nearest cell and region engines, which never see
+    # the store itself, so tables built before it was rewritten are not used after
+    return (path, *parts, store_versions.get(path))
+
 def startup():
+    paths = [*(path for dataset in datasets.values() for path in dataset.variables.values()), *instrumental.variables.values()]
+    # every store version once now, requests only check a store again once its version is stale
+    store_versions.refresh(paths)
+    # time ranges come from the build time manifest, a store is only opened here when the
+    # manifest does not describe it or it has been rewritten since the manifest was built
     for dataset in datasets.values():
         for variable_id in dataset.variables:
-            reconstruction_data =  xr.open_dataset(dataset.variables[variable_id]+".zarr", engine="zarr")
-            timeData = reconstruction_data[
-                "time"].data
-            dataset.timeStart = int(timeData.min())
-            dataset.timeEnd = int(timeData.max())
+            path = dataset.variables[variable_id]
+            entry = store_manifest.get(path)
+            if is_fresh(entry, path):
+                dataset.timeStart = entry["timeStart"]
+                dataset.timeEnd = entry["timeEnd"]
+            else:
+                reconstruction_data = registry.open(path)
+                timeData = reconstruction_data[
+                    "time"].data
+                dataset.timeStart = int(timeData.min())
+                dataset.timeEnd = int(timeData.max())
             variables[variable_id].datasets.append(dataset.id)
-
+    # nearest cell tables of every grid the manifest describes, the rest are built on first use
+    for path in paths:
+        entry = store_manifest.get(path)
+        if is_fresh(entry, path):
+            nearest.add(store_key(path), entry["lat"], entry["lon"])
+    if PRECOMPUTE_CLIMATOLOGY:
+        climatologies.precompute(path for dataset in datasets.values() for path in dataset.variables.values())
+
+store_manifest = load_manifest()
+store_versions.load(store_manifest)
 startup()
+catalog = ResponseCatalog(variables, datasets)
+proxy_table = ProxyTable.load(PROXIES_PATH)
 
+# paths that report live server state, and must never be cached
+uncached_paths = {"/health", "/stats", "/metrics"}
+
+# compresses responses for clients that accept it. Bodies with an entity tag are deterministic, so
+# each one is only compressed once per encoding, and the rest are compressed as they go out
+@app.middleware("http")
+async def compress_response(request: Request, call_next):
+    response = await call_next(request)
+    if not COMPRESSION_ENABLED or response.status_code != 200 or "content-encoding" in response.headers or not is_compressible(response.headers.get("content-type")):
+        return response
+    # a kept download is sent again with the headers it first went out with, Vary included
+    vary = response.headers.get("vary")
+    if not vary:
+        response.headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        response.headers["Vary"] = f"{vary}, Accept-Encoding"
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    length = response.headers.get("content-length")
+    if encoding is None or (length is not None and int(length) < COMPRESSION_MIN_BYTES):
+        return response
+    headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+    headers["content-encoding"] = encoding
+    tag = response.headers.get("etag")
+    if tag is not None:
+        # the compressed body is another representation of the same content, so its tag becomes weak
+        headers["etag"] = "W/" + tag.removeprefix("W/")
+    # the bodies of /stats and /metrics change on every request, and the tag of a file download
+    # only reflects the size and time of the file it was sent from
+    if tag is None or request.url.path in uncached_paths or "content-disposition" in response.headers:
+        return StreamingResponse(compress_stream(response.body_iterator, encoding), headers=headers)
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    compressed = await run_in_threadpool(compressed_bodies.compress, tag, encoding, body)
+    return Response(compressed, headers=headers)
+
+# outside compress_response, so revalidations are answered with the tag and Vary of the
+# representation the client would have been sent
 @app.middleware("http")
 async def cache(request: Request, call_next):
     response = await call_next(request)
-    if request.url.path == "/health" and request.method == "GET":
+    if request.url.path in uncached_paths and request.method == "GET":
         return response
+    # answer revalidation requests for unchanged content without sending the body again
+    tag = response.headers.get("etag")
+    if tag and request.method == "GET" and response.status_code == 200 and etag_matches(request.headers.get("if-none-match"), tag):
+        headers = {name: response.headers[name] for name in ("etag", "vary") if name in response.headers}
+        response = Response(status_code=304, headers=headers)
     response.headers["Cache-Control"] = "public, max-age=259200"
     return response
 
+
+# outermost, so the time until the response headers are ready includes every other middleware
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    timings = timing.begin()
+    if timings is None:
+        return await call_next(request)
+    started = time.perf_counter()
+    response = await call_next(request)
+    total = time.perf_counter() - started
+    response.headers["Server-Timing"] = timings.header(total)
+    route = request.scope.get("route")
+    timing.metrics.observe(timings, route.path if route else "unmatched", response.status_code, total)
+    return response
+
 # Simple end point for checking if the server is up.
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+# Reports the hit/miss counters of the shared store handles and caches
+@app.get("/stats")
+async def stats():
+    return {"stores": registry.stats(), "trends": trends.stats(), "climatologies": climatologies.stats(), "regions": regions.stats(), "nearest": nearest.stats(), "compression": compressed_bodies.stats(), "downloads": downloads.stats(), "compute": compute.stats(), "results": results.stats()}
+
+# Prometheus text format histograms of request and stage timings per route
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(timing.metrics.render(), media_type="text/plain; version=0.0.4")
+
+# proxy records, optionally filtered by a box, a radius in km around a point and proxy types,
+# projected to some fields and paged. Filtered responses report how many records matched in
+# X-Total-Count
 @app.get("/proxies")
-async def proxies():
-    data = pd.read_pickle("proxies.pkl")
-    return data.to_dict(orient="records")
+async def get_proxies(
+        n: Annotated[float, Query(le=90, ge=-90)] = None, s: Annotated[float, Query(le=90, ge=-90)] = None,
+        start: Annotated[float, Query(le=180, ge=-180)] = None, stop: Annotated[float, Query(le=180, ge=-180)] = None,
+        lat: Annotated[float, Query(le=90, ge=-90)] = None, lon: Annotated[float, Query(le=180, ge=-180)] = None,
+        radius: Annotated[float, Query(gt=0)] = None,
+        type: Annotated[List[str], Query()] = None, fields: Annotated[List[str], Query()] = None,
+        offset: Annotated[int, Query(ge=0)] = 0, limit: Annotated[int, Query(ge=1)] = None):
+    box = parse_box(n, s, start, stop)
+    center = None
+    if (lat, lon, radius) != (None, None, None):
+        if None in (lat, lon, radius):
+            raise HTTPException(status_code=400, detail="A radius search needs all of lat, lon and radius.")
+        center = (lat, lon)
+    if fields is not None and not set(fields) <= set(FIELDS):
+        raise HTTPException(status_code=400, detail=f"Fields must be some of {', '.join(FIELDS)}.")
+    query = ProxyQuery(box=box, center=center, radius_km=radius, types=tuple(type) if type else None,
+                       fields=tuple(dict.fromkeys(fields)) if fields else None, offset=offset, limit=limit)
+
+    if query.unfiltered and query.fields is None and offset == 0 and limit is None:
+        return Response(proxy_table.full_body, media_type="application/json", headers={"ETag": proxy_table.full_etag})
+    rows, total = proxy_table.select(query)
+    return ETagJSONResponse(proxy_table.records(rows, query.fields or FIELDS), headers={"X-Total-Count": str(total)})
 
 # root shows possible data sets
 @app.get("/")
@@ -66,21 +203,43 @@ async def root():
 # Get a list of all variables available
 @app.get("/variables")
 async def get_variables():
-    # time.sleep(2)
-    # when getting variables, drop datasets key as it is not need for this view
-    return {
-        "variables":list(variables.values()),
-        "datasets":list(datasets.values()),
-    }
+    return catalog.variables()
+
+def timeseries_versions(variable: VariableMetadata) -> tuple:
+    paths = [instrumental.variables[variable.id]] + [datasets[dataset_id].variables[variable.id] for dataset_id in variable.datasets]
+    return tuple(store_versions.get(path) for path in paths)
+
+def trend_versions(variable_id: str, dataset_id: str) -> tuple:
+    # unknown ids have no store, calculateTrend answers them with a 404
+    if dataset_id not in datasets or variable_id not in datasets[dataset_id].variables:
+        return ()
+    return (store_versions.get(datasets[dataset_id].variables[variable_id]),)
+
+async def run_cached(endpoint: str, key: Hashable, versions: tuple, function: Callable, *args, headers: dict = None, download: str = None):
+    """
+    Runs function(*args) on the compute pool of an endpoint, through the result cache, or the
+    download cache for downloads. If key is None the result is neither shared nor cached.
+
+    :param versions: Versions of the stores the result is computed from, part of the cache key.
+    :param download: The download format the request asked for, if any.
+    """
+    if key is None:
+        return await compute.run(endpoint, None, function, *args)
+    cache_key = (endpoint, key, versions, REFERENCE_PERIOD)
+    if download is not None:
+        # download responses are sent once each, so concurrent requests are not shared
+        return await compute.run(endpoint, None, partial(downloads.response, cache_key + (download,), function, *args))
+    return await compute.run(endpoint, key, partial(results.response, cache_key, function, *args, headers=headers))
 
 # get time series data for a specific lat/lon point
 @app.get("/variables/{id}/timeseries")
 async def get_variable_timeseries(id: str, startYear:int = None, endYear:int = None, lat: Annotated[int, Query(le=90, ge=-90)]  = 0, lon: Annotated[int, Query(le=180, ge=-180)] = -150, download:TimeseriesDownload = None, move_reference:bool = True):
     if variables.keys().__contains__(id):
         lon = to_degrees_east(lon)
-        def select_point(xarray_dataset :xr.Dataset) -> xr.Dataset:
-            return xarray_dataset.sel(lat=lat, lon=lon, method="nearest")
-        return processTimeSeries(select_point,variables[id],f'({lat},{(lon + 180) % 360 - 180})',startYear,endYear,download, move_reference=move_reference)
+        def select_point(xarray_dataset :xr.Dataset, key: Hashable) -> xr.Dataset:
+            return nearest.point(key, xarray_dataset, lat, lon)
+        key = (id, lat, lon, startYear, endYear, move_reference)
+        return await run_cached("timeseries", key, timeseries_versions(variables[id]), processTimeSeries, select_point, variables[id], f'({lat},{(lon + 180) % 360 - 180})', startYear, endYear, download, move_reference, download=download)
     raise  HTTPException(status_code=404, detail="Variable not found.")
 
 @app.get("/variables/{id}/timeseries-area")
@@ -90,29 +249,44 @@ async def get_variable_timeseries_area(
         start: Annotated[int, Query(le=180, ge=-180)] = 170, stop: Annotated[int, Query(le=180, ge=-180)] = -62,
         download:TimeseriesDownload = None, move_reference:bool = True):
     if variables.keys().__contains__(id): # makes sure the user request a valid variable, else returns 404
-        lats = np.arange(np.min([n, s]), np.max([n, s]) + 1)
         start = to_degrees_east(start)
         stop = to_degrees_east(stop)
-        if start < stop:
-            lons = np.arange(np.min([start, stop]), np.max([start, stop]) + 1)
-        elif start == stop:
-            lons = np.array([start])
-        else:
-            lons = np.concatenate((np.arange(start, 361), np.arange(0, stop + 1)))
+        box = Box(south=s, north=n, west=start, east=stop)
         variable = variables[id]
 
-        def select_area(xarray_dataset :xr.Dataset) -> xr.Dataset:
-            print(xarray_dataset)
-            return xarray_dataset.sel(lat=lats, lon=lons, method="nearest").mean(dim=['lat', 'lon'])
-        return processTimeSeries(select_area,variable,f'({n},{s},{start},{stop})',startYear=startYear,endYear=endYear,download=download, move_reference=move_reference)
+        def select_area(xarray_dataset :xr.Dataset, key: Hashable) -> xr.Dataset:
+            return regions.mean(key, xarray_dataset, box)
+        key = (id, box, startYear, endYear, move_reference)
+        return await run_cached("timeseries-area", key, timeseries_versions(variable), processTimeSeries, select_area, variable, f'({n},{s},{start},{stop})', startYear, endYear, download, move_reference, download=download)
     raise  HTTPException(status_code=404, detail="Variable not found.")
 
-def processTimeSeries(selectArea: Callable[[xr.Dataset], xr.Dataset], variable:VariableMetadata, area_name:str, startYear:int = None, endYear:int = None, download:TimeseriesDownload = None, move_reference:bool = True):
+def correlation_label(r: float, p_value: float) -> str:
+    r = np.around(r, decimals=4)
+    p_value = np.around(p_value, decimals=4)
+    if p_value == 0.0:
+        p_value = "0.0000"
+    return f'r={r}, p_value={p_value}'
+
+def grid_cell(selected: xr.Dataset) -> dict:
+    """
+    Returns the coordinates of the grid cell a point selection read, longitude from -180 to 180,
+    or nothing for selections without one such as region means.
+    """
+    if "lat" not in selected.coords or selected["lat"].ndim != 0:
+        return {}
+    return cell_coordinates(selected["lat"].item(), selected["lon"].item())
+
+def cell_coordinates(lat: float, lon: float) -> dict:
+    return {"gridLat": float(lat), "gridLon": (float(lon) + 180) % 360 - 180}
+
+def processTimeSeries(selectArea: Callable[[xr.Dataset, Hashable], xr.Dataset], variable:VariableMetadata, area_name:str, startYear:int = None, endYear:int = None, download:TimeseriesDownload = None, move_reference:bool = True):
     # makes sure the user request a valid variable, else returns 404
     result = []
     # TO-DO: make work for rare cases where there is no instrumental data for variable
-    instrumental_data = xr.open_dataset(instrumental.variables[variable.id]+".zarr", engine="zarr")
-    instrumental_data = selectArea(instrumental_data)
+    instrumental_data = registry.open(instrumental.variables[variable.id], Layout.series)
+    with stage("select"):
+        instrumental_data = selectArea(instrumental_data, store_key(instrumental.variables[variable.id])).load()
+    instrumental_cell = grid_cell(instrumental_data)
 
     # select time range if specified
     if startYear is not None and endYear is not None:
@@ -120,71 +294,71 @@ def processTimeSeries(selectArea: Callable[[xr.Dataset], xr.Dataset], variable:V
             raise  HTTPException(status_code=400, detail="Start year cannot be greater than or equal to end year.")
         instrumental_data = instrumental_data.sel(time=slice(startYear, endYear))
 
+    # series are built straight from the arrays, [time, value] pairs come out of one column_stack
     instrumental_variable = get_first_key(instrumental_data.keys())
-    instrumental_data = instrumental_data.to_dataframe().reset_index()
-    try:
-        instrumental_data = instrumental_data.drop(columns=['lat', 'lon'])
-    except KeyError:
-        pass
-
-    instrumental_data[instrumental_variable] = instrumental_data[instrumental_variable] - np.mean(instrumental_data[instrumental_variable])
+    instrumental_time = instrumental_data["time"].values
+    instrumental_values = np.ravel(instrumental_data[instrumental_variable].values)
+    instrumental_values = instrumental_values - np.nanmean(instrumental_values)
 
     if variable.transform_timeseries:
-        instrumental_data[instrumental_variable] = variable.transform_timeseries(instrumental_data[instrumental_variable])
+        instrumental_values = variable.transform_timeseries(instrumental_values)
 
     if download:
-        download_frame = instrumental_data
-        download_frame.rename(columns={instrumental_variable: f'ERA5_{instrumental_variable}'}, inplace=True)
-        download_frame["time"] = download_frame["time"].astype(int)
+        download_frame = pd.DataFrame({"time": instrumental_time.astype(int), f'ERA5_{instrumental_variable}': instrumental_values})
     else:
         result.append({
             "name": instrumental.name,
             "dashStyle": 'Dash',
-            "data": instrumental_data.values.tolist(),
+            **instrumental_cell,
+            "data": np.column_stack((instrumental_time, instrumental_values)).astype(np.float64, copy=False),
         })
+    # each reconstruction on the instrumental years, correlated for every dataset at once below
+    aligned = []
     for dataset in variable.datasets:
         dataset = datasets[dataset]
-        reconstruction = xr.open_dataset(dataset.variables[variable.id]+".zarr", engine="zarr")
-        reconstruction = selectArea(reconstruction)
+        path = dataset.variables[variable.id]
+        reconstruction = registry.open(path, Layout.series)
+        with stage("select"):
+            reconstruction = selectArea(reconstruction, store_key(path)).load()
+        cell = grid_cell(reconstruction)
 
-        # move anomaly reference to 1979-2005
+        # move anomaly reference to the reference period (1979-2005 by default)
         if move_reference:
-            reconstruction_subset = reconstruction.sel(time=slice(1979, 2005))
-            climatology = reconstruction_subset.mean(dim='time')
-            reconstruction = reconstruction - climatology
+            reconstruction = reconstruction - selectArea(climatologies.get(path), store_key(path, REFERENCE_PERIOD))
 
         dataset_var = get_first_key(reconstruction.keys())
+        time = reconstruction["time"].values
+        values = np.ravel(reconstruction[dataset_var].values)
 
-        reconstruction = reconstruction.to_dataframe().reset_index()
-        reconstruction = reconstruction[['time', dataset_var]]
-
-        r, p_value = [None,None]
         if download is None:
-            merged_df = instrumental_data.merge(reconstruction, how='inner', on='time')
-            instrumental_aligned_values = merged_df.iloc[:, 1].values
-            reconstruction_aligned_values =  merged_df.iloc[:, 2].values
-            r, p_value = pearsonr(instrumental_aligned_values, reconstruction_aligned_values)
-            r = np.around(r, decimals=4)
-            p_value = np.around(p_value, decimals=4)
-            if p_value == 0.0:
-                p_value = "0.0000"
+            column = np.full(len(instrumental_time), np.nan)
+            instrumental_index, reconstruction_index = align(instrumental_time, time)
+            column[instrumental_index] = values[reconstruction_index]
+            aligned.append(column)
 
         if startYear is not None and endYear is not None:
-            reconstruction = reconstruction[(reconstruction['time'] >= startYear) & (reconstruction['time'] <= endYear)]
+            in_range = (time >= startYear) & (time <= endYear)
+            time, values = time[in_range], values[in_range]
 
         if variable.transform_timeseries:
-            reconstruction[dataset_var] = variable.transform_timeseries(reconstruction[dataset_var])
-
+            values = variable.transform_timeseries(values)
 
         if download:
-            reconstruction.rename(columns={dataset_var: f'{dataset.nameShort}_{dataset_var}'.replace(" ","_")}, inplace=True)
-            download_frame = download_frame.merge(reconstruction,how="outer",on="time")
+            column = pd.DataFrame({"time": time, f'{dataset.nameShort}_{dataset_var}'.replace(" ","_"): values})
+            download_frame = download_frame.merge(column,how="outer",on="time")
         else:
             result.append({
-                "name": f'{dataset.name}, r={r}, p_value={p_value}',
-                "data": reconstruction.values.tolist(),
+                "name": dataset.name,
+                **cell,
+                "data": np.column_stack((time, values)).astype(np.float64, copy=False),
             })
 
+    if aligned:
+        with stage("correlation"):
+            r, p_value = pearson(instrumental_values[:, np.newaxis], np.column_stack(aligned))
+        for series, series_r, series_p_value in zip(result[1:], r, p_value):
+            series["name"] = f'{series["name"]}, {correlation_label(series_r, series_p_value)}'
+
     if download:
         return dataframe_download(download_frame,download,f'timeseries_{startYear}_{endYear}_{variable.name}_{variable.annualUnit}_{area_name}')
     return {
@@ -192,17 +366,256 @@ def processTimeSeries(selectArea: Callable[[xr.Dataset], xr.Dataset], variable:V
         "values": result
     }
 
+def parse_points(points: List[str]) -> List[Tuple[int, int]]:
+    """
+    Parses "lat,lon" query values into integer points, raising a 400 for anything outside the
+    ranges the single point endpoint accepts.
+    """
+    if len(points) > BATCH_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_POINTS} points can be requested at once.")
+    parsed = []
+    for point in points:
+        try:
+            lat, lon = (int(value) for value in point.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid point {point}, expected lat,lon.")
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise HTTPException(status_code=400, detail=f"Point {point} is out of range.")
+        parsed.append((lat, lon))
+    return parsed
+
+# get time series data for several lat/lon points at once, e.g. ?point=-70,-100&point=10,20
+@app.get("/variables/{id}/timeseries-batch")
+async def get_variable_timeseries_batch(id: str, point: Annotated[List[str], Query()], startYear:int = None, endYear:int = None, download:TimeseriesDownload = None, move_reference:bool = True):
+    if variables.keys().__contains__(id):
+        points = parse_points(point)
+        key = (id, tuple(points), startYear, endYear, move_reference)
+        return await run_cached("timeseries-batch", key, timeseries_versions(variables[id]), processTimeSeriesBatch, variables[id], points, startYear, endYear, download, move_reference, download=download)
+    raise  HTTPException(status_code=404, detail="Variable not found.")
+
+def select_points(xarray_dataset: xr.Dataset, key: Hashable, points: List[Tuple[int, int]]) -> xr.DataArray:
+    """
+    Selects the nearest grid cell to every point in one vectorized selection, returning an array
+    with dimensions (time, point), or just (point) for climatologies.
+
+    :param key: Identifies the dataset for its nearest cell table.
+    """
+    lats = [lat for lat, _ in points]
+    lons = [to_degrees_east(lon) for _, lon in points]
+    selected = nearest.points(key, xarray_dataset, lats, lons)
+    selected = selected[get_first_key(selected.keys())]
+    return selected.squeeze([dim for dim in selected.dims if dim not in ("time", "point")], drop=True).transpose(..., "point")
+
+def point_cells(selected: xr.DataArray) -> List[dict]:
+    # the grid cell select_points read for each point
+    return [cell_coordinates(lat, lon) for lat, lon in zip(selected["lat"].values, selected["lon"].values)]
+
+def processTimeSeriesBatch(variable:VariableMetadata, points: List[Tuple[int, int]], startYear:int = None, endYear:int = None, download:TimeseriesDownload = None, move_reference:bool = True):
+    if startYear is not None and endYear is not None and startYear >= endYear:
+        raise  HTTPException(status_code=400, detail="Start year cannot be greater than or equal to end year.")
+    names = [f'({lat},{lon})' for lat, lon in points]
+
+    instrumental_data = registry.open(instrumental.variables[variable.id], Layout.series)
+    with stage("select"):
+        instrumental_data = select_points(instrumental_data, store_key(instrumental.variables[variable.id]), points)
+        if startYear is not None and endYear is not None:
+            instrumental_data = instrumental_data.sel(time=slice(startYear, endYear))
+        instrumental_data = instrumental_data.load()
+    instrumental_cells = point_cells(instrumental_data)
+    instrumental_variable = instrumental_data.name
+    instrumental_time = instrumental_data["time"].values
+    instrumental_values = instrumental_data.values
+    instrumental_values = instrumental_values - np.nanmean(instrumental_values, axis=0)
+    if variable.transform_timeseries:
+        instrumental_values = variable.transform_timeseries(instrumental_values)
+
+    if download:
+        columns = {f'ERA5_{instrumental_variable}_{name}': instrumental_values[:, i] for i, name in enumerate(names)}
+        download_frame = pd.DataFrame({"time": instrumental_time.astype(int), **columns})
+    series = [[{
+        "name": instrumental.name,
+        "dashStyle": 'Dash',
+        **instrumental_cells[i],
+        "data": np.column_stack((instrumental_time, instrumental_values[:, i])).astype(np.float64, copy=False),
+    }] for i in range(len(points))]
+
+    for dataset in variable.datasets:
+        dataset = datasets[dataset]
+        path = dataset.variables[variable.id]
+        reconstruction = registry.open(path, Layout.series)
+        with stage("select"):
+            reconstruction = select_points(reconstruction, store_key(path), points).load()
+        cells = point_cells(reconstruction)
+        if move_reference:
+            reconstruction = reconstruction - select_points(climatologies.get(path), store_key(path, REFERENCE_PERIOD), points)
+        dataset_var = reconstruction.name
+        time = reconstruction["time"].values
+        values = reconstruction.values
+
+        # correlate every point against ERA5 over the years both cover, in one call
+        with stage("correlation"):
+            instrumental_index, reconstruction_index = align(instrumental_time, time)
+            r, p_value = pearson(instrumental_values[instrumental_index], values[reconstruction_index])
+
+        if startYear is not None and endYear is not None:
+            in_range = (time >= startYear) & (time <= endYear)
+            time, values = time[in_range], values[in_range]
+        if variable.transform_timeseries:
+            values = variable.transform_timeseries(values)
+
+        if download:
+            columns = pd.DataFrame({"time": time.astype(int), **{
+                f'{dataset.nameShort}_{dataset_var}_{name}'.replace(" ","_"): values[:, i] for i, name in enumerate(names)}})
+            download_frame = download_frame.merge(columns, how="outer", on="time")
+        for i in range(len(points)):
+            series[i].append({
+                "name": f'{dataset.name}, {correlation_label(r[i], p_value[i])}',
+                **cells[i],
+                "data": np.column_stack((time, values[:, i])).astype(np.float64, copy=False),
+            })
+
+    if download:
+        return dataframe_download(download_frame,download,f'timeseries_{startYear}_{endYear}_{variable.name}_{variable.annualUnit}_{len(points)}_points')
+    return {
+        "name": f'Time Series For {len(points)} Points',
+        "points": [{
+            "lat": lat,
+            "lon": lon,
+            "name": f'Time Series For {name}',
+            "values": values,
+        } for (lat, lon), name, values in zip(points, names, series)]
+    }
+
+# running trends at a point, or over a box when n, s, start and stop are given: the slope of every
+# window of `window` years in ERA5 and each reconstruction, labelled by the last year of the window
+@app.get("/variables/{id}/trend-series")
+async def get_trend_series(id: str, window: Annotated[int, Query(ge=2)] = 30, startYear:int = None, endYear:int = None,
+        lat: Annotated[int, Query(le=90, ge=-90)] = 0, lon: Annotated[int, Query(le=180, ge=-180)] = -150,
+        n: Annotated[int, Query(le=90, ge=-90)] = None, s: Annotated[int, Query(le=90, ge=-90)] = None,
+        start: Annotated[int, Query(le=180, ge=-180)] = None, stop: Annotated[int, Query(le=180, ge=-180)] = None,
+        download:TimeseriesDownload = None):
+    if variables.keys().__contains__(id):
+        box = parse_box(n, s, start, stop)
+        if box is None:
+            lon = to_degrees_east(lon)
+            area_name = f'({lat},{(lon + 180) % 360 - 180})'
+            def select_area(xarray_dataset :xr.Dataset, key: Hashable) -> xr.Dataset:
+                return nearest.point(key, xarray_dataset, lat, lon)
+        else:
+            area_name = f'({n},{s},{start},{stop})'
+            def select_area(xarray_dataset :xr.Dataset, key: Hashable) -> xr.Dataset:
+                return regions.mean(key, xarray_dataset, box)
+        key = (id, window, box, lat, lon, startYear, endYear)
+        return await run_cached("trend-series", key, timeseries_versions(variables[id]), processTrendSeries, select_area, variables[id], area_name, window, startYear, endYear, download, download=download)
+    raise  HTTPException(status_code=404, detail="Variable not found.")
+
+def running_trend(time: np.ndarray, values: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the last year of every window of years in a series and the least squares slope per
+    year over each, all windows in one pass over the prefix sums of the series.
+
+    :param window: How many years go into each slope, a series shorter than this has none.
+    """
+    ends = time[time >= time[0] + window - 1] if time.size else time
+    if ends.size == 0:
+        return ends, np.empty(0)
+    sums = build_prefix_sums(xr.DataArray(values, coords={"time": time}, dims="time"))
+    return ends, window_slopes(sums, ends - window + 1, ends)
+
+def processTrendSeries(selectArea: Callable[[xr.Dataset, Hashable], xr.Dataset], variable:VariableMetadata, area_name:str, window:int, startYear:int = None, endYear:int = None, download:TimeseriesDownload = None):
+    if startYear is not None and endYear is not None and startYear >= endYear:
+        raise  HTTPException(status_code=400, detail="Start year cannot be greater than or equal to end year.")
+    result = []
+    download_frame = None
+    # ERA5 first, then every reconstruction, the same order as the time series
+    for dataset in [instrumental] + [datasets[dataset_id] for dataset_id in variable.datasets]:
+        path = dataset.variables[variable.id]
+        series = registry.open(path, Layout.series)
+        with stage("select"):
+            series = selectArea(series, store_key(path)).load()
+        cell = grid_cell(series)
+        if startYear is not None and endYear is not None:
+            series = series.sel(time=slice(startYear, endYear))
+        column = get_first_key(series.keys())
+
+        # subtracting a reference period does not change a slope, so there is no move_reference
+        with stage("trend"):
+            time, slopes = running_trend(series["time"].values, np.ravel(series[column].values), window)
+        slopes = np.around(slopes, 6)
+        if variable.transform_trend:
+            slopes = variable.transform_trend(slopes)
+
+        if download:
+            prefix = "ERA5" if dataset is instrumental else dataset.nameShort
+            frame = pd.DataFrame({"time": time.astype(int), f'{prefix}_{column}'.replace(" ","_"): slopes})
+            download_frame = frame if download_frame is None else download_frame.merge(frame, how="outer", on="time")
+        else:
+            trend_series = {
+                "name": dataset.name,
+                **cell,
+                "data": np.column_stack((time, slopes)).astype(np.float64, copy=False),
+            }
+            if dataset is instrumental:
+                trend_series["dashStyle"] = 'Dash'
+            result.append(trend_series)
+
+    if download:
+        return dataframe_download(download_frame,download,f'trend_series_{window}_{startYear}_{endYear}_{variable.name}_{area_name}')
+    return {
+        "name": f'{window} Year Trends For {area_name}',
+        "variable": variable.trendUnit,
+        "window": window,
+        "values": result
+    }
+
 @app.get("/variables/{id}/trend/{dataset_id}")
-def calculateTrend(id: str, dataset_id: str, response: Response, startYear:int = None, endYear:int = None, download:DownloadMode = None, move_reference:bool = False):
+async def get_trend(id: str, dataset_id: str, request: Request, startYear:int = None, endYear:int = None, download:DownloadMode = None, move_reference:bool = False,
+        level: Annotated[int, Query(le=PYRAMID_LEVELS, ge=0)] = 0,
+        n: Annotated[int, Query(le=90, ge=-90)] = None, s: Annotated[int, Query(le=90, ge=-90)] = None,
+        start: Annotated[int, Query(le=180, ge=-180)] = None, stop: Annotated[int, Query(le=180, ge=-180)] = None):
+    encoding = grid_encoding.negotiate(request.headers.get("accept"))
+    box = parse_box(n, s, start, stop)
+    key = (id, dataset_id, startYear, endYear, move_reference, encoding, level, box)
+    # the same url can return json or binary, so caches must key on the accept header
+    return await run_cached("trend", key, trend_versions(id, dataset_id), calculateTrend, id, dataset_id, startYear, endYear, download, move_reference, encoding, level, box, headers={"Vary": "Accept"}, download=download)
+
+def parse_box(n: float = None, s: float = None, start: float = None, stop: float = None) -> Optional[Box]:
+    """
+    Returns the box given by the optional n, s, start and stop parameters of an endpoint, or None
+    if none of them were given.
+    """
+    if (n, s, start, stop) == (None, None, None, None):
+        return None
+    if None in (n, s, start, stop):
+        raise HTTPException(status_code=400, detail="A box needs all of n, s, start and stop.")
+    return Box(south=s, north=n, west=to_degrees_east(start), east=to_degrees_east(stop))
+
+def open_map(path: str, level: int = 0, box: Box = None, move_reference: bool = False) -> Tuple[xr.Dataset, Optional[xr.Dataset], Optional[dict]]:
+    """
+    Opens the map layout of a store at a pyramid level, limited to the cells inside a box. Returns
+    the lazily opened dataset, the climatology to subtract from it when moving the reference
+    period (None otherwise), and the isel indexers of the box (None without one).
+    """
+    data = registry.open(path, level=level).squeeze()
+    # a box only reads the cells inside it, in the order the map runs from its west edge
+    indexers = box_indexers(data['lat'].values, data['lon'].values, box) if box is not None else None
+    if indexers is not None:
+        data = data.isel(indexers)
+    climatology = None
+    if move_reference:
+        climatology = climatologies.get(path, level=level).squeeze()
+        if indexers is not None:
+            climatology = climatology.isel(indexers)
+    return data, climatology, indexers
+
+def calculateTrend(id: str, dataset_id: str, startYear:int = None, endYear:int = None, download:DownloadMode = None, move_reference:bool = False, encoding: grid_encoding.GridEncoding = None, level: int = 0, box: Box = None):
     if variables.keys().__contains__(id):
         variable = variables[id]
         if variable.datasets.__contains__(dataset_id):
             dataset = datasets[dataset_id]
-            data = xr.open_dataset(dataset.variables[id]+".zarr",engine="zarr").squeeze()
-            if move_reference:
-                data_subset = data.sel(time=slice(1979, 2005))
-                climatology = data_subset.mean(dim='time')
-                data = data - climatology
+            # the climatology is only subtracted from what gets read, subtracting it from the whole
+            # lazily opened store would read all of it
+            data, climatology, indexers = open_map(dataset.variables[id], level, box, move_reference)
 
             column = get_first_key(data.keys())
             if startYear is not None and endYear is not None:
@@ -215,45 +628,195 @@ def calculateTrend(id: str, dataset_id: str, response: Response, startYear:int =
             # if they want full dataset, download before trim
             if download == DownloadMode.full:
                 name = f'{startYear}_{endYear}_{dataset.name}_{variable.name}'
-                return netCDF_download(data,name)
+                return netCDF_download(data if climatology is None else data - climatology,name)
 
             data = data.sel(time=slice(startYear, endYear),drop=True)
 
             if download == DownloadMode.partial:
                 name = f'{startYear}_{endYear}_{dataset.name}_{variable.name}'
-                return netCDF_download(data,name)
+                return netCDF_download(data if climatology is None else data - climatology,name)
 
             if startYear != endYear:
-                trends = data.polyfit(dim='time', deg=1)
-                slope = trends.sel(
-                    degree=1).rename_vars({column+"_polyfit_coefficients":"value"})
-                slope['value'] = np.around(slope['value'], 6)
+                # slopes come from the cached prefix sums of the store, subtracting a climatology
+                # does not change a slope so move_reference has no effect on them
+                fit = trends.slope(dataset.variables[id], startYear, endYear, level, indexers)
+                grid = fit.copy(data=np.around(fit.values, 6))
                 if variable.transform_trend:
-                    slope['value'] = variable.transform_trend(slope['value'])
+                    grid.values = variable.transform_trend(grid.values)
 
                 # if the user wants to download the calculated trend
                 if download == DownloadMode.trend:
                     name = f'{startYear}_{endYear}_{dataset.name}_{variable.name}_trends'
-                    return netCDF_download(trends.sel(
-                        degree=1).drop("degree"),name)
-                df = slope.to_dataframe().reset_index().drop(columns=['degree'])
+                    return netCDF_download(fit.to_dataset(name=column+"_polyfit_coefficients"),name)
+                dim_order = list(fit.dims)
             else:
-                df = data.to_dataframe().reset_index().drop(columns=['time'])
-                df.rename(columns={column: 'value'}, inplace=True)
+                with stage("select"):
+                    grid = data[column].squeeze('time', drop=True).load()
+                if climatology is not None:
+                    grid = grid - climatology[column]
                 if variable.transform_timeseries:
-                    df["value"] = variable.transform_timeseries(df["value"])
+                    grid = variable.transform_timeseries(grid)
+                dim_order = [dim for dim in data.dims if dim in grid.dims]
 
-            df["lon"] = (df["lon"] + 180) % 360 - 180
-            bound = abs_floor_minimum(np.min(df["value"]), np.max(df["value"]))
-            return {
+            bound = abs_floor_minimum(np.nanmin(grid.values), np.nanmax(grid.values))
+            map_metadata = {
                 "bound": np.max([bound,1]).item(),
                 "variable": variable.trendUnit if startYear != endYear else variable.annualUnit,
                 "name": dataset.nameShort + f' Reconstruction '+(f'Trend {startYear}-{endYear}' if startYear != endYear else f'{startYear}'),
-                "colorMap": generate_color_axis(variable.colorMap),
-                "lats": list(df['lat']),
-                "lons": list(df['lon']),
-                "values": list(df['value'])}
+                "colorMap": catalog.color_axis(variable.colorMap),
+            }
+            return map_response(grid, dim_order, map_metadata, encoding)
 
         raise  HTTPException(status_code=404, detail="Dataset not found.")
     raise  HTTPException(status_code=404, detail="Variable not found.")
+
+# streams the annual maps of a range of years, for animations. The grid axes are sent once, then
+# one frame per year, as NDJSON lines or as a binary grid stream (see grid_encoding.py) for
+# clients that accept application/vnd.pv.grid-stream. With delta set, every frame after the first
+# holds its difference from the previous one
+@app.get("/variables/{id}/annual/{dataset_id}")
+async def get_annual_maps(id: str, dataset_id: str, request: Request, startYear:int = None, endYear:int = None, move_reference:bool = False, delta:bool = False,
+        level: Annotated[int, Query(le=PYRAMID_LEVELS, ge=0)] = 0,
+        n: Annotated[int, Query(le=90, ge=-90)] = None, s: Annotated[int, Query(le=90, ge=-90)] = None,
+        start: Annotated[int, Query(le=180, ge=-180)] = None, stop: Annotated[int, Query(le=180, ge=-180)] = None):
+    if id not in variables:
+        raise  HTTPException(status_code=404, detail="Variable not found.")
+    variable = variables[id]
+    if dataset_id not in variable.datasets:
+        raise  HTTPException(status_code=404, detail="Dataset not found.")
+    dataset = datasets[dataset_id]
+    if startYear is not None and endYear is not None:
+        if startYear > endYear:
+            raise  HTTPException(status_code=400, detail="Start year cannot be greater than end year.")
+    else:
+        startYear = dataset.timeStart
+        endYear = dataset.timeEnd
+    box = parse_box(n, s, start, stop)
+    encoding = grid_encoding.negotiate(request.headers.get("accept"), grid_encoding.STREAM_MEDIA_TYPE)
+
+    data, climatology, _ = await compute.run("annual", None, open_map, dataset.variables[id], level, box, move_reference)
+    column = get_first_key(data.keys())
+    lats = data['lat'].values
+    lons = (data['lon'].values + 180) % 360 - 180
+    metadata = {
+        "variable": variable.annualUnit,
+        "name": dataset.nameShort + f' Reconstruction {startYear}-{endYear}',
+        "colorMap": catalog.color_axis(variable.colorMap),
+        "years": data['time'].sel(time=slice(startYear, endYear)).values.astype(int).tolist(),
+        "delta": delta,
+    }
+    encoder = grid_encoding.FrameEncoder(encoding, delta)
+    batches = [(first, min(first + STREAM_BATCH_YEARS - 1, endYear)) for first in range(startYear, endYear + 1, STREAM_BATCH_YEARS)]
+
+    def read_batch(first: int, last: int) -> Tuple[np.ndarray, np.ndarray]:
+        with stage("select"):
+            block = data[column].sel(time=slice(first, last)).load()
+        if climatology is not None:
+            block = block - climatology[column]
+        if variable.transform_timeseries:
+            block = variable.transform_timeseries(block)
+        block = block.transpose('time', 'lat', 'lon')
+        return block['time'].values, block.values
+
+    def encode_batch(years: np.ndarray, maps: np.ndarray) -> List[bytes]:
+        messages = []
+        with stage("encode"):
+            for year, values in zip(years, maps):
+                bound = np.max([abs_floor_minimum(np.nanmin(values), np.nanmax(values)), 1]).item()
+                if encoding is not None:
+                    messages.append(grid_encoding.encode_frame(encoder, int(year), bound, values))
+                    continue
+                encoded, _, _, is_delta = encoder.encode(values)
+                messages.append(dumps({"year": int(year), "bound": bound, "delta": is_delta, "values": encoded.ravel()}) + b"\n")
+        return messages
+
+    async def stream():
+        if encoding is not None:
+            yield grid_encoding.encode_stream_header(lats, lons, metadata)
+        else:
+            yield dumps({**metadata, "lats": lats.astype(np.float64), "lons": lons.astype(np.float64)}) + b"\n"
+        if not batches:
+            return
+        # the next batch is read while the current one is encoded and sent
+        pending = asyncio.ensure_future(compute.run("annual", None, read_batch, *batches[0]))
+        try:
+            for index in range(len(batches)):
+                years, maps = await pending
+                if index + 1 < len(batches):
+                    pending = asyncio.ensure_future(compute.run("annual", None, read_batch, *batches[index + 1]))
+                for message in await compute.run("annual", None, encode_batch, years, maps):
+                    yield message
+        finally:
+            pending.cancel()
+
+    media_type = grid_encoding.STREAM_MEDIA_TYPE if encoding is not None else "application/x-ndjson"
+    return StreamingResponse(stream(), media_type=media_type, headers={"Vary": "Accept"})
+
+def map_response(grid: xr.DataArray, dim_order: List[str], map_metadata: dict, encoding: grid_encoding.GridEncoding = None, extra: dict = None):
+    """
+    Returns a lat/lon map as the binary grid encoding if one was negotiated, otherwise as json with
+    flat lats, lons and values lists.
+
+    :param dim_order: The order of the grid dimensions the json lists follow.
+    :param extra: Further maps on the same grid keyed by the json field they are returned in, only
+        part of the json response.
+    """
+    if encoding is not None:
+        grid = grid.transpose('lat', 'lon')
+        with stage("encode"):
+            payload = grid_encoding.encode_grid(grid['lat'].values, (grid['lon'].values + 180) % 360 - 180, grid.values, map_metadata, encoding)
+        return Response(payload, media_type=grid_encoding.MEDIA_TYPE, headers={"Vary": "Accept", "ETag": etag(payload)})
+
+    # flat vectors in dim_order, the row order a data frame of the grid would have
+    with stage("frame"):
+        grid = grid.transpose(*dim_order)
+        lats, lons = (coordinate.transpose(*dim_order).values.ravel() for coordinate in xr.broadcast(grid['lat'], grid['lon']))
+    return {
+        **map_metadata,
+        "lats": lats.astype(np.float64, copy=False),
+        "lons": (lons.astype(np.float64, copy=False) + 180) % 360 - 180,
+        "values": grid.values.ravel().astype(np.float64, copy=False),
+        **{field: extra_grid.transpose(*dim_order).values.ravel().astype(np.float64, copy=False) for field, extra_grid in (extra or {}).items()}}
+
+@app.get("/variables/{id}/correlation/{dataset_id}")
+async def get_correlation(id: str, dataset_id: str, request: Request, startYear:int = None, endYear:int = None):
+    encoding = grid_encoding.negotiate(request.headers.get("accept"))
+    versions = trend_versions(id, dataset_id)
+    if id in instrumental.variables:
+        versions += (store_versions.get(instrumental.variables[id]),)
+    return await run_cached("correlation", (id, dataset_id, startYear, endYear, encoding), versions, calculateCorrelation, id, dataset_id, startYear, endYear, encoding, headers={"Vary": "Accept"})
+
+def calculateCorrelation(id: str, dataset_id: str, startYear:int = None, endYear:int = None, encoding: grid_encoding.GridEncoding = None):
+    if id not in variables:
+        raise HTTPException(status_code=404, detail="Variable not found.")
+    variable = variables[id]
+    if dataset_id not in variable.datasets:
+        raise HTTPException(status_code=404, detail="Dataset not found.")
+    dataset = datasets[dataset_id]
+    if startYear is not None and endYear is not None:
+        if startYear >= endYear:
+            raise HTTPException(status_code=400, detail="Start year must be less than end year.")
+    else:
+        # the whole overlap of the reconstruction and ERA5
+        startYear = max(dataset.timeStart, instrumental.timeStart)
+        endYear = min(dataset.timeEnd, instrumental.timeEnd)
+    if max(startYear, dataset.timeStart, instrumental.timeStart) > min(endYear, dataset.timeEnd, instrumental.timeEnd):
+        raise HTTPException(status_code=400, detail=f"{dataset.nameShort} and {instrumental.nameShort} share no years between {startYear} and {endYear}.")
+
+    reconstruction = registry.open(dataset.variables[id])
+    reconstruction = reconstruction[get_first_key(reconstruction.keys())].squeeze(drop=True)
+    era5 = registry.open(instrumental.variables[id])
+    era5 = era5[get_first_key(era5.keys())].squeeze(drop=True)
+    with stage("correlation"):
+        r, p_value = correlation_map(reconstruction, era5, startYear, endYear)
+    r = np.around(r, 4)
+    p_value = np.around(p_value, 4)
+
+    map_metadata = {
+        "bound": 1,
+        "variable": "r",
+        "name": f'{dataset.nameShort} Reconstruction Correlation with {instrumental.nameShort} {startYear}-{endYear}',
+        "colorMap": catalog.color_axis("RdBu_r"),
+    }
+    return map_response(r, list(r.dims), map_metadata, encoding, {"pValues": p_value})
 # docker build -t pvapi -f AWS.dockerfile .
@@ -0,0 +1,196 @@
+# Build time catalog of the zarr stores, so the api can start without opening any of them.
+# Run `python manifest.py` after converting the data to write it.
+import glob
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import xarray as xr
+
+from settings import MANIFEST_PATH, STORE_VERSION_TTL
+from util import get_first_key
+
+MANIFEST_VERSION = 2
+
+# files at the root of a store that are rewritten whenever the store is, for zarr v3 and v2
+METADATA_FILES = ("zarr.json", ".zmetadata", ".zgroup")
+
+logger = logging.getLogger(__name__)
+
+
+def store_layouts(path: str) -> List[str]:
+    """
+    Returns every store written for a .nc file: the map layout, the timeseries layout and the
+    pyramid levels, whichever exist.
+
+    :param path: The path of the .nc file as listed in data_sets.py.
+    """
+    return sorted(glob.glob(glob.escape(path) + ".*zarr"))
+
+
+def _root_signature(store: str) -> Optional[str]:
+    for name in METADATA_FILES:
+        try:
+            stat = os.stat(os.path.join(store, name))
+        except FileNotFoundError:
+            continue
+        return f"{name}:{stat.st_size}:{stat.st_mtime_ns}"
+    return None
+
+
+def store_signature(path: str) -> Optional[str]:
+    """
+    Returns a cheap fingerprint of a store from the size and modification time of the root
+    metadata file of each of its layouts, used to notice any of them has been rewritten since the
+    manifest was built. None if the map layout does not exist.
+
+    :param path: The path of the .nc file as listed in data_sets.py.
+    """
+    if _root_signature(path + ".zarr") is None:
+        return None
+    return ";".join(f"{os.path.basename(store)}={_root_signature(store)}" for store in store_layouts(path))
+
+
+def store_checksum(path: str) -> str:
+    """
+    Returns a checksum of every layout of a store covering their metadata documents and the size
+    and modification time of every chunk, which changes whenever any layout is re-ingested.
+
+    :param path: The path of the .nc file as listed in data_sets.py.
+    """
+    digest = hashlib.sha256()
+    for root in store_layouts(path):
+        for directory, directories, files in sorted(os.walk(root)):
+            directories.sort()
+            for name in sorted(files):
+                file_path = os.path.join(directory, name)
+                stat = os.stat(file_path)
+                digest.update(f"{os.path.basename(root)}/{os.path.relpath(file_path, root)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+                if name in METADATA_FILES or name in (".zarray", ".zattrs"):
+                    with open(file_path, "rb") as metadata:
+                        digest.update(metadata.read())
+    return digest.hexdigest()
+
+
+def describe_store(path: str) -> dict:
+    """
+    Returns the manifest entry of a store: its time range, grid shape, coordinate axes, chunking,
+    dtype, checksum and signature.
+
+    :param path: The path of the .nc file as listed in data_sets.py.
+    """
+    dataset = xr.open_dataset(path + ".zarr", engine="zarr")
+    variable = dataset[get_first_key(dataset.keys())]
+    time = dataset["time"].values
+    return {
+        "variable": variable.name,
+        "dims": list(variable.dims),
+        "shape": list(variable.shape),
+        "chunks": list(variable.encoding.get("chunks") or variable.shape),
+        "dtype": str(variable.dtype),
+        "timeStart": int(time.min()),
+        "timeEnd": int(time.max()),
+        "lat": np.asarray(dataset["lat"].values).tolist(),
+        "lon": np.asarray(dataset["lon"].values).tolist(),
+        "checksum": store_checksum(path),
+        "signature": store_signature(path),
+    }
+
+
+def build_manifest(paths: Iterable[str]) -> dict:
+    # stores that have not been converted yet are left out, and get scanned at startup
+    return {"version": MANIFEST_VERSION, "stores": {path: describe_store(path) for path in paths if os.path.isdir(path + ".zarr")}}
+
+
+def write_manifest(paths: Iterable[str], manifest_path: str = MANIFEST_PATH):
+    manifest = build_manifest(paths)
+    temporary_path = manifest_path + ".tmp"
+    with open(temporary_path, "w") as file:
+        json.dump(manifest, file)
+    os.replace(temporary_path, manifest_path)
+
+
+def load_manifest(manifest_path: str = MANIFEST_PATH) -> Dict[str, dict]:
+    """
+    Returns the manifest entries keyed by store path, or no entries if there is no manifest or it
+    was written by an incompatible version.
+    """
+    try:
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        logger.warning("Ignoring manifest %s with version %s.", manifest_path, manifest.get("version"))
+        return {}
+    return manifest["stores"]
+
+
+def is_fresh(entry: Optional[dict], path: str) -> bool:
+    """
+    Checks that a manifest entry still describes the store on disk.
+    """
+    return entry is not None and entry.get("signature") is not None and entry["signature"] == store_signature(path)
+
+
+def store_version(path: str, manifest: Dict[str, dict]) -> str:
+    """
+    Returns a string that changes whenever a store is rewritten, its manifest checksum while the
+    manifest is fresh and its stat signature otherwise.
+    """
+    entry = manifest.get(path)
+    if is_fresh(entry, path):
+        return entry["checksum"]
+    return store_signature(path) or ""
+
+
+class StoreVersions:
+    """
+    The current version of each store, which every cache of data read from a store is keyed by,
+    so nothing read before a store was rewritten is served after it. A store is checked on disk
+    at most once per ttl seconds, so requests do not stat stores.
+
+    :param manifest: The manifest entries keyed by store path.
+    :param ttl: Seconds a version is used before its store is checked again.
+    """
+
+    def __init__(self, manifest: Optional[Dict[str, dict]] = None, ttl: float = STORE_VERSION_TTL):
+        self.manifest = manifest or {}
+        self.ttl = ttl
+        self._versions: Dict[str, Tuple[str, float]] = {}
+
+    def load(self, manifest: Dict[str, dict]):
+        """
+        Replaces the manifest, and checks every store again on its next use.
+        """
+        self.manifest = manifest
+        self._versions = {}
+
+    def refresh(self, paths: Iterable[str]):
+        for path in paths:
+            self._check(path)
+
+    def _check(self, path: str) -> str:
+        version = store_version(path, self.manifest)
+        self._versions[path] = (version, time.monotonic())
+        return version
+
+    def get(self, path: str) -> str:
+        cached = self._versions.get(path)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        return self._check(path)
+
+
+store_versions = StoreVersions()
+
+
+if __name__ == "__main__":
+    from data_sets import datasets, instrumental
+    store_paths = [path for dataset in [*datasets.values(), instrumental] for path in dataset.variables.values()]
+    write_manifest(store_paths)
+    print(f"Wrote {len(store_paths)} stores to {MANIFEST_PATH}")
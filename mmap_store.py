@@ -0,0 +1,150 @@
+# Optional backend that serves every store from uncompressed, memory mapped copies, so all the
+# worker processes of a node share one copy of the data through the page cache. Set PV_MMAP_DIR
+# to turn it on, and run `python mmap_store.py` to write the copies ahead of time.
+import glob
+import hashlib
+import json
+import os
+import shutil
+from typing import Callable
+
+import numpy as np
+import xarray as xr
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# the header of a copy, naming the .npy file, dimensions and attributes of every variable
+HEADER_NAME = "dataset.json"
+
+# time steps copied at once while writing, so a store is never decoded into memory whole
+WRITE_BLOCK = 16
+
+# encoding the stores carry through to netCDF downloads, such as float32 data computed in float64
+KEPT_ENCODING = ("dtype", "_FillValue", "scale_factor", "add_offset", "units", "calendar")
+
+
+def _copy_prefix(root: str, path: str, level: int) -> str:
+    name = os.path.normpath(path).strip(os.sep).replace(os.sep, "_")
+    return os.path.join(root, f"{name}.l{level}.")
+
+
+def mapped_directory(root: str, path: str, level: int, version: str) -> str:
+    """
+    Returns the directory of the copy of a store at a pyramid level. The version of the store is
+    part of the name, so a rewritten store gets a new copy instead of reusing a stale one.
+
+    :param root: The directory holding every copy.
+    :param path: The path of the .nc file as listed in data_sets.py.
+    """
+    return _copy_prefix(root, path, level) + hashlib.sha256(version.encode()).hexdigest()[:12]
+
+
+def _json_default(value):
+    return value.tolist() if hasattr(value, "tolist") else str(value)
+
+
+def write_mapped(dataset: xr.Dataset, directory: str):
+    """
+    Writes every variable of a dataset to its own .npy file in C order, next to a header
+    describing the dataset, and swaps the directory in once it is complete.
+    """
+    temporary = f"{directory}.tmp{os.getpid()}"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    header = {"attrs": dataset.attrs, "variables": {}}
+    for index, (name, variable) in enumerate(dataset.variables.items()):
+        file_name = f"{index}.npy"
+        if variable.ndim == 0:
+            np.save(os.path.join(temporary, file_name), variable.values, allow_pickle=False)
+        else:
+            array = np.lib.format.open_memmap(os.path.join(temporary, file_name), mode="w+", dtype=variable.dtype, shape=variable.shape)
+            for start in range(0, variable.shape[0], WRITE_BLOCK):
+                array[start:start + WRITE_BLOCK] = variable[start:start + WRITE_BLOCK].values
+            array.flush()
+            del array
+        header["variables"][str(name)] = {
+            "file": file_name,
+            "dims": list(variable.dims),
+            "attrs": variable.attrs,
+            "encoding": {key: value for key, value in variable.encoding.items() if key in KEPT_ENCODING},
+            "coordinate": name in dataset.coords,
+        }
+    with open(os.path.join(temporary, HEADER_NAME), "w") as file:
+        json.dump(header, file, default=_json_default)
+    os.replace(temporary, directory)
+
+
+def read_mapped(directory: str) -> xr.Dataset:
+    """
+    Opens a copy written by write_mapped. Data variables are read only memory maps of their
+    files, and coordinates are read into memory like the registry does for zarr stores.
+    """
+    with open(os.path.join(directory, HEADER_NAME)) as file:
+        header = json.load(file)
+    variables = {}
+    for name, spec in header["variables"].items():
+        file_path = os.path.join(directory, spec["file"])
+        values = np.load(file_path, allow_pickle=False) if spec["coordinate"] else np.load(file_path, mmap_mode="r", allow_pickle=False)
+        variables[name] = xr.Variable(spec["dims"], values, spec["attrs"], encoding=spec["encoding"])
+    # variables keep the order of the source, which decides the order of the dataset's dimensions
+    coordinates = [name for name, spec in header["variables"].items() if spec["coordinate"]]
+    return xr.Dataset(variables, attrs=header["attrs"]).set_coords(coordinates)
+
+
+def open_mapped(root: str, path: str, level: int, version: str, source: Callable[[], xr.Dataset]) -> xr.Dataset:
+    """
+    Opens the copy of a store, writing it from source() first if there is none for this version.
+    Workers that ask for the same copy at once wait for the first one to write it, and copies of
+    older versions are removed once the new one is in place. Processes that still map an old copy
+    keep reading it until they let go of it.
+
+    :param root: The directory holding every copy.
+    :param path: The path of the .nc file as listed in data_sets.py.
+    :param level: The pyramid level of the store.
+    :param version: Changes whenever the store is rewritten.
+    :param source: Opens the store the copy is written from.
+    """
+    directory = mapped_directory(root, path, level, version)
+    if not os.path.isdir(directory):
+        os.makedirs(root, exist_ok=True)
+        with open(directory + ".lock", "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.isdir(directory):
+                write_mapped(source(), directory)
+                for stale in glob.glob(glob.escape(_copy_prefix(root, path, level)) + "*"):
+                    if stale.startswith(directory):
+                        continue
+                    if os.path.isdir(stale):
+                        shutil.rmtree(stale, ignore_errors=True)
+                    else:
+                        os.remove(stale)
+    return read_mapped(directory)
+
+
+def main():
+    import argparse
+    from data_sets import datasets, instrumental
+    from registry import DatasetRegistry
+    from settings import MMAP_DIR, PYRAMID_LEVELS
+
+    parser = argparse.ArgumentParser(description="Write the memory mapped copies of every store in data_sets.py.")
+    parser.add_argument("--root", default=MMAP_DIR, help="directory for the copies, defaults to PV_MMAP_DIR")
+    parser.add_argument("--levels", type=int, default=PYRAMID_LEVELS, help="also copy this many pyramid levels")
+    arguments = parser.parse_args()
+    if not arguments.root:
+        parser.error("set PV_MMAP_DIR or pass --root")
+
+    registry = DatasetRegistry(mmap_root=arguments.root)
+    for dataset in [*datasets.values(), instrumental]:
+        for path in dataset.variables.values():
+            for level in range(arguments.levels + 1):
+                registry.open(path, level=level)
+            print(f"{path}: mapped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# nearest grid cell tables for the integer points the timeseries endpoints take
+from dataclasses import dataclass
+from typing import Hashable, Sequence
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from lru import SizedLRU
+from settings import NEAREST_CACHE_BYTES
+
+# every latitude a point can have, and every longitude once to_degrees_east has been applied
+LATITUDES = np.arange(-90, 91)
+LONGITUDES = np.arange(0, 361)
+
+
+@dataclass(frozen=True)
+class NearestIndex:
+    """
+    The row of a grid nearest every integer latitude and the column nearest every integer
+    longitude in degrees east.
+    """
+    lat: np.ndarray  # index -90 first
+    lon: np.ndarray  # index 0 first
+
+    @property
+    def nbytes(self) -> int:
+        return self.lat.nbytes + self.lon.nbytes
+
+    def cell(self, lat: int, lon: int) -> dict:
+        """
+        Returns the isel indexers of the cell nearest a point, longitude in degrees east.
+        """
+        return {"lat": int(self.lat[lat - LATITUDES[0]]), "lon": int(self.lon[lon - LONGITUDES[0]])}
+
+    def cells(self, lats: Sequence[int], lons: Sequence[int]) -> dict:
+        """
+        Returns the isel indexers of the cells nearest many points, along a new point dimension.
+        """
+        return {
+            "lat": xr.DataArray(self.lat[np.asarray(lats) - LATITUDES[0]], dims="point"),
+            "lon": xr.DataArray(self.lon[np.asarray(lons) - LONGITUDES[0]], dims="point"),
+        }
+
+
+def build_nearest_index(lat: Sequence[float], lon: Sequence[float]) -> NearestIndex:
+    """
+    Looks up the nearest row and column of every integer point with the same search that
+    sel(method="nearest") runs, so both pick the same cell, ties included.
+
+    :param lat: The latitudes of the grid, ascending or descending.
+    :param lon: The longitudes of the grid, ascending or descending.
+    """
+    return NearestIndex(
+        lat=pd.Index(np.asarray(lat)).get_indexer(LATITUDES, method="nearest").astype(np.int32),
+        lon=pd.Index(np.asarray(lon)).get_indexer(LONGITUDES, method="nearest").astype(np.int32),
+    )
+
+
+class NearestIndexEngine:
+    """
+    Selects points from a dataset by position, with the nearest cell table of its grid.
+
+    :param max_bytes: The memory budget of the tables in bytes.
+    """
+
+    def __init__(self, max_bytes: int = NEAREST_CACHE_BYTES):
+        self._indexes = SizedLRU(max_bytes)
+
+    def add(self, key: Hashable, lat: Sequence[float], lon: Sequence[float]):
+        """
+        Builds the table of a grid ahead of its first request, from coordinates such as the ones
+        in the manifest.
+        """
+        index = build_nearest_index(lat, lon)
+        self._indexes.put(key, index, index.nbytes)
+
+    def index(self, key: Hashable, dataset: xr.Dataset) -> NearestIndex:
+        """
+        Returns the table of a dataset's grid.
+
+        :param key: Identifies the dataset the table is built from.
+        """
+        def create():
+            index = build_nearest_index(dataset["lat"].values, dataset["lon"].values)
+            return index, index.nbytes
+        return self._indexes.get_or_create(key, create)
+
+    def point(self, key: Hashable, dataset: xr.Dataset, lat: int, lon: int) -> xr.Dataset:
+        """
+        Selects the cell nearest a point, longitude in degrees east. The result keeps the scalar
+        lat and lon of the cell, like sel(method="nearest") does.
+        """
+        return dataset.isel(self.index(key, dataset).cell(lat, lon))
+
+    def points(self, key: Hashable, dataset: xr.Dataset, lats: Sequence[int], lons: Sequence[int]) -> xr.Dataset:
+        """
+        Selects the cells nearest many points at once, along a new point dimension.
+        """
+        return dataset.isel(self.index(key, dataset).cells(lats, lons))
+
+    def stats(self) -> dict:
+        return self._indexes.stats()
+
+
+nearest = NearestIndexEngine()
@@ -0,0 +1,124 @@
+# the proxy record table, loaded once into columns with a latitude index for spatial queries
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from catalog import etag
+from region import Box
+
+FIELDS = ("id", "lat", "lon", "type")
+
+EARTH_RADIUS_KM = 6371.0
+
+
+@dataclass(frozen=True)
+class ProxyQuery:
+    """
+    Filters, projection and page of a proxy request. Every filter that is set must match.
+
+    :param box: Only records inside this box, longitudes in degrees east.
+    :param center: Only records within radius_km of this (lat, lon) point.
+    :param radius_km: The great circle distance from center, in kilometres.
+    :param types: Only records of these proxy types.
+    :param fields: The fields of each record to return, defaults to all of them.
+    :param offset: How many matching records to skip.
+    :param limit: The most records to return.
+    """
+    box: Optional[Box] = None
+    center: Optional[Tuple[float, float]] = None
+    radius_km: Optional[float] = None
+    types: Optional[Tuple[str, ...]] = None
+    fields: Optional[Tuple[str, ...]] = None
+    offset: int = 0
+    limit: Optional[int] = None
+
+    @property
+    def unfiltered(self) -> bool:
+        return self.box is None and self.center is None and self.types is None
+
+
+class ProxyTable:
+    """
+    The proxy records as one array per field, with types stored as codes into a list of type
+    names. Rows are also sorted by latitude, so boxes and radii only look at the band of rows
+    between their southern and northern edges. The response for every record, all fields, is
+    rendered once.
+    """
+
+    def __init__(self, frame: pd.DataFrame):
+        self.ids = frame["id"].to_numpy(dtype=object)
+        self.lat = frame["lat"].to_numpy(dtype=np.float64)
+        self.lon = frame["lon"].to_numpy(dtype=np.float64)
+        self.type_names, codes = np.unique(frame["type"].to_numpy(dtype=str), return_inverse=True)
+        self.type_codes = codes.astype(np.int16)
+        self._by_lat = np.argsort(self.lat, kind="stable")
+        self._sorted_lat = self.lat[self._by_lat]
+        # rendered the same way FastAPI renders the returned records, so the bytes do not change
+        self.full_body = JSONResponse(jsonable_encoder(frame.to_dict(orient="records"))).body
+        self.full_etag = etag(self.full_body)
+
+    @classmethod
+    def load(cls, path: str) -> "ProxyTable":
+        return cls(pd.read_pickle(path))
+
+    def __len__(self) -> int:
+        return self.lat.size
+
+    def _lat_band(self, south: float, north: float) -> np.ndarray:
+        start = np.searchsorted(self._sorted_lat, south, side="left")
+        end = np.searchsorted(self._sorted_lat, north, side="right")
+        return self._by_lat[start:end]
+
+    def _in_box(self, rows: np.ndarray, box: Box) -> np.ndarray:
+        south, north = sorted((box.south, box.north))
+        rows = np.intersect1d(rows, self._lat_band(south, north), assume_unique=True)
+        lon = self.lon[rows] % 360
+        west, east = box.west % 360, box.east % 360
+        inside = (lon >= west) & (lon <= east) if west <= east else (lon >= west) | (lon <= east)
+        return rows[inside]
+
+    def _in_radius(self, rows: np.ndarray, center: Tuple[float, float], radius_km: float) -> np.ndarray:
+        lat, lon = center
+        # no record further than the radius along a meridian can be inside it
+        reach = np.rad2deg(radius_km / EARTH_RADIUS_KM)
+        rows = np.intersect1d(rows, self._lat_band(lat - reach, lat + reach), assume_unique=True)
+        lat1, lat2 = np.deg2rad(lat), np.deg2rad(self.lat[rows])
+        half_dlat = (lat2 - lat1) / 2
+        half_dlon = np.deg2rad(self.lon[rows] - lon) / 2
+        a = np.sin(half_dlat) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(half_dlon) ** 2
+        distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+        return rows[distance <= radius_km]
+
+    def select(self, query: ProxyQuery) -> Tuple[np.ndarray, int]:
+        """
+        Returns the rows of the records matching a query in table order, limited to its page, and
+        how many records matched before paging.
+        """
+        rows = np.arange(len(self))
+        if query.types is not None:
+            codes = np.nonzero(np.isin(self.type_names, query.types))[0]
+            rows = rows[np.isin(self.type_codes, codes)]
+        if query.box is not None:
+            rows = self._in_box(rows, query.box)
+        if query.center is not None and query.radius_km is not None:
+            rows = self._in_radius(rows, query.center, query.radius_km)
+        total = rows.size
+        end = None if query.limit is None else query.offset + query.limit
+        return rows[query.offset:end], total
+
+    def records(self, rows: np.ndarray, fields: Sequence[str] = FIELDS) -> List[dict]:
+        """
+        Returns the records of some rows as dicts holding only the given fields.
+        """
+        columns = {
+            "id": lambda: self.ids[rows].tolist(),
+            "lat": lambda: self.lat[rows].tolist(),
+            "lon": lambda: self.lon[rows].tolist(),
+            "type": lambda: self.type_names[self.type_codes[rows]].tolist(),
+        }
+        values = [columns[field]() for field in fields]
+        return [dict(zip(fields, record)) for record in zip(*values)]
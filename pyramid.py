@@ -0,0 +1,64 @@
+# area weighted coarser levels of the map stores, for overview maps that do not need every cell
+import numpy as np
+import xarray as xr
+
+from region import cell_areas
+
+# each level halves the number of latitudes and longitudes of the one before it
+LEVEL_FACTOR = 2
+
+
+def level_suffix(level: int) -> str:
+    """
+    Returns the suffix of the store holding a level, path.l1.zarr for level 1 and so on. Level 0
+    is the store itself.
+    """
+    return f".l{level}.zarr"
+
+
+def _block_sum(values: np.ndarray, factor: int, axis: int) -> np.ndarray:
+    # zero pads the axis to a multiple of factor, so edge blocks just hold fewer cells
+    values = np.moveaxis(values, axis, -1)
+    padding = -values.shape[-1] % factor
+    values = np.pad(values, [(0, 0)] * (values.ndim - 1) + [(0, padding)])
+    values = values.reshape(values.shape[:-1] + (values.shape[-1] // factor, factor)).sum(axis=-1)
+    return np.moveaxis(values, -1, axis)
+
+
+def coarsen(dataset: xr.Dataset, factor: int) -> xr.Dataset:
+    """
+    Averages blocks of factor by factor cells of every data variable, weighting each cell by its
+    area and skipping missing cells, so the area weighted mean of any region made of whole blocks
+    is the same before and after. Each block is placed at the area weighted centre of its cells.
+    The result has ascending latitudes and longitudes in 0 to 360.
+
+    :param dataset: Dataset with lat and lon dimensions.
+    :param factor: How many cells along each axis go into a block.
+    """
+    dataset = dataset.assign_coords(lon=dataset["lon"] % 360).sortby(["lat", "lon"])
+    lat = np.asarray(dataset["lat"].values, dtype=np.float64)
+    lon = np.asarray(dataset["lon"].values, dtype=np.float64)
+    areas = cell_areas(lat, lon)
+    lat_weights = areas.sum(axis=1)
+
+    def block_mean(values: np.ndarray, weights: np.ndarray, lat_axis: int, lon_axis: int) -> np.ndarray:
+        total = _block_sum(_block_sum(values * weights, factor, lat_axis), factor, lon_axis)
+        weight = _block_sum(_block_sum(weights, factor, lat_axis), factor, lon_axis)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(weight > 0, total / weight, np.nan)
+
+    coarse_lat = _block_sum(lat * lat_weights, factor, 0) / _block_sum(lat_weights, factor, 0)
+    coarse_lon = _block_sum(lon, factor, 0) / _block_sum(np.ones_like(lon), factor, 0)
+    data_vars = {}
+    for name, variable in dataset.data_vars.items():
+        if "lat" not in variable.dims or "lon" not in variable.dims:
+            data_vars[name] = variable
+            continue
+        variable = variable.transpose(..., "lat", "lon")
+        values = np.asarray(variable.values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        weights = np.where(valid, areas, 0.0)
+        mean = block_mean(np.where(valid, values, 0.0), weights, -2, -1)
+        data_vars[name] = (variable.dims, mean.astype(variable.dtype, copy=False), variable.attrs)
+    coords = {name: coordinate for name, coordinate in dataset.coords.items() if "lat" not in coordinate.dims and "lon" not in coordinate.dims}
+    return xr.Dataset(data_vars, coords={**coords, "lat": coarse_lat, "lon": coarse_lon}, attrs=dataset.attrs)
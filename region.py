@@ -0,0 +1,190 @@
+# area weighted region means from summed area tables over (lat, lon)
+from dataclasses import dataclass
+from typing import Hashable, List, Tuple
+
+import numpy as np
+import xarray as xr
+
+from lru import SizedLRU
+from settings import REGION_CACHE_BYTES
+from timing import stage
+
+
+@dataclass(frozen=True)
+class Box:
+    """
+    A latitude/longitude box. Longitudes are in degrees east (0 to 360), and a box whose west edge
+    is greater than its east edge wraps around the dateline.
+    """
+    south: float
+    north: float
+    west: float
+    east: float
+
+
+def cell_areas(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    Returns the area of every grid cell on the unit sphere, with cell edges half way between the
+    centres of neighbouring cells. Latitudes must be ascending and longitudes ascending in 0 to 360.
+    """
+    lat_edges = np.concatenate(([-90.0], (lat[1:] + lat[:-1]) / 2, [90.0]))
+    lat_weights = np.diff(np.sin(np.deg2rad(lat_edges)))
+    if lon.size > 1:
+        wrapped = np.concatenate(([lon[-1] - 360], lon, [lon[0] + 360]))
+        lon_weights = np.deg2rad((wrapped[2:] - wrapped[:-2]) / 2)
+    else:
+        lon_weights = np.array([2 * np.pi])
+    return lat_weights[:, None] * lon_weights[None, :]
+
+
+def box_indexers(lat: np.ndarray, lon: np.ndarray, box: Box) -> dict:
+    """
+    Returns the lat and lon indices, for isel, of the grid cells whose centres fall inside a box,
+    in any grid order. The longitudes of a box that wraps run eastwards from its west edge. A box
+    that contains no cell centre along an axis gets the cell nearest its centre along that axis.
+    """
+    south, north = sorted((box.south, box.north))
+    lat_index = np.nonzero((lat >= south) & (lat <= north))[0]
+    if lat_index.size == 0:
+        lat_index = np.array([np.argmin(np.abs(lat - (south + north) / 2))])
+
+    lon = lon % 360
+    west, east = box.west % 360, box.east % 360
+    if west <= east:
+        lon_index = np.nonzero((lon >= west) & (lon <= east))[0]
+        lon_index = lon_index[np.argsort(lon[lon_index], kind="stable")]
+        centre = (west + east) / 2
+    else:
+        after, before = np.nonzero(lon >= west)[0], np.nonzero(lon <= east)[0]
+        lon_index = np.concatenate((after[np.argsort(lon[after], kind="stable")], before[np.argsort(lon[before], kind="stable")]))
+        centre = ((west + east + 360) / 2) % 360
+    if lon_index.size == 0:
+        lon_index = np.array([np.argmin(np.abs((lon - centre + 180) % 360 - 180))])
+    return {"lat": lat_index, "lon": lon_index}
+
+
+def _summed_area(values: np.ndarray) -> np.ndarray:
+    table = np.zeros(values.shape[:-2] + (values.shape[-2] + 1, values.shape[-1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(values, axis=-2), axis=-1, out=table[..., 1:, 1:])
+    return table
+
+
+def _box_sum(table: np.ndarray, lat_range: Tuple[int, int], lon_ranges: List[Tuple[int, int]]) -> np.ndarray:
+    i0, i1 = lat_range
+    total = 0
+    for j0, j1 in lon_ranges:
+        total = total + table[..., i1, j1] - table[..., i0, j1] - table[..., i1, j0] + table[..., i0, j0]
+    return total
+
+
+@dataclass
+class SummedAreaTables:
+    """
+    Summed area tables of the area weighted values of each data variable and of the weights, on
+    the grid sorted by ascending latitude and longitude.
+    """
+    lat: np.ndarray
+    lon: np.ndarray
+    template: xr.Dataset  # the dataset without lat/lon, carries the coordinates of the output
+    weighted: dict
+    weights: dict
+
+    @property
+    def nbytes(self) -> int:
+        return sum(table.nbytes for table in self.weighted.values()) + sum(table.nbytes for table in self.weights.values())
+
+    def lat_range(self, box: Box) -> Tuple[int, int]:
+        south, north = sorted((box.south, box.north))
+        i0 = np.searchsorted(self.lat, south, side="left")
+        i1 = np.searchsorted(self.lat, north, side="right")
+        if i0 >= i1:
+            # box falls between grid rows, use the row nearest its centre
+            i0 = int(np.argmin(np.abs(self.lat - (south + north) / 2)))
+            i1 = i0 + 1
+        return int(i0), int(i1)
+
+    def lon_ranges(self, box: Box) -> List[Tuple[int, int]]:
+        west, east = box.west % 360, box.east % 360
+        if west <= east:
+            ranges = [(np.searchsorted(self.lon, west, side="left"), np.searchsorted(self.lon, east, side="right"))]
+            centre = (west + east) / 2
+        else:
+            ranges = [(np.searchsorted(self.lon, west, side="left"), self.lon.size),
+                      (0, np.searchsorted(self.lon, east, side="right"))]
+            centre = ((west + east + 360) / 2) % 360
+        ranges = [(int(j0), int(j1)) for j0, j1 in ranges if j0 < j1]
+        if not ranges:
+            # box falls between grid columns, use the column nearest its centre
+            distance = np.abs((self.lon - centre + 180) % 360 - 180)
+            j = int(np.argmin(distance))
+            ranges = [(j, j + 1)]
+        return ranges
+
+
+def build_summed_area_tables(dataset: xr.Dataset) -> SummedAreaTables:
+    """
+    Precomputes the summed area tables of every data variable in a dataset with lat and lon
+    dimensions.
+    """
+    dataset = dataset.assign_coords(lon=dataset["lon"] % 360).sortby(["lat", "lon"])
+    lat = np.asarray(dataset["lat"].values, dtype=np.float64)
+    lon = np.asarray(dataset["lon"].values, dtype=np.float64)
+    areas = cell_areas(lat, lon)
+    weighted = {}
+    weights = {}
+    for name, variable in dataset.data_vars.items():
+        variable = variable.transpose(..., "lat", "lon")
+        values = np.asarray(variable.values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        weighted[name] = _summed_area(np.where(valid, values, 0.0) * areas)
+        weights[name] = _summed_area(areas) if valid.all() else _summed_area(valid * areas)
+    template = dataset.isel(lat=0, lon=0, drop=True)
+    return SummedAreaTables(lat=lat, lon=lon, template=template, weighted=weighted, weights=weights)
+
+
+def region_mean(tables: SummedAreaTables, box: Box) -> xr.Dataset:
+    """
+    Returns the area weighted mean of every data variable over the grid cells whose centres fall
+    inside a box. Boxes that contain no cell centre use the cell nearest their centre.
+    """
+    lat_range = tables.lat_range(box)
+    lon_ranges = tables.lon_ranges(box)
+    result = tables.template.copy()
+    for name in tables.weighted:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = _box_sum(tables.weighted[name], lat_range, lon_ranges) / _box_sum(tables.weights[name], lat_range, lon_ranges)
+        result[name] = result[name].copy(data=np.broadcast_to(mean, result[name].shape).copy())
+    return result
+
+
+class RegionEngine:
+    """
+    Averages datasets over boxes from their summed area tables.
+
+    :param max_bytes: The memory budget of the tables in bytes.
+    """
+
+    def __init__(self, max_bytes: int = REGION_CACHE_BYTES):
+        self._tables = SizedLRU(max_bytes)
+
+    def mean(self, key: Hashable, dataset: xr.Dataset, box: Box) -> xr.Dataset:
+        """
+        Returns the area weighted mean of a dataset over a box.
+
+        :param key: Identifies the dataset the tables are built from.
+        :param dataset: The dataset to average, it must have lat and lon dimensions.
+        :param box: The box to average over.
+        """
+        def create():
+            with stage("region-tables"):
+                tables = build_summed_area_tables(dataset)
+            return tables, tables.nbytes
+        tables = self._tables.get_or_create(key, create)
+        with stage("region"):
+            return region_mean(tables, box)
+
+    def stats(self) -> dict:
+        return self._tables.stats()
+
+
+regions = RegionEngine()
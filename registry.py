@@ -0,0 +1,110 @@
+# process wide registry of the zarr stores listed in data_sets.py
+import os
+from enum import Enum
+
+import xarray as xr
+
+from lru import SizedLRU
+from manifest import store_signature, store_versions
+from mmap_store import open_mapped
+from pyramid import LEVEL_FACTOR, coarsen, level_suffix
+from settings import MMAP_DIR, STORE_CACHE_BYTES
+from timing import CountingStore, stage
+
+
+class Layout(str, Enum):
+    """
+    The chunk layouts ingest.py writes for each .nc file, named by the suffix of their store.
+    Maps keep whole grids together, and series keep the whole time axis of a block of cells
+    together.
+    """
+    map = ".zarr"
+    series = ".ts.zarr"
+
+
+SERIES_SUFFIX = Layout.series.value
+
+
+def open_store(path: str, layout: Layout = Layout.map, level: int = 0) -> xr.Dataset:
+    """
+    Opens the zarr store converted from a .nc file in data_sets.py, and decodes its coordinate
+    arrays (lat, lon, time) into memory so selections never go back to the store for them.
+
+    :param path: The path of the .nc file as listed in data_sets.py.
+    :param layout: Which of the store's chunk layouts to open.
+    :param level: Which pyramid level of the map layout to open, 0 is the full grid.
+    """
+    store = path + (level_suffix(level) if level > 0 else layout.value)
+    # cache=False keeps full variable reads from silently pinning whole arrays to the handle, and
+    # the counting store reports the bytes each request reads to its timings
+    dataset = xr.open_dataset(CountingStore(store, read_only=True), engine="zarr", cache=False)
+    for name in dataset.coords:
+        dataset[name].variable.load()
+    return dataset
+
+
+def handle_size(dataset: xr.Dataset) -> int:
+    """
+    Estimates how much memory an open handle holds, which is its decoded coordinate arrays.
+    """
+    return sum(coordinate.nbytes for coordinate in dataset.coords.values())
+
+
+class DatasetRegistry:
+    """
+    Shares open zarr store handles across requests, so the metadata of each store is only parsed
+    once per process. Handles are evicted least recently used first once the decoded coordinates
+    held by the registry go over its memory budget.
+
+    :param max_bytes: The memory budget of the registry in bytes.
+    :param mmap_root: Serve every store from memory mapped copies in this directory instead,
+        see mmap_store.py. Copies sit in the page cache, so only their coordinates count against
+        the budget.
+    """
+
+    def __init__(self, max_bytes: int = STORE_CACHE_BYTES, mmap_root: str = MMAP_DIR):
+        self._handles = SizedLRU(max_bytes)
+        self.mmap_root = mmap_root
+
+    @staticmethod
+    def _read(path: str, layout: Layout, level: int) -> xr.Dataset:
+        if level == 0 or os.path.isdir(path + level_suffix(level)):
+            return open_store(path, layout, level)
+        return coarsen(open_store(path).load(), LEVEL_FACTOR ** level)
+
+    def open(self, path: str, layout: Layout = Layout.map, level: int = 0) -> xr.Dataset:
+        """
+        Returns the shared handle for a store, opening it on first use. Stores converted before
+        the timeseries layout existed only have the map layout, which is used for both. Pyramid
+        levels always have the map layout, and levels that were never written are coarsened from
+        the full grid into memory instead, counting their data against the budget.
+
+        :param path: The path of the .nc file as listed in data_sets.py.
+        :param layout: Which of the store's chunk layouts to open.
+        :param level: Which pyramid level to open, 0 is the full grid.
+        """
+        # a memory mapped copy has no chunks, so it serves every layout
+        if level > 0 or self.mmap_root is not None:
+            layout = Layout.map
+        if layout != Layout.map and not os.path.isdir(path + layout.value):
+            layout = Layout.map
+
+        def create():
+            with stage("open"):
+                if self.mmap_root is not None:
+                    dataset = open_mapped(self.mmap_root, path, level, store_signature(path) or "", lambda: self._read(path, layout, level))
+                    return dataset, handle_size(dataset)
+                dataset = self._read(path, layout, level)
+            if level > 0 and not os.path.isdir(path + level_suffix(level)):
+                return dataset, dataset.nbytes
+            return dataset, handle_size(dataset)
+        return self._handles.get_or_create((path, layout, level, store_versions.get(path)), create)
+
+    def clear(self):
+        self._handles.clear()
+
+    def stats(self) -> dict:
+        return self._handles.stats()
+
+
+registry = DatasetRegistry()
@@ -0,0 +1,173 @@
+# tiered cache of rendered endpoint results, in memory and optionally on disk
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zlib
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Hashable, Optional
+
+from fastapi.responses import Response
+
+from catalog import ETagJSONResponse
+from lru import SizedLRU
+from settings import RESULT_CACHE_BYTES, RESULT_CACHE_DIR, RESULT_DISK_CACHE_BYTES
+from timing import stage
+
+# bump when the shape of cached results changes, so old disk entries are never read
+RESULT_CACHE_VERSION = 1
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    media_type: str
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.body)
+
+    def response(self) -> Response:
+        return Response(self.body, media_type=self.media_type, headers=self.headers)
+
+    def dumps(self) -> bytes:
+        header = json.dumps({"media_type": self.media_type, "headers": self.headers}).encode()
+        return zlib.compress(header + b"\n" + self.body)
+
+    @staticmethod
+    def loads(blob: bytes) -> "CachedResponse":
+        header, _, body = zlib.decompress(blob).partition(b"\n")
+        header = json.loads(header)
+        return CachedResponse(body, header["media_type"], header["headers"])
+
+
+def render(result, headers: Optional[Dict[str, str]] = None) -> CachedResponse:
+    """
+    Renders an endpoint result the way FastAPI would, dicts become JSON and responses are kept
+    as they are. Dicts may hold numpy arrays.
+    """
+    if not isinstance(result, Response):
+        result = ETagJSONResponse(result)
+    response_headers = {name: value for name, value in result.headers.items() if name not in ("content-length", "content-type")}
+    response_headers.update({name.lower(): value for name, value in (headers or {}).items()})
+    return CachedResponse(bytes(result.body), result.media_type or result.headers.get("content-type"), response_headers)
+
+
+class DiskTier:
+    """
+    A directory of compressed result blobs bounded by their total size, oldest used first out.
+
+    :param directory: The directory to keep the blobs in, created if it does not exist.
+    :param max_bytes: The total size the blobs may take up on disk.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.current_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(".bin"))
+
+    def _path(self, key: Hashable) -> str:
+        return os.path.join(self.directory, hashlib.sha256(repr(key).encode()).hexdigest() + ".bin")
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                blob = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CachedResponse.loads(blob)
+
+    def put(self, key: Hashable, value: CachedResponse):
+        blob = value.dumps()
+        if len(blob) > self.max_bytes:
+            return
+        path = self._path(key)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(file_descriptor, "wb") as file:
+            file.write(blob)
+        with self._lock:
+            if os.path.exists(path):
+                self.current_bytes -= os.path.getsize(path)
+            os.replace(temporary_path, path)
+            self.current_bytes += len(blob)
+            if self.current_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith(".bin")), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self.current_bytes <= self.max_bytes:
+                break
+            size = entry.stat().st_size
+            os.remove(entry.path)
+            self.current_bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "bytes": self.current_bytes,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+        }
+
+
+class ResultCache:
+    """
+    Caches the rendered result of deterministic requests, first in memory and then, if a
+    directory is configured, on disk so results survive restarts. Keys should include the
+    versions of the stores a result was computed from, so re-ingested data is never served from
+    an old entry.
+
+    :param max_bytes: The memory budget of the in memory tier in bytes.
+    :param directory: The directory of the on disk tier, or None for no disk tier.
+    :param disk_max_bytes: The disk budget of the on disk tier in bytes.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_BYTES, directory: Optional[str] = RESULT_CACHE_DIR,
+                 disk_max_bytes: int = RESULT_DISK_CACHE_BYTES):
+        self._memory = SizedLRU(max_bytes)
+        self._disk = DiskTier(directory, disk_max_bytes) if directory else None
+
+    def response(self, key: Hashable, compute: Callable, *args, headers: Optional[Dict[str, str]] = None) -> Response:
+        """
+        Returns the cached response for a key, or computes compute(*args), renders and caches it.
+        Results that are already responses but not cacheable, like downloads, should not be
+        passed through here.
+
+        :param key: The normalized parameters and store versions of the request.
+        :param compute: The blocking function computing the result.
+        :param headers: Extra headers stored with the result, such as Vary.
+        """
+        key = (RESULT_CACHE_VERSION, key)
+
+        def create():
+            cached = self._disk.get(key) if self._disk else None
+            if cached is None:
+                result = compute(*args)
+                with stage("render"):
+                    cached = render(result, headers)
+                if self._disk:
+                    self._disk.put(key, cached)
+            return cached, cached.nbytes
+        return self._memory.get_or_create(key, create).response()
+
+    def stats(self) -> dict:
+        return {"memory": self._memory.stats(), "disk": self._disk.stats() if self._disk else None}
+
+
+results = ResultCache()
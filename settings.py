@@ -0,0 +1,79 @@
+# runtime settings for the api, each one can be overridden with an environment variable
+import os
+
+# memory budget for open zarr store handles and their decoded coordinates
+STORE_CACHE_BYTES = int(os.environ.get("PV_STORE_CACHE_MB", "512")) * 1024 * 1024
+
+# memory budget for the prefix sums the trend engine keeps per reconstruction
+TREND_CACHE_BYTES = int(os.environ.get("PV_TREND_CACHE_MB", "1024")) * 1024 * 1024
+
+# reference period anomalies are moved to when move_reference is set, as "startYear-endYear"
+REFERENCE_PERIOD = tuple(int(year) for year in os.environ.get("PV_REFERENCE_PERIOD", "1979-2005").split("-"))
+
+# memory budget for the reference period climatologies kept per store
+CLIMATOLOGY_CACHE_BYTES = int(os.environ.get("PV_CLIMATOLOGY_CACHE_MB", "128")) * 1024 * 1024
+
+# compute every climatology when the app starts instead of on first use
+PRECOMPUTE_CLIMATOLOGY = os.environ.get("PV_PRECOMPUTE_CLIMATOLOGY", "0") == "1"
+
+# memory budget for the summed area tables used for region means
+REGION_CACHE_BYTES = int(os.environ.get("PV_REGION_CACHE_MB", "1024")) * 1024 * 1024
+
+# build time catalog of the stores, written by `python manifest.py`
+MANIFEST_PATH = os.environ.get("PV_MANIFEST_PATH", "./data/manifest.json")
+
+# how many requests of each endpoint may compute at the same time, as "endpoint=limit,..."
+COMPUTE_LIMITS = {"default": 4, "timeseries-area": 2, "trend": 2}
+COMPUTE_LIMITS.update({
+    endpoint.strip(): int(limit)
+    for endpoint, _, limit in (pair.partition("=") for pair in os.environ.get("PV_COMPUTE_LIMITS", "").split(",") if pair)
+})
+
+# memory budget for rendered endpoint results
+RESULT_CACHE_BYTES = int(os.environ.get("PV_RESULT_CACHE_MB", "256")) * 1024 * 1024
+
+# directory for the on disk tier of the result cache, unset to keep results in memory only
+RESULT_CACHE_DIR = os.environ.get("PV_RESULT_CACHE_DIR") or None
+
+# disk budget for the on disk tier of the result cache
+RESULT_DISK_CACHE_BYTES = int(os.environ.get("PV_RESULT_DISK_CACHE_MB", "2048")) * 1024 * 1024
+
+# record per stage timings of every request, sent as a Server-Timing header and served on /metrics
+TIMING_ENABLED = os.environ.get("PV_TIMING", "1") == "1"
+
+# most points a single timeseries-batch request may ask for
+BATCH_MAX_POINTS = int(os.environ.get("PV_BATCH_MAX_POINTS", "100"))
+
+# number of coarser, area weighted levels ingest.py writes next to each map store, each halving the grid
+PYRAMID_LEVELS = int(os.environ.get("PV_PYRAMID_LEVELS", "3"))
+
+# directory of uncompressed, memory mapped copies of the stores shared by every worker, unset to
+# read the zarr stores directly
+MMAP_DIR = os.environ.get("PV_MMAP_DIR") or None
+
+# the proxy record table served by /proxies, loaded once at startup
+PROXIES_PATH = os.environ.get("PV_PROXIES_PATH", "./proxies.pkl")
+
+# years read from a store at once by the annual map stream, the first frame waits for the first batch
+STREAM_BATCH_YEARS = int(os.environ.get("PV_STREAM_BATCH_YEARS", "8"))
+
+# memory budget for the nearest grid cell tables used for point lookups, a few kB per grid
+NEAREST_CACHE_BYTES = int(os.environ.get("PV_NEAREST_CACHE_MB", "16")) * 1024 * 1024
+
+# compress responses with gzip, or brotli when it is installed, for clients that accept it
+COMPRESSION_ENABLED = os.environ.get("PV_COMPRESSION", "1") == "1"
+
+# responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_BYTES = int(os.environ.get("PV_COMPRESSION_MIN_BYTES", "1024"))
+
+# memory budget for the compressed copies of cached responses
+COMPRESSION_CACHE_BYTES = int(os.environ.get("PV_COMPRESSION_CACHE_MB", "128")) * 1024 * 1024
+
+# disk budget for finished downloads kept by request, 0 to render every download again
+DOWNLOAD_CACHE_BYTES = int(os.environ.get("PV_DOWNLOAD_CACHE_MB", "2048")) * 1024 * 1024
+
+# directory the download cache and download temporary files go in, the system temporary directory if unset
+DOWNLOAD_CACHE_DIR = os.environ.get("PV_DOWNLOAD_CACHE_DIR") or None
+
+# seconds a store version is trusted before the store is checked for a rewrite again
+STORE_VERSION_TTL = float(os.environ.get("PV_STORE_VERSION_TTL", "10"))
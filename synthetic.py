@@ -0,0 +1,154 @@
+# Writes synthetic zarr stores in the layout data_sets.py expects, for development and benchmarks
+# without the real data. Run `python synthetic.py --help` for the available options.
+import argparse
+import os
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+import xarray as xr
+
+from data_sets import datasets, instrumental
+from ingest import IngestOptions, write_layout, write_pyramid
+from manifest import store_signature, write_manifest
+from registry import SERIES_SUFFIX
+
+
+@dataclass(frozen=True)
+class SyntheticGrid:
+    """
+    The shape of the stores generated for one dataset.
+
+    :param lat: Number of latitudes, evenly spaced from pole to pole.
+    :param lon: Number of longitudes, evenly spaced from 0 degrees east.
+    :param time_start: First year of the time axis.
+    :param time_end: Last year of the time axis.
+    :param descending_lat: Write latitudes north to south, as ERA5 does.
+    """
+    lat: int
+    lon: int
+    time_start: int = 1900
+    time_end: int = 2005
+    descending_lat: bool = False
+
+
+# roughly the native grids of each model, and a one degree ERA5
+GRIDS: Dict[str, SyntheticGrid] = {
+    "cesm": SyntheticGrid(96, 144),
+    "hadcm3": SyntheticGrid(73, 96),
+    "lens": SyntheticGrid(192, 288, time_start=1920),
+    "lens2": SyntheticGrid(192, 288),
+    "pace": SyntheticGrid(192, 288),
+    "pace2": SyntheticGrid(192, 288),
+    "era5": SyntheticGrid(181, 360, descending_lat=True),
+}
+
+DEFAULT_GRID = SyntheticGrid(96, 144)
+
+# ERA5 names its variables differently from the reconstructions
+INSTRUMENTAL_NAMES = {"psl": "msl", "tas": "t2m"}
+
+# (mean at the equator, change towards the poles, year to year variability) per variable
+CLIMATES = {
+    "psl": (101325.0, -1500.0, 300.0),
+    "tas": (300.0, -50.0, 1.0),
+    "u10": (0.0, 6.0, 1.5),
+    "v10": (0.0, 1.0, 1.5),
+}
+
+
+def scaled(grid: SyntheticGrid, scale: float) -> SyntheticGrid:
+    return SyntheticGrid(max(2, round(grid.lat * scale)), max(2, round(grid.lon * scale)), grid.time_start, grid.time_end, grid.descending_lat)
+
+
+def synthetic_dataset(variable_id: str, name: str, grid: SyntheticGrid, seed: int) -> xr.Dataset:
+    """
+    Builds a float32 field with a latitude dependent climate, a spatially varying trend, a large
+    scale signal shared by every dataset of the variable and independent red noise, so trends,
+    anomalies and correlations against ERA5 all look plausible.
+
+    :param variable_id: The id of the variable in data_sets.py.
+    :param name: The name of the data variable inside the store.
+    :param grid: The shape of the store.
+    :param seed: Seed of the noise that is specific to this store.
+    """
+    mean, polar_change, variability = CLIMATES.get(variable_id, (0.0, 1.0, 1.0))
+    lat = np.linspace(-90, 90, grid.lat)
+    if grid.descending_lat:
+        lat = lat[::-1]
+    lon = np.arange(grid.lon) * (360 / grid.lon)
+    years = np.arange(grid.time_start, grid.time_end + 1)
+
+    lat_radians = np.deg2rad(lat)[:, np.newaxis]
+    lon_radians = np.deg2rad(lon)[np.newaxis, :]
+    climate = mean + polar_change * np.sin(lat_radians) ** 2
+    trend_pattern = variability * 0.02 * np.cos(2 * lat_radians) * np.cos(lon_radians)
+    signal_pattern = np.sin(3 * lat_radians) * np.cos(2 * lon_radians)
+
+    # the shared signal depends on the variable alone, so every dataset tracks ERA5 somewhat
+    signal = np.random.default_rng(sum(variable_id.encode())).normal(size=len(years))
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(size=(len(years), grid.lat, grid.lon)).astype(np.float32)
+    for i in range(1, len(years)):
+        noise[i] += 0.5 * noise[i - 1]
+
+    elapsed = (years - years.mean())[:, np.newaxis, np.newaxis]
+    values = climate + elapsed * trend_pattern + variability * (signal[:, np.newaxis, np.newaxis] * signal_pattern + noise)
+    return xr.Dataset(
+        {name: (("time", "lat", "lon"), values.astype(np.float32))},
+        coords={"time": years, "lat": lat, "lon": lon},
+    )
+
+
+def generate(scale: float = 1.0, force: bool = False, options: IngestOptions = IngestOptions()) -> List[str]:
+    """
+    Writes both chunk layouts and the coarser levels of every store listed in data_sets.py,
+    relative to the working directory, then the store manifest, and returns the paths it wrote. Existing stores are left
+    alone unless force is set.
+
+    :param scale: Multiplies the number of latitudes and longitudes of every grid.
+    :param force: Overwrite stores that already exist.
+    :param options: How the stores are written.
+    """
+    written = []
+    paths = []
+    for dataset in [*datasets.values(), instrumental]:
+        grid = scaled(GRIDS.get(dataset.id, DEFAULT_GRID), scale)
+        for variable_id, path in dataset.variables.items():
+            paths.append(path)
+            if not force and (os.path.isdir(path + ".zarr") or os.path.isdir(path + SERIES_SUFFIX)):
+                print(f"{path}: exists, skipping")
+                continue
+            name = INSTRUMENTAL_NAMES.get(variable_id, variable_id) if dataset is instrumental else variable_id
+            data = synthetic_dataset(variable_id, name, grid, zlib.crc32(path.encode()))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_layout(data, path + ".zarr", {"time": options.map_time_chunk, "lat": -1, "lon": -1}, options)
+            write_layout(data, path + SERIES_SUFFIX, {"time": -1, "lat": options.series_space_chunk, "lon": options.series_space_chunk}, options)
+            write_pyramid(data, path, options)
+            written.append(path)
+            print(f"{path}: {grid.lat}x{grid.lon}, {grid.time_start}-{grid.time_end}")
+    write_manifest(paths)
+    return written
+
+
+def all_stores_exist() -> bool:
+    return all(store_signature(path) is not None for dataset in [*datasets.values(), instrumental] for path in dataset.variables.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic zarr stores for every file in data_sets.py.")
+    parser.add_argument("--root", default=".", help="directory the ./data paths of data_sets.py are relative to")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the number of latitudes and longitudes of every grid")
+    parser.add_argument("--force", action="store_true", help="overwrite existing stores, including real data")
+    arguments = parser.parse_args()
+
+    os.chdir(arguments.root)
+    started = time.perf_counter()
+    written = generate(arguments.scale, arguments.force)
+    print(f"Wrote {len(written)} synthetic stores in {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+from catalog import etag, etag_matches
+
+def test_etag_is_stable_and_strong():
+    assert etag(b"body") == etag(b"body")
+    assert etag(b"body") != etag(b"other")
+    assert not etag(b"body").startswith("W/")
+
+def test_etag_matches():
+    tag = etag(b"body")
+    assert etag_matches(tag, tag)
+    assert etag_matches(f'"other", W/{tag}', tag)
+    assert etag_matches("*", tag)
+    assert not etag_matches(None, tag)
+    assert not etag_matches('"other"', tag)
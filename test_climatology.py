@@ -0,0 +1,33 @@
+import numpy as np
+import xarray as xr
+from climatology import ClimatologyCache
+from pyramid import coarsen
+
+def write_store(tmp_path) -> tuple:
+    rng = np.random.default_rng(3)
+    values = rng.normal(size=(40, 6, 8)).astype(np.float32)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    data = xr.Dataset({"tas": (("time", "lat", "lon"), values)}, coords={
+        "time": np.arange(1970, 2010), "lat": np.linspace(-75, 75, 6), "lon": np.arange(0, 360, 45.0)})
+    path = str(tmp_path / "tas.nc")
+    data.to_zarr(path + ".zarr", mode="w")
+    return path, data
+
+def reference(data: xr.Dataset, period: tuple) -> xr.Dataset:
+    # the mean of the years inside the period, grouped by whether each year is in it
+    inside = xr.DataArray((data["time"] >= period[0]) & (data["time"] <= period[1]), dims="time", name="inside")
+    return data.groupby(inside).mean(dim="time").sel(inside=True, drop=True)
+
+def test_climatology_matches_groupby_mean(tmp_path):
+    path, data = write_store(tmp_path)
+    cache = ClimatologyCache(max_bytes=1 << 20)
+    for period in [(1979, 2005), (1970, 1970), (2000, 2030)]:
+        xr.testing.assert_allclose(cache.get(path, period), reference(data, period))
+    # each period is computed once
+    cache.get(path, (1979, 2005))
+    assert cache.stats()["hits"] == 1
+
+def test_climatology_of_a_pyramid_level(tmp_path):
+    path, data = write_store(tmp_path)
+    cache = ClimatologyCache(max_bytes=1 << 20)
+    xr.testing.assert_allclose(cache.get(path, (1979, 2005), level=1), reference(coarsen(data, 2), (1979, 2005)), rtol=1e-5)
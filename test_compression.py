@@ -0,0 +1,82 @@
+import asyncio
+import gzip
+import zlib
+import pytest
+from fastapi.testclient import TestClient
+from compression import CompressedBodies, compress, compress_stream, negotiate, supported_encodings
+
+def test_negotiate():
+    assert negotiate(None) is None
+    assert negotiate("identity") is None
+    assert negotiate("gzip, deflate") == "gzip"
+    assert negotiate("gzip;q=0, identity") is None
+    assert negotiate("*") == supported_encodings()[0]
+    assert negotiate("br;q=0.5, gzip;q=0.8") == "gzip"
+    assert negotiate("br") == ("br" if "br" in supported_encodings() else None)
+
+def test_compress_round_trip():
+    body = b'{"values":[' + b",".join(str(i / 7).encode() for i in range(2000)) + b"]}"
+    for encoding in supported_encodings():
+        compressed = compress(body, encoding)
+        assert len(compressed) < len(body)
+        if encoding == "gzip":
+            assert gzip.decompress(compressed) == body
+
+def test_stream_chunks_decode_as_they_arrive():
+    chunks = [f'{{"year":{year},"values":[{year / 3}]}}\n'.encode() for year in range(50)]
+
+    async def body():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [part async for part in compress_stream(body(), "gzip")]
+
+    parts = asyncio.run(collect())
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    # every chunk is readable from the parts sent so far, without waiting for the end of the stream
+    for chunk, part in zip(chunks, parts):
+        assert decompressor.decompress(part) == chunk
+    assert b"".join(chunks) == gzip.decompress(b"".join(parts))
+
+def test_bodies_are_compressed_once_per_tag_and_encoding():
+    bodies = CompressedBodies(max_bytes=1 << 20)
+    body = b"a" * 10000
+    first = bodies.compress('"tag"', "gzip", body)
+    assert bodies.compress('"tag"', "gzip", b"not compressed again") is first
+    assert bodies.compress('"other"', "gzip", body) is not first
+    assert bodies.stats()["misses"] == 2 and bodies.stats()["hits"] == 1
+
+@pytest.fixture
+def client(main, monkeypatch):
+    monkeypatch.setattr(main, "compressed_bodies", CompressedBodies(max_bytes=1 << 24))
+    monkeypatch.setattr(main, "COMPRESSION_MIN_BYTES", 0)
+    return TestClient(main.app)
+
+def test_revalidation_sends_the_compressed_representation_headers(client):
+    response = client.get("/proxies", headers={"accept-encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    tag = response.headers["etag"]
+    assert tag.startswith("W/")
+    revalidated = client.get("/proxies", headers={"accept-encoding": "gzip", "if-none-match": tag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == tag
+    assert revalidated.headers["vary"] == response.headers["vary"] == "Accept-Encoding"
+    # without compression the tag stays strong, for the 200 and the 304 alike
+    plain = client.get("/proxies", headers={"accept-encoding": "identity"})
+    assert "content-encoding" not in plain.headers and not plain.headers["etag"].startswith("W/")
+    revalidated = client.get("/proxies", headers={"accept-encoding": "identity", "if-none-match": plain.headers["etag"]})
+    assert revalidated.status_code == 304 and revalidated.headers["etag"] == plain.headers["etag"]
+
+def test_each_body_is_looked_up_once(main, client):
+    for _ in range(3):
+        client.get("/proxies", headers={"accept-encoding": "gzip"})
+    stats = main.compressed_bodies.stats()
+    assert (stats["misses"], stats["hits"]) == (1, 2)
+
+def test_stats_are_compressed_but_never_kept(main, client):
+    for _ in range(2):
+        response = client.get("/stats", headers={"accept-encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert "compression" in response.json()
+    assert main.compressed_bodies.stats()["entries"] == 0
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import xarray as xr
+from fastapi import HTTPException
+from scipy.stats import pearsonr
+from correlation import align, pearson, correlation_map
+
+def test_pearson_matches_scipy_for_every_series():
+    rng = np.random.default_rng(2)
+    x = rng.normal(size=40)
+    y = x[:, np.newaxis] * np.array([0.1, 1.0, -2.0]) + rng.normal(size=(40, 3))
+    r, p_value = pearson(x[:, np.newaxis], y)
+    for i in range(3):
+        expected = pearsonr(x, y[:, i])
+        np.testing.assert_allclose([r[i], p_value[i]], [expected.statistic, expected.pvalue], rtol=1e-9, atol=1e-12)
+
+def test_pearson_skips_missing_pairs():
+    rng = np.random.default_rng(3)
+    x = rng.normal(size=30)
+    y = x + rng.normal(size=30)
+    y[[2, 7, 11]] = np.nan
+    valid = ~np.isnan(y)
+    r, p_value = pearson(x, y)
+    expected = pearsonr(x[valid], y[valid])
+    np.testing.assert_allclose([r, p_value], [expected.statistic, expected.pvalue], rtol=1e-9)
+    assert np.isnan(pearson(x[:2], y[:2])[0])
+
+def test_correlation_map_aligns_years_and_grids():
+    rng = np.random.default_rng(4)
+    reconstruction = xr.DataArray(rng.normal(size=(60, 2, 3)), dims=("time", "lat", "lon"), coords={
+        "time": np.arange(1900, 1960), "lat": [0.0, 10.0], "lon": [0.0, 10.0, 20.0]})
+    # a finer, descending instrumental grid covering fewer years
+    instrumental = xr.DataArray(rng.normal(size=(40, 3, 5)), dims=("time", "lat", "lon"), coords={
+        "time": np.arange(1930, 1970), "lat": [10.0, 5.0, 0.0], "lon": [0.0, 5.0, 10.0, 15.0, 20.0]})
+    r, p_value = correlation_map(reconstruction, instrumental, 1935, 1965)
+    expected = pearsonr(reconstruction.sel(time=slice(1935, 1959), lat=10.0, lon=20.0).values,
+                        instrumental.sel(time=slice(1935, 1959), lat=10.0, lon=20.0).values)
+    assert r.dims == ("lat", "lon")
+    np.testing.assert_allclose(r.sel(lat=10.0, lon=20.0), expected.statistic, rtol=1e-9)
+    np.testing.assert_allclose(p_value.sel(lat=10.0, lon=20.0), expected.pvalue, rtol=1e-9)
+
+def test_align_returns_shared_years():
+    index_a, index_b = align(np.array([1, 2, 3, 5]), np.array([5, 3, 9]))
+    np.testing.assert_array_equal(index_a, [2, 3])
+    np.testing.assert_array_equal(index_b, [1, 0])
+
+def test_correlation_map_of_a_window_without_reconstruction_years():
+    rng = np.random.default_rng(5)
+    reconstruction = xr.DataArray(rng.normal(size=(60, 2, 3)), dims=("time", "lat", "lon"), coords={
+        "time": np.arange(1900, 1960), "lat": [0.0, 10.0], "lon": [0.0, 10.0, 20.0]})
+    r, p_value = correlation_map(reconstruction, reconstruction, 1700, 1800)
+    assert r.dims == ("lat", "lon") and r.shape == (2, 3)
+    np.testing.assert_array_equal(r["lon"], [0.0, 10.0, 20.0])
+    assert np.isnan(r).all() and np.isnan(p_value).all()
+
+def test_correlation_of_a_window_without_shared_years_is_a_bad_request(main):
+    with pytest.raises(HTTPException) as error:
+        main.calculateCorrelation("tas", "cesm", 1700, 1800)
+    assert error.value.status_code == 400
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from fastapi import FastAPI
+from fastapi.responses import FileResponse, Response
+from fastapi.testclient import TestClient
+
+import download
+from download import ArtifactCache, csv_chunks, netCDF_download
+
+def make_dataset() -> xr.Dataset:
+    return xr.Dataset({"tas": (("time", "lat"), np.arange(6, dtype=np.float32).reshape(3, 2))}, coords={"time": [2000, 2001, 2002], "lat": [-10.0, 10.0]})
+
+def files(directory: str, suffix: str) -> list:
+    return [name for name in os.listdir(directory) if name.endswith(suffix)]
+
+def test_netcdf_temporary_file_is_removed_once_sent(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "downloads", ArtifactCache(parent=str(tmp_path)))
+    app = FastAPI()
+    app.get("/nc")(lambda: netCDF_download(make_dataset(), "test data"))
+    response = TestClient(app).get("/nc")
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == 'attachment; filename="test_data.nc"'
+    (tmp_path / "sent.nc").write_bytes(response.content)
+    with xr.open_dataset(tmp_path / "sent.nc") as sent:
+        xr.testing.assert_equal(sent, make_dataset())
+    assert files(download.downloads.directory, ".nc") == []
+    assert download.downloads.stats()["bytesWritten"]["nc"] == len(response.content)
+
+def test_netcdf_temporary_file_is_removed_when_writing_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "downloads", ArtifactCache(parent=str(tmp_path)))
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(xr.Dataset, "to_netcdf", fail)
+    with pytest.raises(OSError):
+        netCDF_download(make_dataset(), "test")
+    assert os.listdir(download.downloads.directory) == []
+
+def test_csv_chunks_match_to_csv():
+    rng = np.random.default_rng(4)
+    frame = pd.DataFrame({"time": np.arange(5000), "ERA5_msl": rng.normal(size=5000), "LENS_psl": rng.normal(size=5000)})
+    frame.loc[frame.index % 7 == 0, "LENS_psl"] = np.nan
+    assert "".join(csv_chunks(frame)) == frame.to_csv(index=False)
+    assert "".join(csv_chunks(frame.iloc[:0])) == frame.iloc[:0].to_csv(index=False)
+
+def test_artifact_cache_serves_hits_and_evicts(tmp_path):
+    cache = ArtifactCache(max_bytes=150, parent=str(tmp_path))
+    calls = []
+    def compute(body: bytes) -> Response:
+        calls.append(body)
+        return Response(body, media_type="application/x-matlab-data", headers={"Content-Disposition": 'attachment; filename="a.mat"'})
+
+    cache.response("a", compute, b"a" * 100)
+    hit = cache.response("a", compute, b"a" * 100)
+    assert isinstance(hit, FileResponse) and calls == [b"a" * 100]
+    assert hit.headers["content-disposition"] == 'attachment; filename="a.mat"'
+    with open(hit.path, "rb") as file:
+        assert file.read() == b"a" * 100
+    # the second artifact goes over the budget, so the first one and its file go
+    cache.response("b", compute, b"b" * 100)
+    assert cache.stats()["evictions"] == 1 and cache.stats()["entries"] == 1
+    assert len(files(cache.directory, ".artifact")) == 1
+    cache.response("a", compute, b"a" * 100)
+    assert len(calls) == 3
@@ -0,0 +1,27 @@
+import asyncio
+import threading
+from executor import ComputeExecutor
+
+def test_identical_requests_share_one_computation():
+    executor = ComputeExecutor({"default": 2})
+    release = threading.Event()
+    calls = []
+
+    def work(value):
+        calls.append(value)
+        release.wait(5)
+        return value * 2
+
+    async def run():
+        first = asyncio.ensure_future(executor.run("endpoint", ("a",), work, 1))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(executor.run("endpoint", ("a",), work, 1))
+        other = asyncio.ensure_future(executor.run("endpoint", None, work, 2))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(first, second, other)
+
+    assert asyncio.run(run()) == [2, 2, 4]
+    assert sorted(calls) == [1, 2]
+    stats = executor.stats()["endpoint"]
+    assert stats["coalesced"] == 1 and stats["completed"] == 2 and stats["limit"] == 2
@@ -0,0 +1,55 @@
+import numpy as np
+from grid_encoding import FrameEncoder, GridEncoding, STREAM_MEDIA_TYPE, decode_grid, decode_stream, encode_frame, encode_grid, encode_stream_header, negotiate
+
+def test_negotiate():
+    assert negotiate(None) is None
+    assert negotiate("application/json") is None
+    assert negotiate("application/json, application/vnd.pv.grid") == GridEncoding.float32
+    assert negotiate("application/vnd.pv.grid; quantize=int16") == GridEncoding.int16
+    assert negotiate("application/vnd.pv.grid;q=0, application/json") is None
+    assert negotiate("application/vnd.pv.grid; quantize=int16; q=0.5, application/json") == GridEncoding.int16
+    assert negotiate("application/vnd.pv.grid;q=nope") is None
+    assert negotiate("application/vnd.pv.grid", STREAM_MEDIA_TYPE) is None
+    assert negotiate("application/vnd.pv.grid-stream; quantize=int16", STREAM_MEDIA_TYPE) == GridEncoding.int16
+
+def test_encode_grid_round_trip():
+    lats = np.array([-80.0, -70.0, -60.0])
+    lons = np.array([-170.0, 0.0, 10.0, 170.0])
+    values = np.arange(12, dtype=np.float64).reshape(3, 4) / 7
+    values[1, 2] = np.nan
+    for encoding, tolerance in [(GridEncoding.float32, 1e-6), (GridEncoding.int16, 1e-4)]:
+        metadata, decoded_lats, decoded_lons, decoded = decode_grid(encode_grid(lats, lons, values, {"bound": 1}, encoding))
+        assert metadata == {"bound": 1}
+        np.testing.assert_array_equal(decoded_lats, lats)
+        np.testing.assert_array_equal(decoded_lons, lons)
+        np.testing.assert_allclose(decoded, values, atol=tolerance)
+
+def test_stream_round_trip_with_deltas():
+    rng = np.random.default_rng(2)
+    lats = np.array([-80.0, -70.0, -60.0])
+    lons = np.array([-170.0, 0.0, 10.0, 170.0])
+    # a slow drift, so quantization errors would add up if deltas were taken from exact values
+    grids = 1000 + np.cumsum(rng.normal(size=(30, 3, 4)), axis=0)
+    grids[4, 1, 1] = np.nan
+    grids[9:, 0, 0] = np.nan
+    # the cell that comes back after going missing sends its whole value as a delta, which widens
+    # the int16 quantization step of that frame
+    for encoding, tolerance in [(GridEncoding.float32, 1e-3), (GridEncoding.int16, 1e-2)]:
+        for delta in (False, True):
+            encoder = FrameEncoder(encoding, delta)
+            payload = encode_stream_header(lats, lons, {"years": list(range(30))})
+            payload += b"".join(encode_frame(encoder, 1900 + i, 5.0, grid) for i, grid in enumerate(grids))
+            metadata, decoded_lats, decoded_lons, frames = decode_stream(payload)
+            assert metadata == {"years": list(range(30))}
+            np.testing.assert_array_equal(decoded_lons, lons)
+            assert [year for year, _, _ in frames] == list(range(1900, 1930))
+            np.testing.assert_allclose(np.stack([values for _, _, values in frames]), grids, atol=tolerance)
+
+def test_json_frames_send_deltas_from_the_previous_frame():
+    encoder = FrameEncoder(None, delta=True)
+    first = np.array([[1.0, np.nan], [3.0, 4.0]])
+    second = np.array([[2.0, 5.0], [np.nan, 4.5]])
+    assert encoder.encode(first)[3] is False
+    sent, _, _, is_delta = encoder.encode(second)
+    assert is_delta
+    np.testing.assert_array_equal(sent, [[1.0, 5.0], [np.nan, 0.5]])
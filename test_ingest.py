@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+from ingest import IngestOptions, convert, ingest
+from pyramid import level_suffix
+from settings import PYRAMID_LEVELS
+from synthetic import SyntheticGrid, synthetic_dataset
+
+def write_netcdf(tmp_path, dtype: str = "float32") -> tuple:
+    data = synthetic_dataset("tas", "tas", SyntheticGrid(12, 20, 1950, 1979, descending_lat=True), seed=5)
+    data["tas"] = data["tas"].astype(dtype)
+    path = str(tmp_path / "tas.nc")
+    data.to_netcdf(path)
+    return path, data
+
+def test_ingest_writes_both_layouts(tmp_path):
+    path, data = write_netcdf(tmp_path)
+    results = ingest([path], IngestOptions(map_time_chunk=4, series_space_chunk=8), workers=1)
+    assert [result.path for result in results] == [path]
+    assert results[0].map_bytes > 0 and results[0].series_bytes > 0
+
+    with xr.open_dataset(path + ".zarr", engine="zarr") as maps, xr.open_dataset(path + ".ts.zarr", engine="zarr") as series:
+        xr.testing.assert_identical(maps.load(), data)
+        xr.testing.assert_identical(series.load(), data)
+        assert maps["tas"].encoding["chunks"] == (4, 12, 20)
+        assert series["tas"].encoding["chunks"] == (30, 8, 8)
+    for level in range(1, PYRAMID_LEVELS + 1):
+        assert os.path.isdir(path + level_suffix(level))
+    assert not os.path.exists(path + ".zarr.tmp")
+
+@pytest.mark.parametrize("compression", ["zstd", "blosc", "gzip", "none"])
+def test_convert_round_trips_with_every_compression(tmp_path, compression):
+    path, data = write_netcdf(tmp_path, dtype="float64")
+    convert(path, IngestOptions(compression=compression, float32=True))
+    with xr.open_dataset(path + ".ts.zarr", engine="zarr") as series:
+        assert series["tas"].dtype == np.float32
+        np.testing.assert_array_equal(series["tas"].values, data["tas"].values.astype(np.float32))
+        assert len(series["tas"].encoding["compressors"]) == (0 if compression == "none" else 1)
+
+def test_unknown_compression(tmp_path):
+    path, _ = write_netcdf(tmp_path)
+    with pytest.raises(ValueError):
+        convert(path, IngestOptions(compression="lzma"))
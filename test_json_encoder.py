@@ -0,0 +1,26 @@
+import json
+from enum import Enum
+import numpy as np
+import json_encoder
+from json_encoder import dumps
+
+class Mode(str, Enum):
+    trend = "trend"
+
+def test_numpy_content_matches_plain_json(monkeypatch):
+    content = {
+        "values": np.array([[1900.0, 0.5], [1901.0, -8.3e-05]]),
+        "float32": np.float32(0.25),
+        "count": np.int64(3),
+        "mode": Mode.trend,
+        "name": "Trend 1900-2005",
+    }
+    expected = {"values": [[1900.0, 0.5], [1901.0, -8.3e-05]], "float32": 0.25, "count": 3, "mode": "trend", "name": "Trend 1900-2005"}
+    assert json.loads(dumps(content)) == expected
+    monkeypatch.setattr(json_encoder, "orjson", None)
+    assert dumps(content) == json.dumps(expected, separators=(",", ":")).encode()
+
+def test_missing_values_become_null(monkeypatch):
+    for orjson in (json_encoder.orjson, None):
+        monkeypatch.setattr(json_encoder, "orjson", orjson)
+        assert json.loads(dumps({"values": np.array([1.0, np.nan])})) == {"values": [1.0, None]}
@@ -0,0 +1,39 @@
+from lru import SizedLRU
+
+def test_sized_lru_evicts_least_recently_used():
+    cache = SizedLRU(10)
+    cache.put("a", 1, 4)
+    cache.put("b", 2, 4)
+    assert cache.get("a") == 1
+    cache.put("c", 3, 4)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+    assert cache.current_bytes == 8
+
+def test_sized_lru_skips_oversized_values():
+    cache = SizedLRU(10)
+    cache.put("a", 1, 11)
+    assert "a" not in cache
+    assert cache.current_bytes == 0
+
+def test_sized_lru_get_or_create_counts():
+    cache = SizedLRU(10)
+    calls = []
+    def create():
+        calls.append(1)
+        return "value", 1
+    assert cache.get_or_create("a", create) == "value"
+    assert cache.get_or_create("a", create) == "value"
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+def test_sized_lru_reports_evicted_values():
+    evicted = []
+    cache = SizedLRU(10, on_evict=lambda key, value: evicted.append((key, value)))
+    cache.put("a", 1, 6)
+    cache.put("b", 2, 6)
+    cache.put("c", 3, 11)
+    cache.clear()
+    assert evicted == [("a", 1), ("c", 3), ("b", 2)]
@@ -0,0 +1,112 @@
+import numpy as np
+import xarray as xr
+import ingest
+import manifest
+from climatology import ClimatologyCache
+from data_sets import datasets
+from fastapi.testclient import TestClient
+from nearest import NearestIndexEngine
+from region import RegionEngine
+from registry import registry
+from results import ResultCache
+from synthetic import GRIDS, generate, scaled, synthetic_dataset
+from trend import TrendEngine
+from manifest import StoreVersions, build_manifest, describe_store, is_fresh, load_manifest, store_layouts, store_version, write_manifest
+
+def write_layout(store: str, offset: float = 0.0):
+    values = np.arange(24, dtype=np.float32).reshape(4, 2, 3) + offset
+    data = xr.Dataset({"tas": (("time", "lat", "lon"), values)}, coords={"time": [2000, 2001, 2002, 2003], "lat": [-10.0, 10.0], "lon": [0.0, 120.0, 240.0]})
+    data.attrs["offset"] = offset
+    data.to_zarr(store, mode="w")
+
+def write_store(path: str):
+    write_layout(path + ".zarr")
+    write_layout(path + ".ts.zarr")
+
+def test_describe_store(tmp_path):
+    path = str(tmp_path / "tas.nc")
+    write_store(path)
+    entry = describe_store(path)
+    assert entry["timeStart"] == 2000 and entry["timeEnd"] == 2003
+    assert entry["shape"] == [4, 2, 3] and entry["lon"] == [0.0, 120.0, 240.0]
+    assert store_layouts(path) == [path + ".ts.zarr", path + ".zarr"]
+    assert build_manifest([path, str(tmp_path / "missing.nc")])["stores"].keys() == {path}
+
+def test_rewriting_any_layout_invalidates_the_manifest(tmp_path):
+    path = str(tmp_path / "tas.nc")
+    write_store(path)
+    manifest_path = str(tmp_path / "manifest.json")
+    write_manifest([path], manifest_path)
+    manifest = load_manifest(manifest_path)
+    assert is_fresh(manifest[path], path)
+    assert store_version(path, manifest) == manifest[path]["checksum"]
+
+    # only the timeseries layout is rebuilt, the map store is untouched
+    write_layout(path + ".ts.zarr", offset=1.0)
+    assert not is_fresh(manifest[path], path)
+    assert store_version(path, manifest) != manifest[path]["checksum"]
+
+    write_manifest([path], manifest_path)
+    manifest = load_manifest(manifest_path)
+    assert is_fresh(manifest[path], path)
+    # so does adding a pyramid level
+    write_layout(path + ".l1.zarr")
+    assert not is_fresh(manifest[path], path)
+
+def test_manifest_of_another_version_is_ignored(tmp_path):
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text('{"version": 1, "stores": {"a": {}}}')
+    assert load_manifest(str(manifest_path)) == {}
+    assert load_manifest(str(tmp_path / "missing.json")) == {}
+
+REQUESTS = [
+    "/variables/tas/trend/cesm?startYear=1950&endYear=2000",
+    "/variables/tas/timeseries?lat=10&lon=20",
+    "/variables/tas/timeseries-area?n=10&s=-30&start=0&stop=60",
+    "/variables/tas/timeseries-batch?point=10,20&point=-40,100",
+]
+
+def test_rewritten_store_changes_every_response(main, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    generate(scale=0.05)
+    monkeypatch.setattr(main.store_versions, "manifest", load_manifest())
+    monkeypatch.setattr(main.store_versions, "_versions", {})
+    monkeypatch.setattr(main.store_versions, "ttl", 0)
+    client = TestClient(main.app)
+    before = [client.get(url).json() for url in REQUESTS]
+
+    # re-ingest one reconstruction on the same grid with different values
+    path = datasets["cesm"].variables["tas"]
+    options = ingest.IngestOptions()
+    data = synthetic_dataset("tas", "tas", scaled(GRIDS["cesm"], 0.05), seed=99)
+    ingest.write_layout(data, path + ".zarr", {"time": options.map_time_chunk, "lat": -1, "lon": -1}, options)
+    ingest.write_layout(data, path + ".ts.zarr", {"time": -1, "lat": options.series_space_chunk, "lon": options.series_space_chunk}, options)
+    ingest.write_pyramid(data, path, options)
+    after = [client.get(url).json() for url in REQUESTS]
+    assert all(old != new for old, new in zip(before, after))
+
+    # and nothing read before the rewrite was used, the answers match ones computed from scratch
+    registry.clear()
+    for name, engine in [("trends", TrendEngine()), ("climatologies", ClimatologyCache()), ("regions", RegionEngine()),
+                         ("nearest", NearestIndexEngine()), ("results", ResultCache(directory=None))]:
+        monkeypatch.setattr(main, name, engine)
+    assert [client.get(url).json() for url in REQUESTS] == after
+
+def test_store_versions_are_only_checked_once_per_ttl(tmp_path, monkeypatch):
+    path = str(tmp_path / "tas.nc")
+    write_store(path)
+    versions = StoreVersions(build_manifest([path])["stores"], ttl=3600)
+    checks = []
+    signature = manifest.store_signature
+    monkeypatch.setattr(manifest, "store_signature", lambda store: checks.append(store) or signature(store))
+    versions.refresh([path])
+    version = versions.get(path)
+    assert versions.get(path) == version and len(checks) == 1
+    write_layout(path + ".ts.zarr", offset=1.0)
+    assert versions.get(path) == version
+    # a stale version is checked again, as is every version after the manifest is reloaded
+    versions.ttl = 0
+    assert versions.get(path) != version
+    versions.ttl = 3600
+    versions.load(build_manifest([path])["stores"])
+    assert versions.get(path) == versions.get(path) != version
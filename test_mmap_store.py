@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import xarray as xr
+from mmap_store import open_mapped, read_mapped, write_mapped
+
+def make_dataset() -> xr.Dataset:
+    values = np.arange(2 * 3 * 4, dtype=np.float32).reshape(2, 3, 4)
+    dataset = xr.Dataset({"lon": ("lon", np.arange(4.0)), "psl": (("time", "lat", "lon"), values, {"units": "Pa"})},
+                         coords={"time": [2000, 2001], "lat": [-10.0, 0.0, 10.0]}, attrs={"source": "test"})
+    dataset["psl"].encoding = {"dtype": "float32", "chunks": (1, 3, 4)}
+    return dataset
+
+def test_round_trip_keeps_values_order_and_encoding(tmp_path):
+    dataset = make_dataset()
+    write_mapped(dataset, str(tmp_path / "copy"))
+    mapped = read_mapped(str(tmp_path / "copy"))
+    xr.testing.assert_identical(mapped, dataset)
+    assert list(mapped.sizes) == list(dataset.sizes)
+    assert mapped["psl"].encoding == {"dtype": "float32"}
+    # data variables are read only views of the file, coordinates are in memory
+    assert isinstance(mapped["psl"].variable._data, np.memmap)
+    assert not mapped["psl"].values.flags.writeable
+    assert not isinstance(mapped["lat"].values, np.memmap)
+
+def test_open_mapped_writes_each_version_once(tmp_path):
+    root = str(tmp_path)
+    calls = []
+    def source():
+        calls.append(1)
+        return make_dataset()
+    open_mapped(root, "./data/test/psl.nc", 0, "v1", source)
+    open_mapped(root, "./data/test/psl.nc", 0, "v1", source)
+    assert len(calls) == 1
+    mapped = open_mapped(root, "./data/test/psl.nc", 0, "v2", source)
+    assert len(calls) == 2
+    np.testing.assert_array_equal(mapped["psl"].values, make_dataset()["psl"].values)
+    # the copy of the old version is removed once the new one is written
+    assert len([name for name in os.listdir(root) if not name.endswith(".lock")]) == 1
@@ -0,0 +1,27 @@
+import numpy as np
+import xarray as xr
+from nearest import LATITUDES, LONGITUDES, NearestIndexEngine, build_nearest_index
+
+def make_data(lat: np.ndarray, lon: np.ndarray) -> xr.Dataset:
+    values = np.arange(3 * lat.size * lon.size, dtype=np.float64).reshape(3, lat.size, lon.size)
+    return xr.Dataset({"v": (("time", "lat", "lon"), values)}, coords={"time": [2000, 2001, 2002], "lat": lat, "lon": lon})
+
+def test_index_picks_the_same_cells_as_sel():
+    # descending gaussian like latitudes, and a grid whose cells tie between two integer points
+    for lat, lon in [(np.linspace(90, -90, 96), np.arange(0, 360, 1.875)), (np.arange(-89.0, 90, 2), np.arange(0.5, 360, 2))]:
+        index = build_nearest_index(lat, lon)
+        expected_lat = [int(np.flatnonzero(lat == lat_value)[0]) for lat_value in make_data(lat, lon).sel(lat=LATITUDES, method="nearest")["lat"].values]
+        expected_lon = [int(np.flatnonzero(lon == lon_value)[0]) for lon_value in make_data(lat, lon).sel(lon=LONGITUDES, method="nearest")["lon"].values]
+        np.testing.assert_array_equal(index.lat, expected_lat)
+        np.testing.assert_array_equal(index.lon, expected_lon)
+
+def test_point_and_points_match_sel():
+    data = make_data(np.linspace(-90, 90, 46), np.arange(0, 360, 7.5))
+    engine = NearestIndexEngine()
+    for lat, lon in [(-90, 0), (13, 359), (90, 180), (-1, 4)]:
+        assert engine.point("store", data, lat, lon).identical(data.sel(lat=lat, lon=lon, method="nearest"))
+    selected = engine.points("store", data, [13, -1], [359, 4])
+    expected = data.sel(lat=xr.DataArray([13, -1], dims="point"), lon=xr.DataArray([359, 4], dims="point"), method="nearest")
+    np.testing.assert_array_equal(selected["v"].values, expected["v"].values)
+    np.testing.assert_array_equal(selected["lat"].values, expected["lat"].values)
+    assert engine.stats()["entries"] == 1
@@ -0,0 +1,44 @@
+import json
+
+import numpy as np
+import pandas as pd
+from proxies import ProxyQuery, ProxyTable
+from region import Box
+
+def make_table() -> ProxyTable:
+    return ProxyTable(pd.DataFrame({
+        "id": ["a", "b", "c", "d", "e"],
+        "lat": [-75.0, 10.0, -70.0, 40.1, 40.0],
+        "lon": [175.0, 20.0, -100.0, -105.0, -105.1],
+        "type": ["Ice Cores", "Corals", "Ice Cores", "Tree Rings", "Tree Rings"],
+    }))
+
+def ids(table: ProxyTable, query: ProxyQuery) -> list:
+    rows, _ = table.select(query)
+    return [record["id"] for record in table.records(rows, ["id"])]
+
+def test_full_body_is_every_record():
+    table = make_table()
+    body = json.loads(table.full_body)
+    assert [record["id"] for record in body] == ["a", "b", "c", "d", "e"]
+    assert body[0] == {"id": "a", "lat": -75.0, "lon": 175.0, "type": "Ice Cores"}
+
+def test_box_wraps_around_the_dateline():
+    table = make_table()
+    # 170 east to 100 west, across the dateline
+    assert ids(table, ProxyQuery(box=Box(south=-80, north=-60, west=170, east=260))) == ["a", "c"]
+    assert ids(table, ProxyQuery(box=Box(south=-80, north=-60, west=265, east=170))) == []
+
+def test_radius_matches_great_circle_distance():
+    table = make_table()
+    assert ids(table, ProxyQuery(center=(40.0, -105.0), radius_km=20)) == ["d", "e"]
+    assert ids(table, ProxyQuery(center=(40.0, -105.0), radius_km=10)) == ["e"]
+    # near the pole a small radius spans many degrees of longitude
+    assert ids(table, ProxyQuery(center=(-90.0, 0.0), radius_km=2500)) == ["a", "c"]
+
+def test_types_and_paging():
+    table = make_table()
+    rows, total = table.select(ProxyQuery(types=("Ice Cores", "Tree Rings"), offset=1, limit=2))
+    assert total == 4
+    assert table.records(rows, ["id", "type"]) == [{"id": "c", "type": "Ice Cores"}, {"id": "d", "type": "Tree Rings"}]
+    assert np.array_equal(table.select(ProxyQuery(types=("Bivalve",)))[0], [])
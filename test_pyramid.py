@@ -0,0 +1,43 @@
+import numpy as np
+import xarray as xr
+from pyramid import coarsen
+from region import Box, box_indexers, cell_areas
+
+def make_dataset() -> xr.Dataset:
+    rng = np.random.default_rng(3)
+    lat = np.linspace(87.5, -87.5, 36)
+    lon = np.arange(0.0, 360.0, 5.0)
+    values = rng.normal(size=(3, lat.size, lon.size))
+    values[0, 5, 7] = np.nan
+    return xr.Dataset({"psl": (("time", "lat", "lon"), values)}, coords={"time": [2000, 2001, 2002], "lat": lat, "lon": lon})
+
+def test_coarsen_keeps_the_area_weighted_mean():
+    dataset = make_dataset().sortby("lat")
+    coarse = coarsen(dataset, 4)
+    assert coarse["psl"].shape == (3, 9, 18)
+    assert np.all(np.diff(coarse["lat"].values) > 0)
+    areas = cell_areas(dataset["lat"].values, dataset["lon"].values)
+    values = dataset["psl"].values
+    valid = ~np.isnan(values)
+    expected = (np.where(valid, values, 0) * areas).sum(axis=(1, 2)) / (valid * areas).sum(axis=(1, 2))
+    # each coarse cell stands for the valid area of the 4x4 fine cells it averages
+    weights = (valid * areas).reshape(3, 9, 4, 18, 4).sum(axis=(2, 4))
+    np.testing.assert_allclose((coarse["psl"].values * weights).sum(axis=(1, 2)) / weights.sum(axis=(1, 2)), expected, atol=1e-12)
+
+def test_coarsen_pads_uneven_edges():
+    coarse = coarsen(make_dataset().isel(lat=slice(0, 35), lon=slice(0, 70)), 4)
+    assert coarse["psl"].shape == (3, 9, 18)
+    assert not np.isnan(coarse["psl"].values[1:]).any()
+
+def test_box_indexers_wrap_around_the_dateline():
+    dataset = make_dataset()
+    indexers = box_indexers(dataset["lat"].values, dataset["lon"].values, Box(south=-20, north=20, west=350, east=10))
+    assert list(dataset["lon"].values[indexers["lon"]]) == [350.0, 355.0, 0.0, 5.0, 10.0]
+    lats = dataset["lat"].values[indexers["lat"]]
+    assert lats.min() >= -20 and lats.max() <= 20 and lats.size == 8
+
+def test_box_indexers_use_the_nearest_cell_of_an_empty_box():
+    dataset = make_dataset()
+    indexers = box_indexers(dataset["lat"].values, dataset["lon"].values, Box(south=1, north=2, west=1, east=2))
+    assert dataset["lat"].values[indexers["lat"]].tolist() == [2.5]
+    assert dataset["lon"].values[indexers["lon"]].tolist() == [0.0]
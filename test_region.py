@@ -0,0 +1,42 @@
+import numpy as np
+import xarray as xr
+from region import Box, build_summed_area_tables, cell_areas, region_mean
+
+def make_dataset() -> xr.Dataset:
+    rng = np.random.default_rng(2)
+    lat = np.linspace(90, -90, 19)  # descending, like ERA5
+    lon = np.arange(0, 360, 10.0)
+    values = rng.normal(size=(6, lat.size, lon.size))
+    return xr.Dataset({"psl": (("time", "lat", "lon"), values)},
+                      coords={"time": np.arange(2000, 2006), "lat": lat, "lon": lon})
+
+def brute_force_mean(dataset: xr.Dataset, lat_mask, lon_mask) -> np.ndarray:
+    dataset = dataset.sortby(["lat", "lon"])
+    areas = cell_areas(dataset["lat"].values, dataset["lon"].values)
+    mask = np.outer(lat_mask(dataset["lat"].values), lon_mask(dataset["lon"].values))
+    weights = areas * mask
+    return (dataset["psl"].values * weights).sum(axis=(1, 2)) / weights.sum()
+
+def test_cell_areas_cover_the_sphere():
+    areas = cell_areas(np.linspace(-90, 90, 19), np.arange(0, 360, 10.0))
+    assert np.isclose(areas.sum(), 4 * np.pi)
+
+def test_region_mean_matches_weighted_mean():
+    dataset = make_dataset()
+    tables = build_summed_area_tables(dataset)
+    result = region_mean(tables, Box(south=-80, north=-60, west=100, east=200))
+    expected = brute_force_mean(dataset, lambda lat: (lat >= -80) & (lat <= -60), lambda lon: (lon >= 100) & (lon <= 200))
+    np.testing.assert_allclose(result["psl"].values, expected)
+
+def test_region_mean_wraps_around_the_dateline():
+    dataset = make_dataset()
+    tables = build_summed_area_tables(dataset)
+    result = region_mean(tables, Box(south=-20, north=-10, west=350, east=20))
+    expected = brute_force_mean(dataset, lambda lat: (lat >= -20) & (lat <= -10), lambda lon: (lon >= 350) | (lon <= 20))
+    np.testing.assert_allclose(result["psl"].values, expected)
+
+def test_region_mean_uses_nearest_cell_for_small_boxes():
+    dataset = make_dataset()
+    tables = build_summed_area_tables(dataset)
+    result = region_mean(tables, Box(south=12, north=13, west=44, east=46))
+    np.testing.assert_allclose(result["psl"].values, dataset["psl"].sel(lat=10, lon=40).values)
@@ -0,0 +1,23 @@
+from results import ResultCache
+
+def test_result_cache_tiers(tmp_path):
+    calls = []
+    def compute(value):
+        calls.append(value)
+        return {"value": value}
+
+    cache = ResultCache(max_bytes=1024, directory=str(tmp_path), disk_max_bytes=1024)
+    first = cache.response(("trend", 1, "v1"), compute, 1, headers={"Vary": "Accept"})
+    assert cache.response(("trend", 1, "v1"), compute, 1).body == first.body
+    assert first.headers["vary"] == "Accept" and "etag" in first.headers
+    assert calls == [1]
+
+    # a new process only has the disk tier
+    restarted = ResultCache(max_bytes=1024, directory=str(tmp_path), disk_max_bytes=1024)
+    assert restarted.response(("trend", 1, "v1"), compute, 1).body == first.body
+    assert calls == [1]
+
+    # a new store version is a new key
+    restarted.response(("trend", 1, "v2"), compute, 1)
+    assert calls == [1, 1]
+    assert restarted.stats()["disk"]["hits"] == 1
@@ -0,0 +1,25 @@
+import numpy as np
+import xarray as xr
+from data_sets import datasets, instrumental
+from manifest import load_manifest
+from synthetic import SyntheticGrid, generate, synthetic_dataset
+
+def test_synthetic_dataset_shape():
+    data = synthetic_dataset("psl", "msl", SyntheticGrid(10, 20, 1950, 1999, descending_lat=True), seed=1)
+    assert data["msl"].dims == ("time", "lat", "lon") and data["msl"].shape == (50, 10, 20)
+    assert data["msl"].dtype == np.float32
+    assert data["lat"].values[0] == 90 and data["time"].values[-1] == 1999
+    assert 95000 < float(data["msl"].mean()) < 105000
+
+def test_generate_writes_both_layouts_and_manifest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    written = generate(scale=0.05)
+    paths = [path for dataset in [*datasets.values(), instrumental] for path in dataset.variables.values()]
+    assert written == paths
+    era5 = xr.open_dataset(instrumental.variables["psl"] + ".zarr", engine="zarr")
+    assert "msl" in era5 and era5["lat"].values[0] > era5["lat"].values[-1]
+    series = xr.open_dataset(datasets["cesm"].variables["tas"] + ".ts.zarr", engine="zarr")
+    assert series["tas"].encoding["chunks"][0] == series.sizes["time"]
+    assert set(load_manifest()) == set(paths)
+    # existing stores are never overwritten without force
+    assert generate(scale=0.05) == []
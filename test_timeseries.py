@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import xarray as xr
+from climatology import ClimatologyCache
+from data_sets import instrumental, variables
+from ingest import IngestOptions, write_layout
+from nearest import NearestIndexEngine
+from registry import SERIES_SUFFIX, registry
+from synthetic import generate
+
+POINTS = [(10, 20), (-45, -120), (80, 179)]
+MISSING_YEAR = 1990
+
+@pytest.fixture
+def missing_year(main, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    generate(scale=0.05)
+    # blank one ERA5 year, as the real files have for some cells
+    path = instrumental.variables["tas"]
+    options = IngestOptions()
+    with xr.open_dataset(path + SERIES_SUFFIX, engine="zarr") as data:
+        data = data.load()
+    data["t2m"].loc[{"time": MISSING_YEAR}] = np.nan
+    for var in data.variables.values():
+        var.encoding = {}
+    write_layout(data, path + SERIES_SUFFIX, {"time": -1, "lat": options.series_space_chunk, "lon": options.series_space_chunk}, options)
+    # the app opened the stores of the working directory it was imported from
+    registry.clear()
+    monkeypatch.setattr(main, "nearest", NearestIndexEngine())
+    monkeypatch.setattr(main, "climatologies", ClimatologyCache())
+    yield
+    registry.clear()
+
+def single(main, lat: int, lon: int) -> dict:
+    lon = main.to_degrees_east(lon)
+    def select_point(dataset: xr.Dataset, key) -> xr.Dataset:
+        return main.nearest.point(key, dataset, lat, lon)
+    return main.processTimeSeries(select_point, variables["tas"], "", 1950, 2000)
+
+def test_batch_matches_single_points_with_a_missing_year(main, missing_year):
+    batch = main.processTimeSeriesBatch(variables["tas"], POINTS, 1950, 2000)
+    assert len(batch["points"]) == len(POINTS)
+    for (lat, lon), point in zip(POINTS, batch["points"]):
+        expected = single(main, lat, lon)["values"]
+        series = point["values"]
+        assert [s["name"] for s in series] == [s["name"] for s in expected]
+        era5 = series[0]["data"]
+        assert np.isnan(era5[era5[:, 0] == MISSING_YEAR, 1]).all()
+        assert not np.isnan(np.delete(era5[:, 1], np.flatnonzero(era5[:, 0] == MISSING_YEAR))).any()
+        for got, want in zip(series, expected):
+            assert (got["gridLat"], got["gridLon"]) == (want["gridLat"], want["gridLon"])
+            np.testing.assert_allclose(got["data"], want["data"], atol=1e-4, equal_nan=True)
@@ -0,0 +1,38 @@
+import contextvars
+import numpy as np
+import xarray as xr
+from timing import CountingStore, Metrics, begin, stage
+
+def test_stages_add_up_and_read_bytes_are_counted(tmp_path):
+    xr.Dataset({"psl": (("time", "lat"), np.ones((10, 4)))}, coords={"time": np.arange(10), "lat": np.arange(4.0)}).to_zarr(tmp_path / "psl.zarr")
+
+    def request():
+        timings = begin()
+        for _ in range(2):
+            with stage("select"):
+                dataset = xr.open_dataset(CountingStore(str(tmp_path / "psl.zarr"), read_only=True), engine="zarr")
+                dataset["psl"].values
+        return timings
+
+    timings = contextvars.copy_context().run(request)
+    assert list(timings.stages) == ["select"] and timings.stages["select"] > 0
+    assert timings.bytes_read > 0
+    header = timings.header(0.5)
+    assert header.startswith("select;dur=") and header.endswith("total;dur=500.0") and "bytes" in header
+
+def test_stage_without_request_is_a_no_op():
+    with stage("select"):
+        pass
+
+def test_metrics_render_cumulative_histograms():
+    metrics = Metrics()
+    for seconds in (0.002, 0.2):
+        timings = contextvars.copy_context().run(begin)
+        timings.record("trend", seconds)
+        timings.add_bytes(100)
+        metrics.observe(timings, "/variables/{id}/trend/{dataset_id}", 200, seconds)
+    text = metrics.render()
+    assert 'pv_stage_duration_seconds_bucket{route="/variables/{id}/trend/{dataset_id}",stage="trend",le="0.0025"} 1' in text
+    assert 'pv_stage_duration_seconds_bucket{route="/variables/{id}/trend/{dataset_id}",stage="trend",le="+Inf"} 2' in text
+    assert 'pv_store_read_bytes_total{route="/variables/{id}/trend/{dataset_id}"} 200' in text
+    assert 'pv_requests_total{route="/variables/{id}/trend/{dataset_id}",status="200"} 2' in text
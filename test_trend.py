@@ -0,0 +1,50 @@
+import numpy as np
+import xarray as xr
+from trend import build_prefix_sums, window_slope, window_slopes
+
+def make_data(missing: bool = False) -> xr.DataArray:
+    rng = np.random.default_rng(1)
+    values = rng.normal(size=(120, 4, 5)).cumsum(axis=0) + 1000
+    if missing:
+        values[rng.random(values.shape) < 0.1] = np.nan
+    return xr.DataArray(values, dims=("time", "lat", "lon"), coords={
+        "time": np.arange(1886, 2006), "lat": np.arange(4.0), "lon": np.arange(5.0)})
+
+def polyfit_slope(data: xr.DataArray, start: int, end: int) -> np.ndarray:
+    return data.sel(time=slice(start, end)).polyfit(dim="time", deg=1).polyfit_coefficients.sel(degree=1).values
+
+def test_window_slope_matches_polyfit():
+    data = make_data()
+    sums = build_prefix_sums(data)
+    for start, end in [(1886, 2005), (1900, 1930), (1979, 1981)]:
+        np.testing.assert_allclose(window_slope(sums, start, end).values, polyfit_slope(data, start, end), atol=1e-9)
+
+def test_window_slope_skips_missing_values():
+    data = make_data(missing=True)
+    sums = build_prefix_sums(data)
+    np.testing.assert_allclose(window_slope(sums, 1950, 2000).values, polyfit_slope(data, 1950, 2000), atol=1e-9)
+
+def test_window_slope_of_a_subset_matches_the_full_grid():
+    data = make_data()
+    sums = build_prefix_sums(data)
+    indexers = {"lat": np.array([3, 1]), "lon": np.array([4, 0])}
+    subset = window_slope(sums, 1900, 1950, indexers)
+    np.testing.assert_array_equal(subset.values, window_slope(sums, 1900, 1950).isel(indexers).values)
+    np.testing.assert_array_equal(subset["lat"].values, [3.0, 1.0])
+
+def test_window_slopes_match_each_window():
+    for missing in (False, True):
+        data = make_data(missing)
+        sums = build_prefix_sums(data)
+        ends = np.arange(1915, 2006)
+        slopes = window_slopes(sums, ends - 29, ends)
+        assert slopes.shape == (ends.size, 4, 5)
+        for index in (0, 40, ends.size - 1):
+            np.testing.assert_allclose(slopes[index], window_slope(sums, ends[index] - 29, ends[index]).values, atol=1e-12)
+
+def test_window_slopes_of_a_series_match_polyfit():
+    data = make_data().isel(lat=2, lon=3, drop=True)
+    sums = build_prefix_sums(data)
+    ends = np.arange(1895, 2006)
+    expected = [np.polyfit(np.arange(end - 9, end + 1), data.sel(time=slice(end - 9, end)).values, 1)[0] for end in ends]
+    np.testing.assert_allclose(window_slopes(sums, ends - 9, ends), expected, atol=1e-9)
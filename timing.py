@@ -0,0 +1,182 @@
+# per request stage timings, sent back as a Server-Timing header and aggregated for /metrics
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from zarr.storage import LocalStore
+
+from settings import TIMING_ENABLED
+
+# upper bounds in seconds of the histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class RequestTimings:
+    """
+    The time a request spent in each stage and the bytes it read from stores. Stages are recorded
+    from the event loop, the compute pools and zarr's io loop, so updates are locked.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.bytes_read = 0
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_bytes(self, count: int):
+        with self._lock:
+            self.bytes_read += count
+
+    def header(self, total: float) -> str:
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        if self.bytes_read:
+            parts.append(f'read;desc="{self.bytes_read} bytes"')
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def begin() -> Optional[RequestTimings]:
+    """
+    Starts collecting timings for the request running in the current context, or returns None if
+    timing is turned off.
+    """
+    if not TIMING_ENABLED:
+        return None
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Adds the time spent inside the block to a stage of the current request. Stages entered more
+    than once per request add up.
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.record(name, time.perf_counter() - started)
+
+
+def record(name: str, seconds: float):
+    timings = _current.get()
+    if timings is not None:
+        timings.record(name, seconds)
+
+
+class CountingStore(LocalStore):
+    """
+    A local zarr store that adds the size of every chunk and metadata document it reads to the
+    current request.
+    """
+
+    async def get(self, key, prototype, byte_range=None):
+        buffer = await super().get(key, prototype, byte_range)
+        timings = _current.get()
+        if timings is not None and buffer is not None:
+            timings.add_bytes(len(buffer))
+        return buffer
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def format_labels(labels: Labels, **extra: str) -> str:
+    pairs = [*labels, *extra.items()]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}" if pairs else ""
+
+
+class Metrics:
+    """
+    Aggregates request timings into histograms and counters per route, rendered in the Prometheus
+    text format.
+    """
+
+    HELP = {
+        "pv_request_duration_seconds": ("histogram", "Time until the response headers were ready."),
+        "pv_stage_duration_seconds": ("histogram", "Time a request spent in each stage."),
+        "pv_store_read_bytes_total": ("counter", "Bytes read from zarr stores."),
+        "pv_requests_total": ("counter", "Requests answered."),
+    }
+
+    def __init__(self):
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], int] = {}
+        self._lock = threading.Lock()
+
+    def _observe(self, name: str, labels: Labels, value: float):
+        histogram = self._histograms.get((name, labels))
+        if histogram is None:
+            histogram = self._histograms[(name, labels)] = Histogram()
+        histogram.observe(value)
+
+    def _increment(self, name: str, labels: Labels, value: int = 1):
+        self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+
+    def observe(self, timings: RequestTimings, route: str, status: int, total: float):
+        """
+        Adds one finished request.
+
+        :param route: The route template the request matched, so label values stay bounded.
+        """
+        with self._lock:
+            self._observe("pv_request_duration_seconds", (("route", route),), total)
+            for name, seconds in timings.stages.items():
+                self._observe("pv_stage_duration_seconds", (("route", route), ("stage", name)), seconds)
+            self._increment("pv_store_read_bytes_total", (("route", route),), timings.bytes_read)
+            self._increment("pv_requests_total", (("route", route), ("status", str(status))))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (kind, description) in self.HELP.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for (metric, labels), value in self._counters.items():
+                        if metric == name:
+                            lines.append(f"{name}{format_labels(labels)} {value}")
+                    continue
+                for (metric, labels), histogram in self._histograms.items():
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(labels, le=f'{bound:g}')} {cumulative}")
+                    lines.append(f"{name}_bucket{format_labels(labels, le='+Inf')} {histogram.count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
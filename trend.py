@@ -0,0 +1,171 @@
+# closed form least squares trends from prefix sums along time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+import xarray as xr
+
+from lru import SizedLRU
+from manifest import store_versions
+from registry import registry
+from settings import TREND_CACHE_BYTES
+from timing import stage
+from util import get_first_key
+
+
+@dataclass
+class PrefixSums:
+    """
+    Cumulative sums along time of a reconstruction, index i covering the first i time steps.
+    Values are centred on their per cell mean and times on their midpoint before summing. The
+    count and time sums are 1-D unless the data has missing values.
+    """
+    time: np.ndarray
+    template: xr.DataArray  # first time step, carries the grid coordinates of the output
+    t0: float
+    sum_y: np.ndarray
+    sum_ty: np.ndarray
+    count: np.ndarray
+    sum_t: np.ndarray
+    sum_tt: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.sum_y, self.sum_ty, self.count, self.sum_t, self.sum_tt))
+
+
+def _cumulative(values: np.ndarray) -> np.ndarray:
+    result = np.zeros((values.shape[0] + 1,) + values.shape[1:], dtype=np.float64)
+    np.cumsum(values, axis=0, out=result[1:])
+    return result
+
+
+def build_prefix_sums(data: xr.DataArray) -> PrefixSums:
+    """
+    Precomputes the cumulative sums of y and t·y along time for a data array.
+
+    :param data: The data array to fit, it must have a time dimension.
+    """
+    data = data.transpose("time", ...)
+    time = np.asarray(data["time"].values, dtype=np.float64)
+    t0 = (time[0] + time[-1]) / 2
+    t = (time - t0).reshape((-1,) + (1,) * (data.ndim - 1))
+    values = np.asarray(data.values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    if valid.all():
+        values = values - values.mean(axis=0)
+        count = _cumulative(np.ones_like(time))
+        sum_t = _cumulative(t.ravel())
+        sum_tt = _cumulative(t.ravel() ** 2)
+    else:
+        with np.errstate(invalid="ignore"):
+            values = np.where(valid, values - np.nanmean(values, axis=0), 0.0)
+        count = _cumulative(valid.astype(np.float64))
+        sum_t = _cumulative(valid * t)
+        sum_tt = _cumulative(valid * t ** 2)
+    return PrefixSums(
+        time=np.asarray(data["time"].values),
+        template=data.isel(time=0, drop=True),
+        t0=t0,
+        sum_y=_cumulative(values),
+        sum_ty=_cumulative(values * t),
+        count=count,
+        sum_t=sum_t,
+        sum_tt=sum_tt,
+    )
+
+
+def _slope(sums: PrefixSums, window: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+    # least squares slope from the sums over a window, window(prefix) differences each prefix sum
+    n = window(sums.count)
+    sum_t = window(sums.sum_t)
+    sum_y = window(sums.sum_y)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covariance = window(sums.sum_ty) - sum_t * sum_y / n
+        variance = window(sums.sum_tt) - sum_t ** 2 / n
+        slope = covariance / variance
+    return np.where(n >= 2, slope, np.nan)
+
+
+def window_slope(sums: PrefixSums, startYear: int, endYear: int, indexers: Optional[dict] = None) -> xr.DataArray:
+    """
+    Returns the least squares slope per year of every grid cell over the years startYear to
+    endYear inclusive, the same value polyfit(dim='time', deg=1) gives for that window.
+
+    :param indexers: Only compute the cells picked by these isel style index arrays per dimension.
+    """
+    start = np.searchsorted(sums.time, startYear, side="left")
+    end = np.searchsorted(sums.time, endYear, side="right")
+    template = sums.template
+    cells = ...
+    if indexers:
+        template = template.isel(indexers)
+        cells = np.ix_(*(np.asarray(indexers.get(dim, np.arange(size))) for dim, size in sums.template.sizes.items()))
+
+    def window(prefix: np.ndarray) -> np.ndarray:
+        if prefix.ndim == 1:
+            return prefix[end] - prefix[start]
+        return prefix[end][cells] - prefix[start][cells]
+
+    slope = _slope(sums, window)
+    return template.copy(data=np.broadcast_to(slope, template.shape).copy())
+
+
+def window_slopes(sums: PrefixSums, startYears: np.ndarray, endYears: np.ndarray) -> np.ndarray:
+    """
+    Returns the least squares slopes per year of many windows at once, one row per window with
+    the shape of the grid after it.
+
+    :param startYears: The first year of each window.
+    :param endYears: The last year of each window, inclusive.
+    """
+    starts = np.searchsorted(sums.time, startYears, side="left")
+    ends = np.searchsorted(sums.time, endYears, side="right")
+    grid = (1,) * sums.template.ndim
+
+    def window(prefix: np.ndarray) -> np.ndarray:
+        difference = prefix[ends] - prefix[starts]
+        # shared 1-D sums broadcast against the grid of each window
+        return difference.reshape((-1,) + grid) if prefix.ndim == 1 else difference
+
+    slope = _slope(sums, window)
+    return np.broadcast_to(slope, (len(starts),) + sums.template.shape).copy()
+
+
+class TrendEngine:
+    """
+    Answers trend requests for any window from the prefix sums of each store.
+
+    :param max_bytes: The memory budget of the prefix sums in bytes.
+    """
+
+    def __init__(self, max_bytes: int = TREND_CACHE_BYTES):
+        self._sums = SizedLRU(max_bytes)
+
+    def prefix_sums(self, path: str, level: int = 0) -> PrefixSums:
+        def create():
+            dataset = registry.open(path, level=level).squeeze()
+            with stage("prefix-sums"):
+                sums = build_prefix_sums(dataset[get_first_key(dataset.keys())])
+            return sums, sums.nbytes
+        return self._sums.get_or_create((path, level, store_versions.get(path)), create)
+
+    def slope(self, path: str, startYear: int, endYear: int, level: int = 0, indexers: Optional[dict] = None) -> xr.DataArray:
+        """
+        Returns the trend map of a store over a window of years.
+
+        :param path: The path of the .nc file as listed in data_sets.py.
+        :param startYear: The first year of the window.
+        :param endYear: The last year of the window.
+        :param level: The pyramid level of the store, 0 is the full grid.
+        :param indexers: Only return the cells picked by these isel style index arrays.
+        """
+        sums = self.prefix_sums(path, level)
+        with stage("trend"):
+            return window_slope(sums, startYear, endYear, indexers)
+
+    def stats(self) -> dict:
+        return self._sums.stats()
+
+
+trends = TrendEngine()